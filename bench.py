@@ -0,0 +1,398 @@
+""" Headless benchmarks of the game's hot paths.
+
+Every benchmark uses a fixed seed and a scripted player, so two runs on the
+same machine do the same work. Results are written as JSON and can be
+compared against a stored baseline:
+
+    python bench.py --output bench.json
+    python bench.py --baseline bench.json
+
+Each benchmark reports its throughput, the p50 and p99 latency of one
+operation, and the peak memory it allocated. Memory is measured in a second,
+untimed run, since tracing allocations slows everything down.
+
+"""
+
+from __future__ import division
+
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from chunks import CHUNK_SIZE
+from generation import generate_chunk
+from lod import build_lod_mesh
+from terrain import STAGES, TerrainGenerator
+from mesher import (build_section_mesh, build_greedy_mesh, face_bytes,
+    VERTEX_FORMAT, ATLAS_FORMAT, TILED_FORMAT)
+from physics import move
+from raycast import raycast, raycast_many
+from world import Model, TERRAIN, TICKS_PER_SEC, sectorize
+
+# Seed of the terrain and of the random rays and moves.
+SEED = 1234
+
+# Speed of the scripted player in blocks per second; the in-game flying
+# speed.
+FLIGHT_SPEED = 15
+
+# Highest the terrain surface can be, for placing the scripted player and
+# rays above it.
+SURFACE = TERRAIN.base + TERRAIN.amplitude
+
+# A benchmark whose throughput drops by more than this fraction of the
+# baseline counts as a regression.
+TOLERANCE = 0.1
+
+
+class Samples(object):
+    """ Durations of repeated runs of one operation.
+
+    """
+
+    def __init__(self):
+        self.times = []
+
+    def time(self, func, *args):
+        """ Call `func(*args)`, record how long it took and return its
+        result.
+
+        """
+        start = time.perf_counter()
+        result = func(*args)
+        self.times.append(time.perf_counter() - start)
+        return result
+
+    def percentile(self, p):
+        """ Return the `p`th percentile duration in milliseconds.
+
+        """
+        if not self.times:
+            return 0.0
+        times = sorted(self.times)
+        index = min(len(times) - 1, int(math.ceil(p / 100 * len(times))) - 1)
+        return times[max(index, 0)] * 1000
+
+    def summary(self, count=None, unit='ops'):
+        """ Return the throughput and latency of the samples as a dict.
+
+        Parameters
+        ----------
+        count : int
+            Number of items processed, if not one per sample.
+        unit : str
+            What the items are, e.g. 'chunks' or 'rays'.
+
+        """
+        total = sum(self.times)
+        count = len(self.times) if count is None else count
+        return {
+            'unit': unit,
+            'count': count,
+            'throughput': count / total if total else 0.0,
+            'p50_ms': self.percentile(50),
+            'p99_ms': self.percentile(99),
+        }
+
+
+def new_model(path, seed):
+    """ Return a headless model with a fresh world in `path`, generating
+    chunks on the calling thread.
+
+    """
+    terrain = TERRAIN._replace(seed=seed)
+    model = Model(path=path, terrain=terrain, workers=0)
+    model.process_entire_queue()
+    return model
+
+
+def bench_generate(args):
+    """ Generate the terrain of a square of chunks, and time each stage of
+    the generator on its own.
+
+    """
+    terrain = TERRAIN._replace(seed=args.seed)
+    n = int(math.ceil(math.sqrt(args.chunks)))
+    samples = Samples()
+    for x in range(n):
+        for z in range(n):
+            samples.time(generate_chunk, terrain, (x, z))
+    results = {'generate': samples.summary(unit='chunks')}
+    generator = TerrainGenerator(terrain)
+    for x in range(n):
+        for z in range(n):
+            generator.generate((x, z))
+            generator.decorate((x, z))
+    for stage in STAGES:
+        samples = Samples()
+        samples.times = list(generator.timings[stage])
+        results['generate_' + stage] = samples.summary(unit='chunks')
+    return results
+
+
+def bench_lod(args):
+    """ Build the level of detail meshes of a square of chunks.
+
+    """
+    terrain = TERRAIN._replace(seed=args.seed)
+    n = int(math.ceil(math.sqrt(args.chunks)))
+    samples = Samples()
+    for x in range(n):
+        for z in range(n):
+            samples.time(build_lod_mesh, terrain, (x, z))
+    return {'lod': samples.summary(unit='chunks')}
+
+
+def bench_mesh(args, path):
+    """ Build naive and greedy meshes of every visible section around the
+    spawn point, and report the size of the vertex data they upload.
+
+    """
+    model = new_model(path, args.seed)
+    sections = [section for key in sorted(model.loaded_chunks)
+                for section in model.world.visible_sections(key)]
+    results = {}
+    for name, build, texture_format in (
+            ('mesh_naive', build_section_mesh, ATLAS_FORMAT),
+            ('mesh_greedy', build_greedy_mesh, TILED_FORMAT)):
+        samples = Samples()
+        faces = 0
+        for key in sections:
+            vertices, _ = samples.time(build, model.world, key)
+            faces += len(vertices) // 12
+        results[name] = samples.summary(unit='sections')
+        size = face_bytes(VERTEX_FORMAT, texture_format)
+        results[name]['bytes_per_face'] = size
+        results[name]['mesh_kb'] = faces * size / 1024
+    model.close()
+    return results
+
+
+def bench_flight(args, path):
+    """ Fly in a straight line across `args.chunks` chunks, running the
+    same per-tick work as `Window.update()`, and time each phase.
+
+    """
+    model = new_model(path, args.seed)
+    dt = 1.0 / TICKS_PER_SEC
+    position = (0.5, SURFACE + 8.0, 0.5)
+    vector = (1.0, -0.5, 0.0)
+    sector = None
+    ticks = int(args.chunks * CHUNK_SIZE / (FLIGHT_SPEED * dt))
+    phases = dict((name, Samples()) for name in (
+        'check_chunks', 'process_generated', 'change_sectors',
+        'process_queue', 'collide', 'hit_test'))
+    tick = Samples()
+    loaded = 0
+    for _ in range(ticks):
+        start = time.perf_counter()
+        model.queue.set_focus(position, vector)
+        before = len(model.loaded_chunks)
+        phases['process_generated'].time(model.process_generated)
+        loaded += len(model.loaded_chunks) - before
+        phases['process_queue'].time(model.process_entire_queue)
+        new_sector = sectorize(position)
+        if new_sector != sector:
+            phases['change_sectors'].time(
+                model.change_sectors, sector, new_sector)
+            sector = new_sector
+        position, _ = phases['collide'].time(
+            move, model.world, position, (FLIGHT_SPEED * dt, 0, 0), 1)
+        phases['hit_test'].time(model.hit_test, position, vector)
+        phases['check_chunks'].time(
+            model.check_chunks, position[0], position[2])
+        tick.times.append(time.perf_counter() - start)
+    results = dict(('flight_' + name, samples.summary())
+                   for name, samples in phases.items())
+    results['flight_tick'] = tick.summary(unit='ticks')
+    # Chunks added to the world per second of time spent generating and
+    # adding them.
+    chunks = Samples()
+    chunks.times = phases['check_chunks'].times + phases['process_generated'].times
+    results['flight_chunks'] = chunks.summary(count=loaded, unit='chunks')
+    model.close()
+    return results
+
+
+def bench_churn(args, path):
+    """ Unload chunks into the chunk cache and load them back again.
+
+    """
+    model = new_model(path, args.seed)
+    keys = sorted(model.loaded_chunks)
+    unload = Samples()
+    load = Samples()
+    for _ in range(max(1, args.chunks // len(keys))):
+        for key in keys:
+            unload.time(model.unload_chunk, key)
+        for key in keys:
+            load.time(model.load_chunk, key)
+    model.close()
+    return {
+        'unload_chunk': unload.summary(unit='chunks'),
+        'load_chunk': load.summary(unit='chunks'),
+    }
+
+
+def bench_raycast(args, path):
+    """ Cast random rays down at the terrain around the spawn point, one at
+    a time and as a batch.
+
+    """
+    model = new_model(path, args.seed)
+    rng = np.random.RandomState(args.seed)
+    reach = CHUNK_SIZE * 3
+    origins = np.column_stack([
+        rng.uniform(-reach, reach, args.rays),
+        rng.uniform(SURFACE, SURFACE + 8, args.rays),
+        rng.uniform(-reach, reach, args.rays),
+    ])
+    vectors = rng.normal(size=(args.rays, 3))
+    vectors[:, 1] = -abs(vectors[:, 1])
+    vectors /= np.linalg.norm(vectors, axis=1)[:, None]
+    single = Samples()
+    for origin, vector in zip(origins.tolist(), vectors.tolist()):
+        single.time(raycast, model.world, origin, vector)
+    batch = Samples()
+    for start in range(0, args.rays, args.batch):
+        batch.time(raycast_many, model.world,
+                   origins[start:start + args.batch],
+                   vectors[start:start + args.batch])
+    model.close()
+    return {
+        'raycast': single.summary(unit='rays'),
+        'raycast_many': batch.summary(count=args.rays, unit='rays'),
+    }
+
+
+def bench_collide(args, path):
+    """ Move the player by random amounts over the terrain around the spawn
+    point.
+
+    """
+    model = new_model(path, args.seed)
+    rng = random.Random(args.seed)
+    samples = Samples()
+    position = (0.5, SURFACE + 4.0, 0.5)
+    for _ in range(args.moves):
+        motion = (rng.uniform(-1, 1), rng.uniform(-2, 1), rng.uniform(-1, 1))
+        position, _ = samples.time(move, model.world, position, motion, 2)
+        if max(abs(position[0]), abs(position[2])) > CHUNK_SIZE * 2:
+            position = (0.5, SURFACE + 4.0, 0.5)
+    model.close()
+    return {'collide': samples.summary(unit='moves')}
+
+
+BENCHMARKS = [
+    ('generate', bench_generate, False),
+    ('lod', bench_lod, False),
+    ('mesh', bench_mesh, True),
+    ('flight', bench_flight, True),
+    ('churn', bench_churn, True),
+    ('raycast', bench_raycast, True),
+    ('collide', bench_collide, True),
+]
+
+
+def run(args):
+    """ Run the selected benchmarks and return their results as a dict.
+
+    """
+    results = {}
+    for name, bench, needs_world in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        print('running %s...' % name, file=sys.stderr)
+        for memory in (False, True) if args.memory else (False,):
+            with tempfile.TemporaryDirectory() as path:
+                if memory:
+                    tracemalloc.start()
+                out = bench(args, path) if needs_world else bench(args)
+                if memory:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    for key in out:
+                        results[key]['peak_kb'] = peak / 1024
+                else:
+                    results.update(out)
+    return {
+        'meta': {
+            'seed': args.seed,
+            'chunks': args.chunks,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """ Print each result next to its baseline.
+
+    Returns
+    -------
+    regressions : list of str
+        Names of the benchmarks whose throughput dropped by more than
+        `tolerance`.
+
+    """
+    regressions = []
+    print('%-24s %14s %14s %8s' % ('benchmark', 'throughput', 'baseline', 'change'))
+    for name, result in sorted(report['results'].items()):
+        base = baseline['results'].get(name)
+        line = '%-24s %10.1f/s %-3s' % (name, result['throughput'], '')
+        if base is None or not base['throughput']:
+            print(line)
+            continue
+        change = result['throughput'] / base['throughput'] - 1
+        flag = ''
+        if change < -tolerance:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print('%s%12.1f/s %+7.1f%%%s' % (line, base['throughput'], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--chunks', type=int, default=32,
+                        help='chunks to fly across and to generate')
+    parser.add_argument('--rays', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=500,
+                        help='rays per raycast_many() call')
+    parser.add_argument('--moves', type=int, default=5000)
+    parser.add_argument('--only', nargs='*',
+                        choices=[name for name, _, _ in BENCHMARKS])
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip measuring peak memory')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare against this file')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+    elif not args.output:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
+from array import array
+
+
 def tex_coords(top, bottom, side):
     """ Return a list of the texture squares for the top, bottom and side.
 
@@ -21,11 +24,103 @@ def tex_coord(x, y, n=16):
     return dx, dy, dx + m, dy, dx + m, dy + m, dx, dy + m
 
 
-GRASS = tex_coords((1, 0), (0, 1), (0, 0)) #top bottom sides
-SAND = tex_coords((1, 1), (1, 1), (1, 1))
-BRICK = tex_coords((2, 0), (2, 0), (2, 0))
-STONE = tex_coords((2, 1), (2, 1), (2, 1))
-END_PORTAL_FRAME = tex_coords((1, 2), (2, 2), (0, 2))
-CRAFTING_TABLE = tex_coords((0, 3), (0,3),(1,3))
-OBSIDIAN = tex_coords((3, 0), (3,0),(3,0))
-DIAMOND_ORE = tex_coords((3, 2), (3,2),(3,2))
\ No newline at end of file
+# Number of texture coordinates (u, v pairs for 24 vertices) per block.
+UV_STRIDE = 48
+
+# Number of squares along each side of the texture atlas.
+ATLAS_SIZE = 16
+
+
+def tex_layer(x, y, n=ATLAS_SIZE):
+    """ Return the layer of the texture square at x, y when the atlas is
+    loaded as a texture array, one square per layer.
+
+    """
+    return y * n + x
+
+
+class Block(object):
+    """ The static properties of one kind of block.
+
+    Parameters
+    ----------
+    id : int
+        The block's index in `BLOCKS`. This is what the world stores.
+    name : str
+    top, bottom, side : tuple of len 2
+        The (x, y) squares of the texture atlas used for each face.
+    solid : bool
+        Whether the player collides with the block.
+    transparent : bool
+        Whether faces behind the block can be seen.
+    breakable : bool
+        Whether the player can remove the block.
+    gui : bool
+        Whether the block opens a GUI, so blocks cannot be placed against it.
+
+    """
+
+    def __init__(self, id, name, top, bottom, side, solid=True,
+                 transparent=False, breakable=True, gui=False):
+        self.id = id
+        self.name = name
+        self.top = top
+        self.bottom = bottom
+        self.side = side
+        self.solid = solid
+        self.transparent = transparent
+        self.breakable = breakable
+        self.gui = gui
+
+    def __repr__(self):
+        return 'Block(%d, %r)' % (self.id, self.name)
+
+
+# All registered blocks, indexed by id.
+BLOCKS = []
+
+# Mapping from block name to id.
+BLOCK_IDS = {}
+
+# Texture coordinates of every block, `UV_STRIDE` floats per id, in the same
+# face order as `cube_vertices()`.
+UV_TABLE = array('f')
+
+# Texture array layer of each face of every block, 6 per id in the same face
+# order as `UV_TABLE`.
+LAYER_TABLE = bytearray()
+
+# 1 for the id of every opaque block and 0 otherwise, padded to all 256 byte
+# values so it can be used with `bytes.translate()`.
+OPAQUE = bytearray(256)
+
+
+def register_block(name, top=None, bottom=None, side=None, **properties):
+    """ Register a new kind of block and return its integer id.
+
+    """
+    if len(BLOCKS) > 255:
+        raise ValueError('Block ids must fit in a byte')
+    id = len(BLOCKS)
+    block = Block(id, name, top, bottom, side, **properties)
+    BLOCKS.append(block)
+    BLOCK_IDS[name] = id
+    if top is None:
+        UV_TABLE.extend([0.0] * UV_STRIDE)
+        LAYER_TABLE.extend(bytes(6))
+    else:
+        UV_TABLE.extend(tex_coords(top, bottom, side))
+        LAYER_TABLE.extend([tex_layer(*top), tex_layer(*bottom)] + [tex_layer(*side)] * 4)
+    OPAQUE[id] = not block.transparent
+    return id
+
+
+AIR = register_block('air', solid=False, transparent=True, breakable=False)
+GRASS = register_block('grass', (1, 0), (0, 1), (0, 0)) #top bottom sides
+SAND = register_block('sand', (1, 1), (1, 1), (1, 1))
+BRICK = register_block('brick', (2, 0), (2, 0), (2, 0))
+STONE = register_block('stone', (2, 1), (2, 1), (2, 1), breakable=False)
+END_PORTAL_FRAME = register_block('end_portal_frame', (1, 2), (2, 2), (0, 2))
+CRAFTING_TABLE = register_block('crafting_table', (0, 3), (0,3),(1,3), gui=True)
+OBSIDIAN = register_block('obsidian', (3, 0), (3,0),(3,0))
+DIAMOND_ORE = register_block('diamond_ore', (3, 2), (3,2),(3,2))
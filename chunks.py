@@ -0,0 +1,636 @@
+""" Array-backed block storage.
+
+The world is split into columns of CHUNK_SIZE x CHUNK_SIZE blocks, and each
+column into SECTION_SIZE-tall cubic sections. Instead of keeping a dict entry
+(and a position tuple) for every block, each section keeps its blocks in one
+dense bytearray of small integer ids, where 0 is air. Sections that are all
+air are not stored at all, so memory follows the terrain rather than the
+world height.
+
+"""
+
+import math
+import zlib
+
+from collections import OrderedDict
+
+import numpy as np
+
+from blocks import AIR, OPAQUE
+
+CHUNK_SIZE = 16
+WORLD_HEIGHT = 320
+
+# Height of a section. Sections are cubes.
+SECTION_SIZE = CHUNK_SIZE
+
+# Number of blocks in one horizontal layer of a chunk, and in one section.
+LAYER_AREA = CHUNK_SIZE * CHUNK_SIZE
+SECTION_VOLUME = LAYER_AREA * SECTION_SIZE
+
+# Number of sections in a chunk.
+SECTIONS = WORLD_HEIGHT // SECTION_SIZE
+
+# Serialized chunks start with this version byte. Each section then follows as
+# a tag byte: _EMPTY for all air, _UNIFORM followed by the one block id it is
+# made of, or _RAW followed by its whole block array.
+FORMAT_VERSION = 2
+_EMPTY, _UNIFORM, _RAW = 0, 1, 2
+
+
+def chunk_key(position):
+    """ Returns the (x, z) key of the chunk column containing `position`.
+
+    Parameters
+    ----------
+    position : tuple of len 3
+
+    Returns
+    -------
+    key : tuple of len 2
+
+    """
+    return (position[0] // CHUNK_SIZE, position[2] // CHUNK_SIZE)
+
+
+def section_key(position):
+    """ Returns the (x, y, z) key of the section containing `position`.
+
+    """
+    x, y, z = position
+    return (x // CHUNK_SIZE, y // SECTION_SIZE, z // CHUNK_SIZE)
+
+
+class Section(object):
+    """ A CHUNK_SIZE x SECTION_SIZE x CHUNK_SIZE cube of blocks, stored layer
+    by layer (y, then z, then x).
+
+    Parameters
+    ----------
+    blocks : bytes or None
+        The block array, or None for all air.
+
+    """
+
+    __slots__ = ('blocks', 'count', 'opaque', 'connectivity')
+
+    def __init__(self, blocks=None):
+        # One byte per block, indexed by `Chunk.index()` with a local y.
+        self.blocks = bytearray(SECTION_VOLUME if blocks is None else blocks)
+
+        # Number of non-air blocks, and of opaque blocks.
+        self.count = SECTION_VOLUME - self.blocks.count(AIR)
+        self.opaque = self.blocks.translate(OPAQUE).count(1)
+
+        # Which faces of the section see each other through it, as computed
+        # by `culling.section_connectivity()`. None until computed, and
+        # reset whenever the blocks change.
+        self.connectivity = None
+
+    @property
+    def full(self):
+        """ Whether every block of the section is opaque. """
+        return self.opaque == SECTION_VOLUME
+
+    def set(self, i, value):
+        """ Store block id `value` at array index `i`.
+
+        """
+        blocks = self.blocks
+        old = blocks[i]
+        blocks[i] = value
+        self.count += (value != AIR) - (old != AIR)
+        self.opaque += OPAQUE[value] - OPAQUE[old]
+        self.connectivity = None
+
+    def array(self):
+        """ Return the blocks as a writable (y, z, x) NumPy view. Call
+        `recount()` after writing to it.
+
+        """
+        return np.frombuffer(self.blocks, dtype=np.uint8).reshape(
+            SECTION_SIZE, CHUNK_SIZE, CHUNK_SIZE)
+
+    def recount(self):
+        """ Recompute the block counts after the array was written to
+        directly.
+
+        """
+        self.count = SECTION_VOLUME - self.blocks.count(AIR)
+        self.opaque = self.blocks.translate(OPAQUE).count(1)
+        self.connectivity = None
+
+
+class Chunk(object):
+    """ A CHUNK_SIZE x CHUNK_SIZE column of blocks, made of SECTIONS stacked
+    sections. Sections that are all air are None.
+
+    """
+
+    __slots__ = ('position', 'sections', 'count')
+
+    def __init__(self, position):
+        # The (x, z) key of this chunk, in chunk units.
+        self.position = position
+
+        # The sections from the bottom up, None where all air.
+        self.sections = [None] * SECTIONS
+
+        # Number of non-air blocks in the chunk.
+        self.count = 0
+
+    @classmethod
+    def from_array(cls, position, array):
+        """ Create a chunk at `position` from a NumPy array of block ids
+        indexed by y, then z, then x. It may be shorter than the world.
+
+        """
+        chunk = cls(position)
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        for cy in range(min(SECTIONS, -(-len(array) // SECTION_SIZE))):
+            part = array[cy * SECTION_SIZE:(cy + 1) * SECTION_SIZE]
+            if not part.any():
+                continue
+            data = part.tobytes()
+            data += bytes(SECTION_VOLUME - len(data))
+            chunk.sections[cy] = section = Section(data)
+            chunk.count += section.count
+        return chunk
+
+    @classmethod
+    def from_bytes(cls, position, data):
+        """ Create a chunk at `position` from data made by `to_bytes()`.
+
+        """
+        if data[0] != FORMAT_VERSION:
+            raise ValueError('Unknown chunk format %d' % data[0])
+        chunk = cls(position)
+        offset = 1
+        for cy in range(SECTIONS):
+            tag = data[offset]
+            offset += 1
+            if tag == _EMPTY:
+                continue
+            if tag == _UNIFORM:
+                blocks = bytes([data[offset]]) * SECTION_VOLUME
+                offset += 1
+            else:
+                blocks = data[offset:offset + SECTION_VOLUME]
+                offset += SECTION_VOLUME
+            chunk.sections[cy] = section = Section(blocks)
+            chunk.count += section.count
+        return chunk
+
+    def to_bytes(self):
+        """ Return the chunk's blocks in a compact form, for `from_bytes()`.
+        All-air sections take one byte and single-block sections two.
+
+        """
+        data = bytearray((FORMAT_VERSION,))
+        for section in self.sections:
+            if section is None:
+                data.append(_EMPTY)
+                continue
+            blocks = section.blocks
+            first = blocks[0]
+            if blocks.count(first) == SECTION_VOLUME:
+                data.append(_UNIFORM)
+                data.append(first)
+            else:
+                data.append(_RAW)
+                data += blocks
+        return bytes(data)
+
+    @staticmethod
+    def index(x, y, z):
+        """ Returns the array index of the section-local position x, y, z.
+
+        """
+        return (y * CHUNK_SIZE + z) * CHUNK_SIZE + x
+
+    def get(self, x, y, z):
+        """ Returns the block id at chunk-local x, y, z, or AIR.
+
+        """
+        if not 0 <= y < WORLD_HEIGHT:
+            return AIR
+        section = self.sections[y // SECTION_SIZE]
+        if section is None:
+            return AIR
+        return section.blocks[((y % SECTION_SIZE) * CHUNK_SIZE + z) * CHUNK_SIZE + x]
+
+    def set(self, x, y, z, value):
+        """ Store block id `value` at chunk-local x, y, z.
+
+        """
+        cy = y // SECTION_SIZE
+        section = self.sections[cy]
+        if section is None:
+            if value == AIR:
+                return
+            section = self.sections[cy] = Section()
+        count = section.count
+        section.set(((y % SECTION_SIZE) * CHUNK_SIZE + z) * CHUNK_SIZE + x, value)
+        self.count += section.count - count
+        if not section.count:
+            # Drop sections that became all air.
+            self.sections[cy] = None
+
+    def positions(self):
+        """ Returns a list of the world positions of all blocks in the chunk.
+
+        """
+        ox = self.position[0] * CHUNK_SIZE
+        oz = self.position[1] * CHUNK_SIZE
+        result = []
+        for cy, section in enumerate(self.sections):
+            if section is None:
+                continue
+            oy = cy * SECTION_SIZE
+            for i, value in enumerate(section.blocks):
+                if value:
+                    x = i % CHUNK_SIZE
+                    z = (i // CHUNK_SIZE) % CHUNK_SIZE
+                    y = i // LAYER_AREA
+                    result.append((ox + x, oy + y, oz + z))
+        return result
+
+
+class ChunkStore(object):
+    """ A mapping from (x, y, z) position to block id, backed by Chunk arrays.
+    Supports the same `in`, `[]`, `del` and `len()` operations the world dict
+    used to.
+
+    """
+
+    def __init__(self):
+        # Mapping from (x, z) chunk key to Chunk.
+        self.chunks = {}
+
+        # Total number of blocks in all chunks.
+        self._count = 0
+
+    def in_bounds(self, position):
+        """ Returns True if `position` is inside the world's build height.
+
+        """
+        return 0 <= position[1] < WORLD_HEIGHT
+
+    def _lookup(self, position):
+        x, y, z = position
+        chunk = self.chunks.get((x // CHUNK_SIZE, z // CHUNK_SIZE))
+        if chunk is None:
+            return AIR
+        return chunk.get(x % CHUNK_SIZE, y, z % CHUNK_SIZE)
+
+    def __contains__(self, position):
+        return self._lookup(position) != AIR
+
+    def __getitem__(self, position):
+        value = self._lookup(position)
+        if value == AIR:
+            raise KeyError(position)
+        return value
+
+    def get(self, position, default=None):
+        value = self._lookup(position)
+        if value == AIR:
+            return default
+        return value
+
+    def __setitem__(self, position, block):
+        if not self.in_bounds(position):
+            raise KeyError(position)
+        x, y, z = position
+        key = (x // CHUNK_SIZE, z // CHUNK_SIZE)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = Chunk(key)
+        count = chunk.count
+        chunk.set(x % CHUNK_SIZE, y, z % CHUNK_SIZE, block)
+        self._count += chunk.count - count
+
+    def __delitem__(self, position):
+        x, y, z = position
+        key = (x // CHUNK_SIZE, z // CHUNK_SIZE)
+        chunk = self.chunks.get(key)
+        if chunk is None or not chunk.get(x % CHUNK_SIZE, y, z % CHUNK_SIZE):
+            raise KeyError(position)
+        chunk.set(x % CHUNK_SIZE, y, z % CHUNK_SIZE, AIR)
+        self._count -= 1
+        if not chunk.count:
+            del self.chunks[key]
+
+    def __len__(self):
+        return self._count
+
+    def fill(self, low, high, block, mask=None, replace=None, chunks=None):
+        """ Set every block in a box to `block` with one array write per
+        section.
+
+        Parameters
+        ----------
+        low, high : tuple of len 3
+            The (x, y, z) positions of opposite corners of the box, both
+            included. The box is clipped to the build height.
+        block : int
+            The id of the block to write; AIR clears the box.
+        mask : array_like of bool or None
+            If given, only the blocks where `mask` is true are written.
+            Indexed by x, y, z relative to `low`, with the shape of the box.
+        replace : int or None
+            If given, only blocks that are currently `replace` are written.
+        chunks : set of tuple or None
+            If given, only blocks in the chunks with these (x, z) keys are
+            written.
+
+        Returns
+        -------
+        touched : set of tuple
+            The (x, y, z) keys of the sections that were written to.
+
+        """
+        low, high = ([min(a, b) for a, b in zip(low, high)],
+                     [max(a, b) for a, b in zip(low, high)])
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            if mask.shape != tuple(h - l + 1 for l, h in zip(low, high)):
+                raise ValueError('mask does not match the shape of the box')
+            # Sections are indexed by y, then z, then x.
+            mask = mask.transpose(1, 2, 0)
+        x0, y0, z0 = low
+        x1, y1, z1 = high
+        if y0 < 0:
+            if mask is not None:
+                mask = mask[-y0:]
+            y0 = 0
+        y1 = min(y1, WORLD_HEIGHT - 1)
+        # Writing air where there is no section, or replacing anything but
+        # air there, changes nothing.
+        creates = block != AIR and replace in (None, AIR)
+        touched = set()
+        for cx in range(x0 // CHUNK_SIZE, x1 // CHUNK_SIZE + 1):
+            for cz in range(z0 // CHUNK_SIZE, z1 // CHUNK_SIZE + 1):
+                key = (cx, cz)
+                if chunks is not None and key not in chunks:
+                    continue
+                chunk = self.chunks.get(key)
+                if chunk is None:
+                    if not creates:
+                        continue
+                    chunk = self.chunks[key] = Chunk(key)
+                # The part of the box in this chunk, in chunk-local and in
+                # box-relative coordinates.
+                ox, oz = cx * CHUNK_SIZE, cz * CHUNK_SIZE
+                lx, hx = max(x0, ox) - ox, min(x1, ox + CHUNK_SIZE - 1) - ox + 1
+                lz, hz = max(z0, oz) - oz, min(z1, oz + CHUNK_SIZE - 1) - oz + 1
+                mx, mz = lx + ox - x0, lz + oz - z0
+                for cy in range(y0 // SECTION_SIZE, y1 // SECTION_SIZE + 1):
+                    oy = cy * SECTION_SIZE
+                    ly = max(y0, oy) - oy
+                    hy = min(y1, oy + SECTION_SIZE - 1) - oy + 1
+                    section = chunk.sections[cy]
+                    if section is None:
+                        if not creates:
+                            continue
+                        section = Section()
+                    view = section.array()[ly:hy, lz:hz, lx:hx]
+                    where = None
+                    if mask is not None:
+                        my = ly + oy - y0
+                        where = mask[my:my + hy - ly, mz:mz + hz - lz,
+                                     mx:mx + hx - lx]
+                    if replace is not None:
+                        matches = view == replace
+                        where = matches if where is None else where & matches
+                    if where is None:
+                        view[...] = block
+                    elif where.any():
+                        view[where] = block
+                    else:
+                        continue
+                    count = section.count
+                    section.recount()
+                    chunk.count += section.count - count
+                    self._count += section.count - count
+                    # Drop sections that became all air.
+                    chunk.sections[cy] = section if section.count else None
+                    touched.add((cx, cy, cz))
+                if not chunk.count:
+                    del self.chunks[key]
+        return touched
+
+    def add_chunk(self, chunk):
+        """ Add the whole `chunk` to the store, replacing any chunk already at
+        its position.
+
+        """
+        self.remove_chunk(chunk.position)
+        if chunk.count:
+            self.chunks[chunk.position] = chunk
+            self._count += chunk.count
+
+    def remove_chunk(self, key):
+        """ Remove the chunk at `key` and all its blocks from the store.
+
+        Returns
+        -------
+        chunk : Chunk or None
+
+        """
+        chunk = self.chunks.pop(key, None)
+        if chunk is not None:
+            self._count -= chunk.count
+        return chunk
+
+    def __iter__(self):
+        for chunk in list(self.chunks.values()):
+            for position in chunk.positions():
+                yield position
+
+    def section(self, key):
+        """ Return the section at (x, y, z) section `key`, or None if it is
+        all air or not loaded.
+
+        """
+        x, y, z = key
+        chunk = self.chunks.get((x, z))
+        if chunk is None or not 0 <= y < SECTIONS:
+            return None
+        return chunk.sections[y]
+
+    def is_buried(self, key):
+        """ Returns True if the section at `key` and all six sections around
+        it are full of opaque blocks, so none of its faces can be seen.
+
+        """
+        section = self.section(key)
+        if section is None or not section.full:
+            return False
+        x, y, z = key
+        for dx, dy, dz in ((0, 1, 0), (0, -1, 0), (-1, 0, 0), (1, 0, 0),
+                           (0, 0, 1), (0, 0, -1)):
+            other = self.section((x + dx, y + dy, z + dz))
+            if other is None or not other.full:
+                return False
+        return True
+
+    def visible_sections(self, key):
+        """ Return the keys of the sections of the chunk at (x, z) `key` that
+        need a mesh: those that are neither all air nor buried.
+
+        """
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            return []
+        x, z = key
+        return [
+            (x, cy, z) for cy, section in enumerate(chunk.sections)
+            if section is not None and not self.is_buried((x, cy, z))
+        ]
+
+    def lookup_many(self, positions):
+        """ Return the block id at each of `positions` at once.
+
+        Parameters
+        ----------
+        positions : ndarray of int, shape (N, 3)
+
+        Returns
+        -------
+        blocks : ndarray of uint8, shape (N,)
+            AIR where there is no block.
+
+        """
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 3)
+        result = np.zeros(len(positions), dtype=np.uint8)
+        x, y, z = positions[:, 0], positions[:, 1], positions[:, 2]
+        keys = np.stack([x // CHUNK_SIZE, y // SECTION_SIZE, z // CHUNK_SIZE], axis=1)
+        index = ((y % SECTION_SIZE) * CHUNK_SIZE + z % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+        keys, groups = np.unique(keys, axis=0, return_inverse=True)
+        groups = groups.reshape(-1)
+        for i, key in enumerate(keys.tolist()):
+            section = self.section(key)
+            if section is None:
+                continue
+            blocks = np.frombuffer(section.blocks, dtype=np.uint8)
+            mask = groups == i
+            result[mask] = blocks[index[mask]]
+        return result
+
+
+class ChunkCache(object):
+    """ A size-bounded, least recently used cache of unloaded chunks. The
+    chunks are kept zlib-compressed, which shrinks mostly-air arrays a lot.
+
+    Parameters
+    ----------
+    capacity : int
+        The most chunks to keep. The least recently used are dropped first.
+
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+        # Mapping from chunk key to compressed block array, oldest first.
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def put(self, chunk):
+        """ Add `chunk` to the cache, dropping the least recently used chunks
+        if it is full.
+
+        """
+        key = chunk.position
+        self.entries.pop(key, None)
+        self.entries[key] = zlib.compress(chunk.to_bytes(), 1)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        """ Remove the chunk at `key` from the cache and return it, or None if
+        it is not cached.
+
+        """
+        data = self.entries.pop(key, None)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Chunk.from_bytes(key, zlib.decompress(data))
+
+    def nbytes(self):
+        """ Return the total size of the compressed chunks.
+
+        """
+        return sum(len(data) for data in self.entries.values())
+
+
+def spiral_offsets(radius):
+    """ Return the (dx, dz) offsets of all chunks within `radius` chunks of a
+    center chunk, nearest first.
+
+    """
+    offsets = [
+        (dx, dz)
+        for dx in range(-radius, radius + 1)
+        for dz in range(-radius, radius + 1)
+        if dx * dx + dz * dz <= radius * radius
+    ]
+    offsets.sort(key=lambda o: (o[0] * o[0] + o[1] * o[1], math.atan2(o[1], o[0])))
+    return offsets
+
+
+class ChunkManager(object):
+    """ Tracks which chunks should be loaded around the player.
+
+    Parameters
+    ----------
+    radius : int
+        How many chunks away from the player's chunk to keep loaded.
+
+    """
+
+    def __init__(self, radius):
+        self.radius = radius
+
+        # Offsets of the chunks to keep loaded, nearest first. Computed once
+        # so moving only costs a pass over this table.
+        self.offsets = spiral_offsets(radius)
+
+        # The (x, z) key of the chunk the player is in.
+        self.center = None
+
+        # Set of the keys of all chunks that should be loaded.
+        self.needed = set()
+
+    def update(self, center):
+        """ Move the player to the chunk at `center`.
+
+        Returns
+        -------
+        load : list of tuple
+            Keys of chunks that are now needed, nearest first.
+        unload : set of tuple
+            Keys of chunks that are no longer needed.
+
+        """
+        if center == self.center:
+            return [], set()
+        self.center = center
+        cx, cz = center
+        load = [(cx + dx, cz + dz) for dx, dz in self.offsets]
+        needed = set(load)
+        unload = self.needed - needed
+        load = [key for key in load if key not in self.needed]
+        self.needed = needed
+        return load, unload
@@ -0,0 +1,273 @@
+""" Thin client mode: a world streamed from a game server.
+
+`RemoteModel` is a `Model` whose chunks come from a server (see `server.py`)
+instead of being generated and saved locally. It still builds and culls its
+own meshes, and draws distant terrain from the server's terrain settings.
+Block edits, including the bulk edits of `fill()`, are shown straight away
+and sent to the server block by block, which answers with the real block if
+it refuses one. The game window uses it when started
+with `python main.py --connect HOST:PORT`.
+
+"""
+
+import queue
+import socket
+import threading
+import time
+
+import numpy as np
+
+from blocks import AIR
+from chunks import Chunk, ChunkCache, ChunkManager, WORLD_HEIGHT, chunk_key
+from world import Model, SPAWN_POSITION
+import protocol
+
+# Longest time in seconds to wait for the chunks around the spawn point.
+SPAWN_TIMEOUT = 30.0
+
+
+class ServerConnection(object):
+    """ A connection to a game server. Messages are read on a background
+    thread and collected for the game loop to drain a little at a time.
+
+    Parameters
+    ----------
+    host : str
+    port : int
+
+    """
+
+    def __init__(self, host, port):
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self.socket.makefile('rb')
+        self._lock = threading.Lock()
+
+        # Bytes received so far.
+        self.bytes_received = 0
+
+        # Whether the server has closed the connection.
+        self.closed = False
+
+        kind, payload = self._read()
+        if kind != protocol.HELLO:
+            raise ValueError('Expected HELLO, got message type %d' % kind)
+        # The server's terrain settings and view radius in chunks.
+        self.settings, self.radius = protocol.decode_hello(payload)
+
+        # Received (type, payload) messages, filled in from the reading
+        # thread.
+        self.received = queue.Queue()
+        self._thread = threading.Thread(target=self._receive, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        header = self._file.read(protocol.HEADER.size)
+        if len(header) < protocol.HEADER.size:
+            raise EOFError
+        length, kind = protocol.unpack_header(header)
+        payload = self._file.read(length)
+        if len(payload) < length:
+            raise EOFError
+        self.bytes_received += protocol.HEADER.size + length
+        return kind, payload
+
+    def _receive(self):
+        """ Read messages until the connection closes. Runs on its own
+        thread.
+
+        """
+        try:
+            while True:
+                self.received.put(self._read())
+        except (EOFError, OSError, ValueError):
+            pass
+        self.closed = True
+
+    def send(self, message):
+        """ Send `message`, as made by the `protocol` encoders.
+
+        """
+        if self.closed:
+            return
+        try:
+            with self._lock:
+                self.socket.sendall(message)
+        except OSError:
+            self.closed = True
+
+    def drain(self, budget=None, timeout=None):
+        """ Yield received messages until none are left or `budget` seconds
+        have passed. The time the caller spends on each message counts
+        against the budget; messages not yet yielded stay queued.
+
+        Parameters
+        ----------
+        budget : float or None
+            Time limit in seconds, or None for no limit.
+        timeout : float or None
+            If given, wait up to this long for the first message.
+
+        Yields
+        ------
+        message : tuple
+            (type, payload) of each message.
+
+        """
+        start = time.perf_counter()
+        first = True
+        while budget is None or time.perf_counter() - start < budget:
+            try:
+                if timeout is not None and first:
+                    message = self.received.get(timeout=timeout)
+                else:
+                    message = self.received.get_nowait()
+            except queue.Empty:
+                break
+            first = False
+            yield message
+
+    def close(self):
+        self.closed = True
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+
+class RemoteModel(Model):
+    """ The world of a game server, as one player sees it.
+
+    Parameters
+    ----------
+    connection : ServerConnection
+    renderer : Renderer
+    spawn : tuple of len 3
+        The position around which the first chunks are loaded.
+
+    """
+
+    def __init__(self, connection, renderer=None, spawn=SPAWN_POSITION):
+        # The server the world is streamed from.
+        self.connection = connection
+        super(RemoteModel, self).__init__(
+            renderer, path=None, terrain=connection.settings, workers=0,
+            spawn=spawn)
+
+    def _initialize(self, spawn):
+        # Ask for the same chunks the server will send.
+        self.chunk_manager = ChunkManager(self.connection.radius)
+        # The server sends chunks again when the player comes back.
+        self.chunk_cache = ChunkCache(0)
+        self.check_chunks(spawn[0], spawn[2])
+        # Wait for the chunks around the spawn point so the player has ground
+        # to stand on.
+        end = time.perf_counter() + SPAWN_TIMEOUT
+        while not self.chunk_manager.needed <= self.loaded_chunks:
+            remaining = end - time.perf_counter()
+            if self.connection.closed or remaining <= 0:
+                break
+            for kind, payload in self.connection.drain(timeout=remaining):
+                self.receive(kind, payload)
+
+    def update_chunks(self, load, unload):
+        """ Unload the chunks at the keys in `unload`, and tell the server
+        which chunk the player is now in so it sends the ones in `load`.
+
+        """
+        for key in unload:
+            if key in self.loaded_chunks:
+                self.unload_chunk(key)
+        if load or unload:
+            self.connection.send(protocol.encode_move(self.chunk_manager.center))
+
+    def process_generated(self, budget=None):
+        """ Apply the chunks and block edits received from the server,
+        spending at most `budget` seconds.
+
+        """
+        for kind, payload in self.connection.drain(budget):
+            self.receive(kind, payload)
+
+    def receive(self, kind, payload):
+        """ Apply one message from the server.
+
+        """
+        if kind == protocol.CHUNK:
+            key, blocks = protocol.decode_chunk(payload)
+            if key not in self.chunk_manager.needed:
+                return
+            if key in self.loaded_chunks:
+                # A newer copy, sent after the player left and came back.
+                self.unload_chunk(key)
+            self.insert_chunk(Chunk.from_bytes(key, blocks), immediate=False)
+        elif kind == protocol.BLOCK:
+            position, block = protocol.decode_block(payload)
+            self.set_block(position, block)
+
+    def add_block(self, position, block, immediate=True):
+        """ Place `block` at `position` and ask the server to do the same.
+
+        """
+        if (not self.world.in_bounds(position) or
+                chunk_key(position) not in self.loaded_chunks):
+            return
+        self.connection.send(protocol.encode_block(position, block))
+        self.set_block(position, block, immediate)
+
+    def remove_block(self, position, immediate=True):
+        """ Remove the block at `position` and ask the server to do the same.
+
+        """
+        if chunk_key(position) not in self.loaded_chunks:
+            return
+        self.connection.send(protocol.encode_block(position, AIR))
+        self.set_block(position, AIR, immediate)
+
+    def fill(self, low, high, block, mask=None, replace=None):
+        """ Set every block in the box from `low` to `high` to `block`, as
+        `Model.fill()` does, and send each block that changed to the server.
+        `replace()` and `clear()` go through here too.
+
+        """
+        low, high = ([min(a, b) for a, b in zip(low, high)],
+                     [max(a, b) for a, b in zip(low, high)])
+        y0, y1 = max(low[1], 0), min(high[1], WORLD_HEIGHT - 1)
+        if y0 > y1:
+            return set()
+        x, y, z = np.meshgrid(np.arange(low[0], high[0] + 1),
+                              np.arange(y0, y1 + 1),
+                              np.arange(low[2], high[2] + 1), indexing='ij')
+        positions = np.stack([x.ravel(), y.ravel(), z.ravel()], axis=1)
+        before = self.world.lookup_many(positions)
+        touched = super(RemoteModel, self).fill(low, high, block, mask, replace)
+        if not touched:
+            return touched
+        after = self.world.lookup_many(positions)
+        changed = before != after
+        self.connection.send(b''.join(
+            protocol.encode_block(position, new) for position, new in
+            zip(positions[changed].tolist(), after[changed].tolist())))
+        return touched
+
+    def set_block(self, position, block, immediate=True):
+        """ Set the block at `position` without telling the server. Only
+        loaded chunks are edited.
+
+        """
+        if chunk_key(position) not in self.loaded_chunks:
+            return
+        if block != AIR:
+            self.world[position] = block
+        elif position in self.world:
+            del self.world[position]
+        if immediate:
+            self.mark_dirty(position)
+
+    def close(self):
+        """ Disconnect from the server. Nothing is saved locally.
+
+        """
+        self.connection.close()
+        super(RemoteModel, self).close()
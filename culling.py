@@ -0,0 +1,254 @@
+""" Visibility culling of section meshes.
+
+A `Frustum` is built from the same camera settings `Window.set_3d()` hands to
+OpenGL. Section bounding boxes are tested against its six planes with NumPy,
+all at once, so only sections that can appear on screen are drawn.
+
+Sections hidden behind terrain are culled with a connectivity graph: each
+section records which pairs of its faces are joined by see-through blocks,
+and `reachable_sections()` flood-fills through those connections from the
+camera's section. Sections the fill never reaches cannot be seen.
+
+"""
+
+import collections
+import math
+
+import numpy as np
+
+from blocks import OPAQUE
+from chunks import CHUNK_SIZE, SECTION_SIZE, SECTION_VOLUME, SECTIONS
+from mesher import FACES
+
+# Connectivity of a section that is all air: every face sees every other.
+ALL_CONNECTED = (1 << 36) - 1
+
+# The faces of the section each block index lies on, as a bit mask over
+# `FACES`. Zero for blocks inside the section.
+_CELL_FACES = []
+for _i in range(SECTION_VOLUME):
+    _x = _i % CHUNK_SIZE
+    _z = (_i // CHUNK_SIZE) % CHUNK_SIZE
+    _y = _i // (CHUNK_SIZE * CHUNK_SIZE)
+    _CELL_FACES.append(
+        (_y == SECTION_SIZE - 1) << 0 | (_y == 0) << 1 |
+        (_x == 0) << 2 | (_x == CHUNK_SIZE - 1) << 3 |
+        (_z == CHUNK_SIZE - 1) << 4 | (_z == 0) << 5)
+
+# Indices of the blocks on the outside of a section.
+_BOUNDARY = [i for i, faces in enumerate(_CELL_FACES) if faces]
+
+# For each set of faces, the connectivity bits joining all of them.
+_PAIRS = []
+for _faces in range(64):
+    _mask = 0
+    for _a in range(6):
+        for _b in range(6):
+            if _faces >> _a & 1 and _faces >> _b & 1:
+                _mask |= 1 << (_a * 6 + _b)
+    _PAIRS.append(_mask)
+
+
+def camera_basis(rotation):
+    """ Return the forward, right and up unit vectors of a camera with the
+    given (horizontal, vertical) `rotation` in degrees, as `set_3d()` applies
+    it.
+
+    """
+    x, y = rotation
+    m = math.cos(math.radians(y))
+    forward = np.array([
+        math.cos(math.radians(x - 90)) * m,
+        math.sin(math.radians(y)),
+        math.sin(math.radians(x - 90)) * m,
+    ])
+    right = np.array([math.cos(math.radians(x)), 0.0, math.sin(math.radians(x))])
+    up = np.cross(right, forward)
+    return forward, right, up
+
+
+def section_bounds(keys):
+    """ Return the low and high corners of the sections at `keys`.
+
+    Returns
+    -------
+    low, high : ndarray of float, shape (len(keys), 3)
+
+    """
+    keys = np.asarray(keys, dtype=np.float64).reshape(-1, 3)
+    size = np.array([CHUNK_SIZE, SECTION_SIZE, CHUNK_SIZE], dtype=np.float64)
+    # Blocks are centered on integer coordinates.
+    low = keys * size - 0.5
+    return low, low + size
+
+
+class Frustum(object):
+    """ The volume seen by a perspective camera.
+
+    Parameters
+    ----------
+    position : tuple of len 3
+        The position of the camera.
+    rotation : tuple of len 2
+        The (horizontal, vertical) rotation of the camera in degrees.
+    fov : float
+        The vertical field of view in degrees, as for `gluPerspective()`.
+    aspect : float
+        Width divided by height of the viewport.
+    near, far : float
+        Distances to the near and far clipping planes.
+
+    """
+
+    def __init__(self, position, rotation, fov, aspect, near, far):
+        forward, right, up = camera_basis(rotation)
+        tan_v = math.tan(math.radians(fov) / 2)
+        tan_h = tan_v * aspect
+        # Inward-pointing plane normals: a point p is inside when
+        # dot(normal, p - position) + offset >= 0 for every plane.
+        normals = np.array([
+            right + forward * tan_h,   # left
+            -right + forward * tan_h,  # right
+            up + forward * tan_v,      # bottom
+            -up + forward * tan_v,     # top
+            forward,                   # near
+            -forward,                  # far
+        ])
+        offsets = np.array([0, 0, 0, 0, -near, far], dtype=np.float64)
+        position = np.asarray(position, dtype=np.float64)
+        self.normals = normals
+        self.offsets = offsets - normals.dot(position)
+
+    def test_boxes(self, low, high):
+        """ Test axis-aligned boxes against the frustum.
+
+        Parameters
+        ----------
+        low, high : ndarray of float, shape (N, 3)
+            The corners of the boxes.
+
+        Returns
+        -------
+        visible : ndarray of bool, shape (N,)
+            False for the boxes entirely outside the frustum. Boxes near a
+            corner of the frustum may be kept although they are outside.
+
+        """
+        visible = np.ones(len(low), dtype=bool)
+        for normal, offset in zip(self.normals, self.offsets):
+            # The corner of each box furthest along the plane's normal.
+            corner = np.where(normal > 0, high, low)
+            visible &= corner.dot(normal) + offset >= 0
+        return visible
+
+
+def section_connectivity(section):
+    """ Return which faces of `section` are joined through blocks that are
+    not opaque. The result is cached on the section until it changes.
+
+    Returns
+    -------
+    connectivity : int
+        Bit `a * 6 + b` is set if faces a and b (indices into `FACES`) are
+        joined.
+
+    """
+    if section is None:
+        return ALL_CONNECTED
+    if section.connectivity is not None:
+        return section.connectivity
+    if section.full:
+        section.connectivity = 0
+        return 0
+    # 1 for every block that can be seen through.
+    seen = bytearray(1 - v for v in OPAQUE)
+    open_cells = section.blocks.translate(seen)
+    last = CHUNK_SIZE - 1
+    top = SECTION_SIZE - 1
+    connectivity = 0
+    cell_faces = _CELL_FACES
+    for start in _BOUNDARY:
+        if not open_cells[start]:
+            continue
+        # Flood fill the see-through blocks joined to `start`, collecting the
+        # faces they touch.
+        open_cells[start] = 0
+        stack = [start]
+        faces = 0
+        while stack:
+            i = stack.pop()
+            faces |= cell_faces[i]
+            x = i & last
+            z = (i >> 4) & last
+            y = i >> 8
+            if x > 0 and open_cells[i - 1]:
+                open_cells[i - 1] = 0
+                stack.append(i - 1)
+            if x < last and open_cells[i + 1]:
+                open_cells[i + 1] = 0
+                stack.append(i + 1)
+            if z > 0 and open_cells[i - CHUNK_SIZE]:
+                open_cells[i - CHUNK_SIZE] = 0
+                stack.append(i - CHUNK_SIZE)
+            if z < last and open_cells[i + CHUNK_SIZE]:
+                open_cells[i + CHUNK_SIZE] = 0
+                stack.append(i + CHUNK_SIZE)
+            if y > 0 and open_cells[i - 256]:
+                open_cells[i - 256] = 0
+                stack.append(i - 256)
+            if y < top and open_cells[i + 256]:
+                open_cells[i + 256] = 0
+                stack.append(i + 256)
+        connectivity |= _PAIRS[faces]
+    section.connectivity = connectivity
+    return connectivity
+
+
+def reachable_sections(world, start, chunks):
+    """ Flood-fill from the section at `start` through the faces each
+    section connects, and return every section that could be seen.
+
+    The fill never steps back against a direction it has already moved in,
+    so it cannot wrap around behind walls.
+
+    Parameters
+    ----------
+    world : ChunkStore
+    start : tuple of len 3
+        The (x, y, z) key of the camera's section.
+    chunks : set of tuple
+        The (x, z) keys of the chunks to search; the fill stops at their
+        edge.
+
+    Returns
+    -------
+    reachable : set of tuple
+        The (x, y, z) keys of the sections that can be seen.
+
+    """
+    x, y, z = start
+    start = (x, max(0, min(SECTIONS - 1, y)), z)
+    reachable = {start}
+    # Entries are (section key, face it was entered through, directions
+    # moved so far as a bit mask over FACES).
+    queue = collections.deque([(start, None, 0)])
+    section = world.section
+    while queue:
+        key, entry, moved = queue.popleft()
+        connectivity = section_connectivity(section(key))
+        x, y, z = key
+        for face, (dx, dy, dz) in enumerate(FACES):
+            # The opposite of each face is its index with the lowest bit
+            # flipped.
+            if moved >> (face ^ 1) & 1:
+                continue
+            if entry is not None and not connectivity >> (entry * 6 + face) & 1:
+                continue
+            other = (x + dx, y + dy, z + dz)
+            if other in reachable or not 0 <= other[1] < SECTIONS:
+                continue
+            if (other[0], other[2]) not in chunks:
+                continue
+            reachable.add(other)
+            queue.append((other, face ^ 1, moved | 1 << face))
+    return reachable
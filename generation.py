@@ -0,0 +1,190 @@
+""" Chunk generation off the main thread.
+
+Terrain for a chunk is generated by `generate_chunk()`, which only needs the
+terrain settings and the chunk key, so it can run in a worker process; the
+stages it runs are in `terrain`. The
+`ChunkGenerator` hands requests to a process pool and collects the finished
+block arrays in a completion queue that the game loop drains a little at a
+time.
+
+"""
+
+import logging
+import queue
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from chunks import Chunk
+from terrain import TerrainGenerator, TerrainSettings, group_writes, place_blocks
+
+
+logger = logging.getLogger(__name__)
+
+# Times a chunk is generated before giving up on it after errors.
+MAX_ATTEMPTS = 3
+
+# TerrainGenerator of each worker process, by settings.
+_generators = {}
+
+
+def terrain_generator(settings):
+    """ Return this process's TerrainGenerator for `settings`, creating it on
+    first use.
+
+    """
+    generator = _generators.get(settings)
+    if generator is None:
+        generator = _generators[settings] = TerrainGenerator(settings)
+    return generator
+
+
+def generate_chunk(settings, key):
+    """ Generate the blocks of the chunk at `key`.
+
+    Parameters
+    ----------
+    settings : TerrainSettings
+    key : tuple of len 2
+        The (x, z) key of the chunk.
+
+    Returns
+    -------
+    key : tuple of len 2
+    blocks : bytes
+        The chunk, as returned by `Chunk.to_bytes()`, including the parts of
+        its structures that fall inside it.
+    pending : dict
+        Mapping from the (x, z) key of each other chunk the structures reach
+        into to a list of world (x, y, z, block) writes; see
+        `terrain.place_blocks()`.
+
+    """
+    generator = terrain_generator(settings)
+    chunk = Chunk.from_array(key, generator.generate(key))
+    pending = group_writes(generator.decorate(key).tolist())
+    place_blocks(chunk, pending.pop(key, ()))
+    return key, chunk.to_bytes(), pending
+
+
+class ChunkGenerator(object):
+    """ Generates chunks in a pool of worker processes.
+
+    Parameters
+    ----------
+    settings : TerrainSettings
+    workers : int or None
+        Number of worker processes. None uses one per CPU; 0 generates every
+        chunk synchronously inside `request()`.
+
+    """
+
+    def __init__(self, settings, workers=None):
+        self.settings = settings
+        self.executor = None if workers == 0 else ProcessPoolExecutor(workers)
+
+        # Mapping from chunk key to the Future generating it.
+        self.pending = {}
+
+        # Finished (key, future, result) tuples, filled in from the executor's
+        # thread and drained on the main thread.
+        self.completed = queue.Queue()
+
+        # Mapping from chunk key to the number of times generating it failed
+        # in a row.
+        self.failures = {}
+
+    def request(self, key):
+        """ Start generating the chunk at `key` unless it already is.
+
+        """
+        if key in self.pending:
+            return
+        if self.executor is None:
+            self.pending[key] = None
+            self.completed.put((key, None, generate_chunk(self.settings, key)))
+            return
+        future = self.executor.submit(generate_chunk, self.settings, key)
+        self.pending[key] = future
+        future.add_done_callback(
+            lambda future, key=key: self._done(key, future))
+
+    def _done(self, key, future):
+        """ Called from the executor's thread when a chunk has been generated.
+
+        """
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            # Still report the chunk so that `drain()` can log the error and
+            # request it again.
+            self.completed.put((key, future, None))
+            return
+        self.completed.put((key, future, future.result()))
+
+    def cancel(self, keep):
+        """ Cancel pending requests for every chunk not in `keep`.
+
+        """
+        for key in list(self.pending):
+            if key not in keep:
+                future = self.pending.pop(key)
+                if future is not None:
+                    future.cancel()
+        for key in list(self.failures):
+            if key not in keep:
+                del self.failures[key]
+
+    def drain(self, budget=None, block=False, retry=None):
+        """ Yield finished chunks until the completion queue is empty or
+        `budget` seconds have passed. The time the caller spends on each
+        chunk counts against the budget; chunks not yet yielded stay queued.
+        Chunks whose generation failed are logged, and requested again if
+        they are in `retry`, up to MAX_ATTEMPTS times in all.
+
+        Parameters
+        ----------
+        budget : float or None
+            Time limit in seconds, or None for no limit.
+        block : bool
+            Whether to wait for every pending chunk to finish.
+        retry : container of tuple or None
+            Keys of the chunks to request again if generating them failed.
+
+        Yields
+        ------
+        result : tuple
+            (key, blocks, pending) for each finished chunk, as returned by
+            `generate_chunk()`.
+
+        """
+        start = time.perf_counter()
+        while budget is None or time.perf_counter() - start < budget:
+            try:
+                if block and self.pending:
+                    key, future, result = self.completed.get()
+                else:
+                    key, future, result = self.completed.get_nowait()
+            except queue.Empty:
+                break
+            # Skip chunks that were cancelled after they finished.
+            if self.pending.get(key, False) is not future:
+                continue
+            del self.pending[key]
+            if result is not None:
+                self.failures.pop(key, None)
+                yield result
+                continue
+            attempts = self.failures[key] = self.failures.get(key, 0) + 1
+            logger.error('Generating chunk %s failed (attempt %d of %d)', key,
+                         attempts, MAX_ATTEMPTS, exc_info=future.exception())
+            if retry is not None and key in retry and attempts < MAX_ATTEMPTS:
+                self.request(key)
+
+    def shutdown(self):
+        """ Cancel all pending work and stop the worker processes.
+
+        """
+        self.cancel(())
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
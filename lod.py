@@ -0,0 +1,141 @@
+""" Simplified meshes of distant terrain.
+
+Chunks beyond the loaded area are drawn from the terrain heightmap alone:
+each square of `LOD_CELL` by `LOD_CELL` columns becomes one grass quad at
+the height of its middle column, joined to lower neighbours by walls. No
+blocks are generated or stored for them, and a chunk takes a few dozen
+quads instead of hundreds of faces. As the player comes closer the chunk is
+loaded and its level of detail mesh is replaced by the full section meshes.
+
+"""
+
+import numpy as np
+
+from blocks import GRASS, LAYER_TABLE
+from chunks import CHUNK_SIZE
+from terrain import column_heights
+from mesher import _FACE_AXES, _FACE_CORNER_OFFSETS
+
+# Width in blocks of the squares distant terrain is simplified to. Must
+# divide CHUNK_SIZE.
+LOD_CELL = 4
+
+# Cells per chunk side.
+_CELLS = CHUNK_SIZE // LOD_CELL
+
+# For the walls on the -x, +x, +z and -z sides of a cell: the face index, and
+# the offset to the neighbouring cell in the padded height grid.
+_WALLS = [
+    (2, -1, 0),
+    (3, 1, 0),
+    (4, 0, 1),
+    (5, 0, -1),
+]
+
+
+def lod_heights(settings, key):
+    """ Return the sampled terrain height of each cell of the chunk at
+    `key`, with a border one cell wide from the chunks around it.
+
+    Returns
+    -------
+    heights : ndarray of int, shape (_CELLS + 2, _CELLS + 2)
+        Indexed by cell x, then cell z, starting one cell outside the chunk.
+
+    """
+    # The middle column of each cell.
+    cells = np.arange(-1, _CELLS + 1) * LOD_CELL + LOD_CELL // 2
+    x = key[0] * CHUNK_SIZE + cells[:, None]
+    z = key[1] * CHUNK_SIZE + cells[None, :]
+    return column_heights(settings, x, z)
+
+
+def _quads(face, low, size, layer):
+    """ Return the vertices and texture array coordinates of one quad per
+    row of `low` and `size`, on side `face` of each box.
+
+    Parameters
+    ----------
+    face : int
+        Index of the side of the boxes, into `mesher.FACES`.
+    low : ndarray of int, shape (N, 3)
+        Chunk-local position of the lowest block of each box.
+    size : ndarray of int, shape (N, 3)
+        Size of each box in blocks.
+    layer : int
+        The texture array layer of the quads.
+
+    """
+    corners = _FACE_CORNER_OFFSETS[face]
+    vertices = low[:, None, :] + corners[None, :, :] * size[:, None, :]
+    _, u_axis, v_axis = _FACE_AXES[face]
+    u = size[:, u_axis]
+    v = size[:, v_axis]
+    zero = np.zeros(len(low), dtype=np.int64)
+    r = np.full(len(low), layer * 2 + 1)
+    tex_coords = np.stack([zero, zero, r, u, zero, r, u, v, r, zero, v, r], axis=1)
+    return vertices.reshape(-1), tex_coords.reshape(-1)
+
+
+def build_lod_mesh(settings, key):
+    """ Build the simplified surface of the chunk at `key` from the terrain
+    heightmap.
+
+    Parameters
+    ----------
+    settings : TerrainSettings
+    key : tuple of len 2
+        The (x, z) key of the chunk.
+
+    Returns
+    -------
+    vertices : list of int
+        Four (x, y, z) vertices per quad relative to `mesher.mesh_origin(key)`,
+        for drawing as GL_QUADS.
+    tex_coords : list of int
+        Four (u, v, r) texture array coordinates per quad, as for
+        `mesher.build_greedy_mesh()`.
+    top : int
+        The height of the highest column in the mesh.
+
+    """
+    heights = lod_heights(settings, key)
+    inner = heights[1:-1, 1:-1]
+    i, j = np.meshgrid(np.arange(_CELLS), np.arange(_CELLS), indexing='ij')
+    i = i.reshape(-1)
+    j = j.reshape(-1)
+    h = inner.reshape(-1)
+    x0 = i * LOD_CELL
+    z0 = j * LOD_CELL
+    cell = np.full(len(h), LOD_CELL)
+    one = np.ones(len(h), dtype=np.int64)
+
+    vertices = []
+    tex_coords = []
+    low = np.stack([x0, h - 1, z0], axis=1)
+    size = np.stack([cell, one, cell], axis=1)
+    quads = _quads(0, low, size, LAYER_TABLE[GRASS * 6])
+    vertices.append(quads[0])
+    tex_coords.append(quads[1])
+    for face, di, dj in _WALLS:
+        other = heights[1 + di:_CELLS + 1 + di, 1 + dj:_CELLS + 1 + dj].reshape(-1)
+        mask = other < h
+        if not mask.any():
+            continue
+        # The wall runs along the cell's side, from the top of the lower
+        # neighbour to the top of this cell.
+        low = np.stack([
+            x0 + (LOD_CELL - 1) * (di > 0),
+            other,
+            z0 + (LOD_CELL - 1) * (dj > 0),
+        ], axis=1)[mask]
+        size = np.stack([
+            one if di else cell,
+            h - other,
+            one if dj else cell,
+        ], axis=1)[mask]
+        quads = _quads(face, low, size, LAYER_TABLE[GRASS * 6 + face])
+        vertices.append(quads[0])
+        tex_coords.append(quads[1])
+    return (np.concatenate(vertices).tolist(),
+            np.concatenate(tex_coords).tolist(), int(heights.max()))
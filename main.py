@@ -1,41 +1,42 @@
 from __future__ import division
 
+import argparse
 import sys
 import math
 import random
 import time
 
-from collections import deque
-
 from pyglet.gl import *
 from pyglet.graphics import TextureGroup
 from pyglet.window import key, mouse
 from pyglet import image
 from pyglet import shapes
-import threading
 from blocks import *
-from perlin_noise import PerlinNoise
-
-TICKS_PER_SEC = 60
-# originally was 60
+from world import (Model, sectorize, TICKS_PER_SEC, GENERATION_BUDGET,
+    LOD_DISTANCE)
+from chunks import CHUNK_SIZE
+from renderer import Renderer
+from client import RemoteModel, ServerConnection
+from profiler import FrameProfiler
+from culling import Frustum
+import physics
+from mesher import (cube_vertices, mesh_origin, VERTEX_FORMAT, ATLAS_FORMAT,
+    TILED_FORMAT, LAYER_SCALE)
 
 FOV = 90.0
 
-max_world_size = 32000
-max_build_height = 319
-
-terrain_noise = PerlinNoise(octaves=2)
+# Distances to the near and far clipping planes. The far plane reaches the
+# edge of the distant terrain.
+NEAR_PLANE = 0.1
+FAR_PLANE = float(LOD_DISTANCE * CHUNK_SIZE)
 
-render = 3
-
-# Size of sectors used to ease block loading.
-SECTOR_SIZE = 16
+# Distances at which fog starts and becomes opaque.
+FOG_START = FAR_PLANE * 0.6
+FOG_END = FAR_PLANE
 
 WALKING_SPEED = 5
 FLYING_SPEED = 15  
 
-player_pos = (0, 10, 0)
-
 INVENTORY_POS = (195, 100)
 
 GRAVITY = 20.0
@@ -52,21 +53,17 @@ TERMINAL_VELOCITY = 50
 
 PLAYER_HEIGHT = 2
 
-if sys.version_info[0] >= 3:
-    xrange = range
+# Seconds of frame timings kept by the profiler, and the frame time in
+# milliseconds at the top of the profiler graph.
+PROFILE_HISTORY = 10.0
+PROFILE_GRAPH_MS = 50.0
 
-def cube_vertices(x, y, z, n):
-    """ Return the vertices of the cube at position x, y, z with size 2*n.
+# Seconds between taking damage, and between regaining health.
+HURT_COOLDOWN = 1.0
+REGEN_DELAY = 6.25
 
-    """
-    return [
-        x-n,y+n,z-n, x-n,y+n,z+n, x+n,y+n,z+n, x+n,y+n,z-n,  # top
-        x-n,y-n,z-n, x+n,y-n,z-n, x+n,y-n,z+n, x-n,y-n,z+n,  # bottom
-        x-n,y-n,z-n, x-n,y-n,z+n, x-n,y+n,z+n, x-n,y+n,z-n,  # left
-        x+n,y-n,z+n, x+n,y-n,z-n, x+n,y+n,z-n, x+n,y+n,z+n,  # right
-        x-n,y-n,z+n, x+n,y-n,z+n, x+n,y+n,z+n, x-n,y+n,z+n,  # front
-        x+n,y-n,z-n, x-n,y-n,z-n, x-n,y+n,z-n, x+n,y+n,z-n,  # back
-    ]
+if sys.version_info[0] >= 3:
+    xrange = range
 
 def slab_vertices(x, y, z, n):
     """ Return the vertices of the cube at position x, y, z with size 2*n.
@@ -81,451 +78,91 @@ def slab_vertices(x, y, z, n):
         x+n,y-n,z-n, x-n,y-n,z-n, x-n,n,z-n, x+n,n,z-n,  # back
     ]
 
-gui_blocks = [CRAFTING_TABLE]
-
 TEXTURE_PATH = 'texture_size_test.png'
 
-hotbar_image = image.load('hotbar.png')
-player_inventory = image.load('player_inventory.png')
-heart = image.load('heart.png')
-empty_heart = image.load('heart_empty.png')
-
-
-FACES = [
-    ( 0, 1, 0),
-    ( 0,-1, 0),
-    (-1, 0, 0),
-    ( 1, 0, 0),
-    ( 0, 0, 1),
-    ( 0, 0,-1),
-]
 
-
-def normalize(position):
-    """ Accepts `position` of arbitrary precision and returns the block
-    containing that position.
-
-    Parameters
-    ----------
-    position : tuple of len 3
-
-    Returns
-    -------
-    block_position : tuple of ints of len 3
+def texture_array(atlas):
+    """ Return the texture atlas `atlas` as a 3D texture with one square
+    per layer. Unlike the atlas, a single square can then be repeated across
+    a larger quad.
 
     """
-    x, y, z = position
-    x, y, z = (int(round(x)), int(round(y)), int(round(z)))
-    return (x, y, z)
-
-
-def sectorize(position):
-    """ Returns a tuple representing the sector for the given `position`.
-
-    Parameters
-    ----------
-    position : tuple of len 3
-
-    Returns
-    -------
-    sector : tuple of len 3
+    grid = image.ImageGrid(atlas, ATLAS_SIZE, ATLAS_SIZE)
+    texture = image.Texture3D.create_for_image_grid(grid)
+    glBindTexture(texture.target, texture.id)
+    glTexParameteri(texture.target, GL_TEXTURE_WRAP_S, GL_REPEAT)
+    glTexParameteri(texture.target, GL_TEXTURE_WRAP_T, GL_REPEAT)
+    glTexParameteri(texture.target, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+    glTexParameteri(texture.target, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    return texture
+
+
+class VertexListRenderer(Renderer):
+    """ Draws the world's section meshes, one pyglet vertex list per section,
+    so each frame only the sections in view need to be drawn. Each mesh is
+    translated to its origin and its texture coordinates are scaled by the
+    texture matrix; see `mesher`.
 
     """
-    x, y, z = normalize(position)
-    x, y, z = x // SECTOR_SIZE, y // SECTOR_SIZE, z // SECTOR_SIZE
-    return (x, 0, z)
-
-
-class Model(object):
 
     def __init__(self):
 
-        # A Batch is a collection of vertex lists for batched rendering.
-        self.batch = pyglet.graphics.Batch()
-
         # A TextureGroup manages an OpenGL texture.
-        self.group = TextureGroup(image.load(TEXTURE_PATH).get_texture())
-
-        self.chunk_cooldown = 75
-
-        self.current_chunk = (0, 0)
-        self.last_chunk = (0, 0)
-
-        # A mapping from position to the texture of the block at that position.
-        # This defines all the blocks that are currently in the world.
-        self.world = {}
-
-        # Same mapping as `world` but only contains blocks that are shown.
-        self.shown = {}
-
-        self.loaded_chunks = []
-
-        # Mapping from position to a pyglet `VertextList` for all shown blocks.
-        self._shown = {}
-
-        # Mapping from sector to a list of positions inside that sector.
-        self.sectors = {}
-
-        # Simple function queue implementation. The queue is populated with
-        # _show_block() and _hide_block() calls
-        self.queue = deque()
-
-        self._initialize()
-    
-    def load_chunk(self, pos=(1, 0)):
-        global SECTOR_SIZE, terrain_noise, max_world_size
-        if not pos in self.loaded_chunks:
-            for x in range(SECTOR_SIZE):
-                for z in range(SECTOR_SIZE):
-                    height = terrain_noise([x+(pos[0]*SECTOR_SIZE) * max_world_size, z+(pos[1]*SECTOR_SIZE) * max_world_size])
-                    # height = height*max_build_height
-                    if height > max_build_height:
-                        height = max_build_height
-                    elif height < 1:
-                        height = 1
-                    for y in range(int(height)):
-                        self.add_block((x+(pos[0]*SECTOR_SIZE), y, z+(pos[1]*SECTOR_SIZE)), GRASS, immediate=False)
-                        self.show_block((x+(pos[0]*SECTOR_SIZE), y, z+(pos[1]*SECTOR_SIZE)))
-                        
-                
-
-            self.loaded_chunks.append((pos[0], pos[1]))
-
-    def unload_chunk(self, pos=(1, 0)):
-        global SECTOR_SIZE
-        for x in range(SECTOR_SIZE):
-            for z in range(SECTOR_SIZE):
-                for y in range(10):
-                    if (x+(pos[0]*SECTOR_SIZE), y, z+(pos[1]*SECTOR_SIZE)) in self.world:
-                        self.remove_block((x+(pos[0]*SECTOR_SIZE), y, z+(pos[1]*SECTOR_SIZE)), immediate=True)
-        self.loaded_chunks.remove((pos[0], pos[1]))
-    
-    def check_chunks(self, x=0, z=0):
-        global SECTOR_SIZE
-        
-        for i in self.loaded_chunks:
-            distance = math.dist((i[0], i[1]), (x // SECTOR_SIZE, z // SECTOR_SIZE))
-            if distance > render:
-                self.unload_chunk((i[0], i[1]))
-            
-        for x in range(-render, render):
-            for z in range(-render, render):
-                if not (x+player_pos[0] // SECTOR_SIZE, z+player_pos[2] // SECTOR_SIZE) in self.loaded_chunks:
-                    self.load_chunk((x+player_pos[0] // SECTOR_SIZE, z+player_pos[2] // SECTOR_SIZE))
-
-    def moved_chunks(self, chunk1=(0, 0), chunk2=(0, 0)):
-        return chunk1 != chunk2
-
-    def get_chunked_coords(self, pos=(0, 0)):
-        global SECTOR_SIZE
-        return (pos[0] // SECTOR_SIZE, pos[1] // SECTOR_SIZE)
-
-
-        
-
-    def _initialize(self):
-        global render
-
-        '''
-        self.chunk_updater = threading.Thread(target=self.check_chunks, args=(player_pos[0], player_pos[2]))
-        self.chunk_updater.start()
-        '''
-
-        
-
-        """ Initialize the world by placing all the blocks.
-
-        """
-        '''
-        n = 80  # 1/2 width and height of world
-        s = 1  # step size
-        y = 0  # initial y height
-        for x in xrange(-n, n + 1, s):
-            for z in xrange(-n, n + 1, s):
-                # create a layer stone an grass everywhere.
-                self.add_block((x, y - 2, z), GRASS, immediate=False)
-                self.add_block((x, y - 3, z), STONE, immediate=False)
-                if x in (-n, n) or z in (-n, n):
-                    # create outer walls.
-                    pass
-
-        # generate the hills randomly
-        o = n - 10
-        for _ in xrange(120):
-            a = random.randint(-o, o)  # x position of the hill
-            b = random.randint(-o, o)  # z position of the hill
-            c = -1  # base of the hill
-            h = random.randint(1, 6)  # height of the hill
-            s = random.randint(4, 8)  # 2 * s is the side length of the hill
-            d = 2  # how quickly to taper off the hills
-            t = GRASS
-            for y in xrange(c, c + h):
-                for x in xrange(a - s, a + s + 1):
-                    for z in xrange(b - s, b + s + 1):
-                        if (x - a) ** 2 + (z - b) ** 2 > (s + 1) ** 2:
-                            continue
-                        if (x - 0) ** 2 + (z - 0) ** 2 < 5 ** 2:
-                            continue
-                        self.add_block((x, y, z), t, immediate=False)
-                s -= d  # decrement side length so hills taper off
-        '''
-        '''
-        for x in range(-render, render):
-            for z in range(-render, render):
-                self.load_chunk((x, z))
-                # self.unload_chunk((x, z))
-        '''
-        self.check_chunks(player_pos[0], player_pos[2])
-
-
-    
-        
-
-    def hit_test(self, position, vector, max_distance=8):
-        """ Line of sight search from current position. If a block is
-        intersected it is returned, along with the block previously in the line
-        of sight. If no block is found, return None, None.
-
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position to check visibility from.
-        vector : tuple of len 3
-            The line of sight vector.
-        max_distance : int
-            How many blocks away to search for a hit.
-
-        """
-        m = 8
-        x, y, z = position
-        dx, dy, dz = vector
-        previous = None
-        for _ in xrange(max_distance * m):
-            key = normalize((x, y, z))
-            if key != previous and key in self.world:
-                return key, previous
-            previous = key
-            x, y, z = x + dx / m, y + dy / m, z + dz / m
-        return None, None
-
-    def exposed(self, position):
-        """ Returns False is given `position` is surrounded on all 6 sides by
-        blocks, True otherwise.
-
-        """
-        x, y, z = position
-        for dx, dy, dz in FACES:
-            if (x + dx, y + dy, z + dz) not in self.world:
-                return True
-        return False
-
-    def add_block(self, position, texture, immediate=True):
-        """ Add a block with the given `texture` and `position` to the world.
-
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to add.
-        texture : list of len 3
-            The coordinates of the texture squares. Use `tex_coords()` to
-            generate.
-        immediate : bool
-            Whether or not to draw the block immediately.
-
-        """
-        if position in self.world:
-            self.remove_block(position, immediate)
-        self.world[position] = texture
-        self.sectors.setdefault(sectorize(position), []).append(position)
-        if immediate:
-            if self.exposed(position):
-                self.show_block(position)
-            self.check_neighbors(position)
-
-    def remove_block(self, position, immediate=True):
-        """ Remove the block at the given `position`.
-
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to remove.
-        immediate : bool
-            Whether or not to immediately remove block from canvas.
-
-        """
-        del self.world[position]
-        self.sectors[sectorize(position)].remove(position)
-        if immediate:
-            if position in self.shown:
-                self.hide_block(position)
-            self.check_neighbors(position)
-
-    def check_neighbors(self, position):
-        """ Check all blocks surrounding `position` and ensure their visual
-        state is current. This means hiding blocks that are not exposed and
-        ensuring that all exposed blocks are shown. Usually used after a block
-        is added or removed.
-
-        """
-        x, y, z = position
-        for dx, dy, dz in FACES:
-            key = (x + dx, y + dy, z + dz)
-            if key not in self.world:
-                continue
-            if self.exposed(key):
-                if key not in self.shown:
-                    self.show_block(key)
-            else:
-                if key in self.shown:
-                    self.hide_block(key)
-
-    def show_block(self, position, immediate=True):
-        """ Show the block at the given `position`. This method assumes the
-        block has already been added with add_block()
-
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to show.
-        immediate : bool
-            Whether or not to show the block immediately.
-
-        """
-        texture = self.world[position]
-        self.shown[position] = texture
-        if immediate:
-            self._show_block(position, texture)
-        else:
-            self._enqueue(self._show_block, position, texture)
-
-    def _show_block(self, position, texture):
-        """ Private implementation of the `show_block()` method.
-
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to show.
-        texture : list of len 3
-            The coordinates of the texture squares. Use `tex_coords()` to
-            generate.
-
-        """
-        x, y, z = position
-        vertex_data = cube_vertices(x, y, z, 0.5)
-        texture_data = list(texture)
-        # create vertex list
-        # FIXME Maybe `add_indexed()` should be used instead
-        self._shown[position] = self.batch.add(24, GL_QUADS, self.group,
-            ('v3f/static', vertex_data),
-            ('t2f/static', texture_data))
-
-    def hide_block(self, position, immediate=True):
-        """ Hide the block at the given `position`. Hiding does not remove the
-        block from the world.
-
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to hide.
-        immediate : bool
-            Whether or not to immediately remove the block from the canvas.
-
-        """
-        self.shown.pop(position)
-        if immediate:
-            self._hide_block(position)
+        atlas = image.load(TEXTURE_PATH)
+        self.group = TextureGroup(atlas.get_texture())
+
+        # The same texture as one layer per square, used by greedy meshes.
+        self.tiled_group = TextureGroup(texture_array(atlas))
+
+        # Each group with the texture matrix scale turning the stored texture
+        # coordinates into texture space.
+        self.groups = [
+            (self.group, (1.0 / ATLAS_SIZE, 1.0 / ATLAS_SIZE, 1.0)),
+            (self.tiled_group, (1.0, 1.0, LAYER_SCALE)),
+        ]
+
+        # Mapping from mesh key to the (VertexList, TextureGroup, origin) of
+        # its mesh.
+        self.vertex_lists = {}
+
+    def add_mesh(self, key, vertex_data, texture_data, tiled):
+        self.remove_mesh(key)
+        if tiled:
+            group, texture_format = self.tiled_group, TILED_FORMAT
         else:
-            self._enqueue(self._hide_block, position)
-
-    def _hide_block(self, position):
-        """ Private implementation of the 'hide_block()` method.
-
-        """
-        try:
-            self._shown.pop(position).delete()
-        except:
-            pass
-
-    def show_sector(self, sector):
-        """ Ensure all blocks in the given sector that should be shown are
-        drawn to the canvas.
-
-        """
-        for position in self.sectors.get(sector, []):
-            if position not in self.shown and self.exposed(position):
-                self.show_block(position, False)
-            else:
-                self.add_block(position, GRASS)
-
-    def hide_sector(self, sector):
-        """ Ensure all blocks in the given sector that should be hidden are
-        removed from the canvas.
-
-        """
-        for position in self.sectors.get(sector, []):
-            if position in self.shown:
-                self.hide_block(position, False)
-
-    def change_sectors(self, before, after):
-        """ Move from sector `before` to sector `after`. A sector is a
-        contiguous x, y sub-region of world. Sectors are used to speed up
-        world rendering.
-
-        """
-        before_set = set()
-        after_set = set()
-        pad = 4
-        for dx in xrange(-pad, pad + 1):
-            for dy in [0]:  # xrange(-pad, pad + 1):
-                for dz in xrange(-pad, pad + 1):
-                    if dx ** 2 + dy ** 2 + dz ** 2 > (pad + 1) ** 2:
-                        continue
-                    if before:
-                        x, y, z = before
-                        before_set.add((x + dx, y + dy, z + dz))
-                    if after:
-                        x, y, z = after
-                        after_set.add((x + dx, y + dy, z + dz))
-        show = after_set - before_set
-        hide = before_set - after_set
-        for sector in show:
-            self.show_sector(sector)
-        for sector in hide:
-            self.hide_sector(sector)
-
-    def _enqueue(self, func, *args):
-        """ Add `func` to the internal queue.
-
-        """
-        self.queue.append((func, args))
-
-    def _dequeue(self):
-        """ Pop the top function from the internal queue and call it.
-
-        """
-        func, args = self.queue.popleft()
-        func(*args)
-
-    def process_queue(self):
-        """ Process the entire queue while taking periodic breaks. This allows
-        the game loop to run smoothly. The queue contains calls to
-        _show_block() and _hide_block() so this method should be called if
-        add_block() or remove_block() was called with immediate=False
-
-        """
-        start = time.perf_counter()
-        while self.queue and time.perf_counter() - start < 1.0 / TICKS_PER_SEC:
-            self._dequeue()
-
-    def process_entire_queue(self):
-        """ Process the entire queue with no breaks.
-
-        """
-        while self.queue:
-            self._dequeue()
+            group, texture_format = self.group, ATLAS_FORMAT
+        vertex_list = pyglet.graphics.vertex_list(len(vertex_data) // 3,
+            (VERTEX_FORMAT + '/static', vertex_data),
+            (texture_format + '/static', texture_data))
+        self.vertex_lists[key] = (vertex_list, group, mesh_origin(key))
+
+    def remove_mesh(self, key):
+        entry = self.vertex_lists.pop(key, None)
+        if entry is not None:
+            entry[0].delete()
+
+    def draw(self, keys=None):
+        if keys is None:
+            keys = list(self.vertex_lists)
+        vertex_lists = self.vertex_lists
+        for group, scale in self.groups:
+            group.set_state()
+            glMatrixMode(GL_TEXTURE)
+            glLoadIdentity()
+            glScalef(*scale)
+            glMatrixMode(GL_MODELVIEW)
+            for key in keys:
+                entry = vertex_lists.get(key)
+                if entry is not None and entry[1] is group:
+                    glPushMatrix()
+                    glTranslatef(*entry[2])
+                    entry[0].draw(GL_QUADS)
+                    glPopMatrix()
+            group.unset_state()
+        glMatrixMode(GL_TEXTURE)
+        glLoadIdentity()
+        glMatrixMode(GL_MODELVIEW)
 
-    
-        
 
 class Slot():
     def __inti__(self, x=0, y=0, contents=None):
@@ -540,16 +177,18 @@ class Slot():
 class Window(pyglet.window.Window):
 
     def __init__(self, *args, **kwargs):
+        # The (host, port) of the server to play on, or None to play a local
+        # world.
+        server = kwargs.pop('server', None)
         super(Window, self).__init__(*args, **kwargs)
 
         # Whether or not the window exclusively captures the mouse.
         self.exclusive = False
         self.health = 10
-        self.health_cooldown = 500
-        self.health_regen = 3010
+        self.health_cooldown = HURT_COOLDOWN
+        self.health_regen = REGEN_DELAY
         self.hurt_batch = pyglet.graphics.Batch()
 
-        self.last_pos = (0, 0, 0)
         
         self.last_chunk = (0, 0)
         self.current_chunk = (0, 0)
@@ -605,7 +244,21 @@ class Window(pyglet.window.Window):
             key._6, key._7, key._8, key._9, key._0]
 
         # Instance of the model that handles the world.
-        self.model = Model()
+        if server is None:
+            self.model = Model(VertexListRenderer(), spawn=self.position)
+        else:
+            self.model = RemoteModel(ServerConnection(*server),
+                                     VertexListRenderer(), spawn=self.position)
+
+        # Start just above the ground.
+        x, _, z = self.position
+        self.position = (x, self.model.surface_height(x, z) + PLAYER_HEIGHT, z)
+
+        # Images of the HUD.
+        self.hotbar_image = image.load('hotbar.png')
+        self.player_inventory = image.load('player_inventory.png')
+        self.heart = image.load('heart.png')
+        self.empty_heart = image.load('heart_empty.png')
 
         
 
@@ -614,10 +267,30 @@ class Window(pyglet.window.Window):
             x=10, y=self.height - 10, anchor_x='left', anchor_y='top',
             color=(0, 0, 0, 255))
 
+        # Times each phase of update() and on_draw().
+        self.profiler = FrameProfiler(PROFILE_HISTORY)
+
+        # Whether the profiler graph is shown. Toggle with F3.
+        self.show_profile = False
+
+        # Per-phase timings shown under the profiler graph.
+        self.profile_label = pyglet.text.Label('', font_name='Arial',
+            font_size=10, x=10, y=self.height - 160, anchor_x='left',
+            anchor_y='top', width=400, multiline=True,
+            color=(0, 0, 0, 255))
+
         # This call schedules the `update()` method to be called
         # TICKS_PER_SEC. This is the main game event loop.
         pyglet.clock.schedule_interval(self.update, 1.0 / TICKS_PER_SEC)
 
+    def on_close(self):
+        """ Called when the window is closed. Saves the world and stops the
+        chunk generator's worker processes.
+
+        """
+        self.model.close()
+        super(Window, self).on_close()
+
     def set_exclusive_mouse(self, exclusive):
         """ If `exclusive` is True, the game will capture the mouse, if False
         the game will ignore the mouse.
@@ -683,7 +356,6 @@ class Window(pyglet.window.Window):
         return (dx, dy, dz)
 
     def update(self, dt):
-        global player_pos
         """ This method is scheduled to be called repeatedly by the pyglet
         clock.
 
@@ -693,26 +365,27 @@ class Window(pyglet.window.Window):
             The change in time since the last call.
 
         """
-        
-        self.model.process_queue()
-        sector = sectorize(self.position)
-        if sector != self.sector:
-            self.model.change_sectors(self.sector, sector)
-            if self.sector is None:
-                self.model.process_entire_queue()
-            self.sector = sector
-        m = 8
-        dt = min(dt, 0.2)
-        for _ in xrange(m):
-            self._update(dt / m)
-
-        player_pos = self.position
-        
-    def difference(self, a, b):
-        if a > b:
-            return a - b
-        else:
-            return b - a
+        profiler = self.profiler
+        with profiler.phase('update'):
+            self.model.queue.adapt(dt)
+            self.model.queue.set_focus(self.position, self.get_sight_vector())
+            with profiler.phase('process_generated'):
+                self.model.process_generated(GENERATION_BUDGET)
+            with profiler.phase('process_queue'):
+                self.model.process_queue()
+            sector = sectorize(self.position)
+            if sector != self.sector:
+                with profiler.phase('change_sectors'):
+                    self.model.change_sectors(self.sector, sector)
+                    if self.sector is None:
+                        self.model.process_entire_queue()
+                self.sector = sector
+            with profiler.phase('physics'):
+                self._update(min(dt, 0.2))
+
+            if self.gen_chunks:
+                with profiler.phase('check_chunks'):
+                    self.model.check_chunks(self.position[0], self.position[2])
 
     def _update(self, dt):
         global PLAYER_HEIGHT, health
@@ -743,48 +416,39 @@ class Window(pyglet.window.Window):
             self.dy = max(self.dy, -TERMINAL_VELOCITY)
             dy += self.dy * dt
         # collisions
-        x, y, z = self.position
-        x, y, z = self.collide((x + dx, y + dy, z + dz), PLAYER_HEIGHT)
-        
-        self.position = (x, y, z)
+        self.position = self.collide((dx, dy, dz), PLAYER_HEIGHT)
         if self.flying:
             PLAYER_HEIGHT = 1
         elif not self.flying:
             PLAYER_HEIGHT = 2
         if self.gamemode != 'creative':
             if self.position[1] < -10:
-                if self.health_cooldown < 1:
+                if self.health_cooldown <= 0:
                     self.health -= 2
-                    self.health_cooldown = 500
-                    self.health_regen = 3010
+                    self.health_cooldown = HURT_COOLDOWN
+                    self.health_regen = REGEN_DELAY
 
         if self.health < 1:
             print('You died')
             exit()
 
-        self.health_cooldown -= 1
+        self.health_cooldown -= dt
 
-        if self.health_regen < 1:
+        if self.health_regen <= 0:
             if self.health < 10:
                 self.health += 1
-                self.health_regen = 3010
+                self.health_regen = REGEN_DELAY
         else:
-            self.health_regen -= 1
-        if self.gen_chunks:
-            if self.difference(self.position[0], self.last_pos[0]) < 5  and self.difference(self.position[2], self.last_pos[2]) < 5:
-                pass
-            else:
-                self.last_pos = (self.position[0], self.position[1], self.position[2])
-                self.model.check_chunks(player_pos[0], player_pos[2])
+            self.health_regen -= dt
 
-    def collide(self, position, height):
-        """ Checks to see if the player at the given `position` and `height`
-        is colliding with any blocks in the world.
+    def collide(self, motion, height):
+        """ Moves the player by `motion`, stopping it where it runs into
+        blocks in the world.
 
         Parameters
         ----------
-        position : tuple of len 3
-            The (x, y, z) position to check for collisions at.
+        motion : tuple of len 3
+            The (dx, dy, dz) distance to move.
         height : int or float
             The height of the player.
 
@@ -794,39 +458,18 @@ class Window(pyglet.window.Window):
             The new position of the player taking into account collisions.
 
         """
-        # How much overlap with a dimension of a surrounding block you need to
-        # have to count as a collision. If 0, touching terrain at all counts as
-        # a collision. If .49, you sink into the ground, as if walking through
-        # tall grass. If >= .5, you'll fall through the ground.
-        pad = 0.25
-        p = list(position)
-        np = normalize(position)
-        for face in FACES:  # check all surrounding blocks
-            for i in xrange(3):  # check each dimension independently
-                if not face[i]:
-                    continue
-                # How much overlap you have with this dimension.
-                d = (p[i] - np[i]) * face[i]
-                if d < pad:
-                    continue
-                for dy in xrange(height):  # check each height
-                    op = list(np)
-                    op[1] -= dy
-                    op[i] += face[i]
-                    if tuple(op) not in self.model.world:
-                        continue
-                    p[i] -= (d - pad) * face[i]
-                    if face == (0, -1, 0) or face == (0, 1, 0):
-                        # You are colliding with the ground or ceiling, so stop
-                        # falling / rising.
-                        self.dy = 0
-                        if face == (0, 1, 0):
-                            self.dy = -0.1
-                    break
-        return tuple(p)
+        position, hits = physics.move(
+            self.model.world, self.position, motion, height)
+        for face in hits:
+            if face == (0, -1, 0) or face == (0, 1, 0):
+                # You are colliding with the ground or ceiling, so stop
+                # falling / rising.
+                self.dy = 0
+                if face == (0, 1, 0):
+                    self.dy = -0.1
+        return position
 
     def on_mouse_press(self, x, y, button, modifiers):
-        global gui_blocks
         """ Called when a mouse button is pressed. See pyglet docs for button
         amd modifier mappings.
 
@@ -849,13 +492,12 @@ class Window(pyglet.window.Window):
                 block, previous = self.model.hit_test(self.position, vector)
                 if (button == mouse.RIGHT):
                     if previous:
-                        if self.model.world[block] != CRAFTING_TABLE:
+                        if not BLOCKS[self.model.world[block]].gui:
                             if block != (round(self.position[0]), round(self.position[1]), round(self.position[2])) or block != (round(self.position[0]), round(self.position[1] + 1), round(self.position[2])):
                                 self.model.add_block(previous, self.block)
                         
                 elif button == pyglet.window.mouse.LEFT and block:
-                    texture = self.model.world[block]
-                    if texture != STONE:
+                    if BLOCKS[self.model.world[block]].breakable:
                         self.model.remove_block(block)
         else:
             if not self.inventory_open:
@@ -870,9 +512,9 @@ class Window(pyglet.window.Window):
             return None
         if y < INVENTORY_POS[1]:
             return None
-        if x > INVENTORY_POS[0] + player_inventory.width:
+        if x > INVENTORY_POS[0] + self.player_inventory.width:
             return None
-        if y > INVENTORY_POS[1] + player_inventory.height:
+        if y > INVENTORY_POS[1] + self.player_inventory.height:
             return None
 
     def on_mouse_motion(self, x, y, dx, dy):
@@ -937,6 +579,15 @@ class Window(pyglet.window.Window):
                     self.gamemode = 'creative'
             elif symbol == key.Q:
                 self.gen_chunks = not self.gen_chunks
+            elif symbol == key.G:
+                stats = self.model.set_greedy(not self.model.greedy)
+                print('naive: %(naive)d triangles, greedy: %(greedy)d triangles' % stats)
+            elif symbol == key.F3:
+                self.show_profile = not self.show_profile
+            elif symbol == key.F4:
+                path = 'trace-%d.json' % time.time()
+                self.profiler.dump(path)
+                print('wrote %s' % path)
             elif symbol == key.T or symbol == key.SLASH:
                 self.chat_open = True
         
@@ -991,6 +642,7 @@ class Window(pyglet.window.Window):
         """
         # label
         self.label.y = height - 10
+        self.profile_label.y = height - 160
         # reticle
         if self.reticle:
             self.reticle.delete()
@@ -1025,7 +677,7 @@ class Window(pyglet.window.Window):
         glViewport(0, 0, max(1, viewport[0]), max(1, viewport[1]))
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
-        gluPerspective(FOV, width / float(height), 0.1, 60.0)
+        gluPerspective(FOV, width / float(height), NEAR_PLANE, FAR_PLANE)
         glMatrixMode(GL_MODELVIEW)
         glLoadIdentity()
         x, y = self.rotation
@@ -1034,39 +686,58 @@ class Window(pyglet.window.Window):
         x, y, z = self.position
         glTranslatef(-x, -y, -z)
 
+    def get_frustum(self):
+        """ Return the view frustum of the camera as `set_3d()` sets it up.
+
+        """
+        width, height = self.get_size()
+        return Frustum(self.position, self.rotation, FOV,
+            width / float(max(1, height)), NEAR_PLANE, FAR_PLANE)
+
     def on_draw(self):
         """ Called by pyglet to draw the canvas.
 
         """
         global INVENTORY_POS
-        
-        self.clear()
-        self.set_3d()
-        glColor3d(1, 1, 1)
-        
-        self.model.batch.draw()
-        
-        self.set_2d()
-        glEnable(GL_BLEND)
-        hotbar_image.blit(self.width // 2 - 230, 0, z=-1)
-        if self.inventory_open:
-            player_inventory.blit(INVENTORY_POS[0], INVENTORY_POS[1])
-        for i in range(10):
-            if self.gamemode == 'survival':
-                if i < self.health:
-                    heart.blit(self.width // 2 - 210 + i*21, 60, z=-1)
-                else:
-                    empty_heart.blit(self.width // 2 - 210 +i*21, 60, z=-1)
-        self.draw_label()
-        
-        if not self.inventory_open:
-            self.draw_reticle()
-        self.set_3d()
-        if not self.inventory_open:
-            self.draw_focused_block()
+        profiler = self.profiler
+        profiler.frame()
+        with profiler.phase('draw'):
+            self.clear()
+            self.set_3d()
+            glColor3d(1, 1, 1)
+
+            with profiler.phase('cull'):
+                keys = self.model.visible_meshes(
+                    self.get_frustum(), self.position)
+            with profiler.phase('draw_world'):
+                self.model.renderer.draw(keys)
+
+            self.set_2d()
+            glEnable(GL_BLEND)
+            with profiler.phase('draw_hud'):
+                self.hotbar_image.blit(self.width // 2 - 230, 0, z=-1)
+                if self.inventory_open:
+                    self.player_inventory.blit(INVENTORY_POS[0], INVENTORY_POS[1])
+                for i in range(10):
+                    if self.gamemode == 'survival':
+                        if i < self.health:
+                            self.heart.blit(self.width // 2 - 210 + i*21, 60, z=-1)
+                        else:
+                            self.empty_heart.blit(self.width // 2 - 210 +i*21, 60, z=-1)
+            with profiler.phase('draw_label'):
+                self.draw_label()
+            if self.show_profile:
+                self.draw_profile()
 
-        if self.chat_open:
-            empty_heart.blit(100, 100, z=-1)
+            if not self.inventory_open:
+                self.draw_reticle()
+            self.set_3d()
+            if not self.inventory_open:
+                with profiler.phase('draw_focused_block'):
+                    self.draw_focused_block()
+
+            if self.chat_open:
+                self.empty_heart.blit(100, 100, z=-1)
 
     def draw_focused_block(self):
         """ Draw black edges around the block that is currently under the
@@ -1088,11 +759,37 @@ class Window(pyglet.window.Window):
 
         """
         x, y, z = self.position
-        self.label.text = '%02d (%.2f, %.2f, %.2f) %d / %d' % (
+        queue = self.model.queue
+        self.label.text = '%02d (%.2f, %.2f, %.2f) %d tris (%s) %d lod / %d q%d %dms %d drawn %d culled %d occluded' % (
             pyglet.clock.get_fps(), round(x), round(y), round(z),
-            len(self.model._shown), len(self.model.world))
+            self.model.face_count * 2,
+            'greedy' if self.model.greedy else 'naive',
+            self.model.lod_face_count * 2, len(self.model.world),
+            len(queue), queue.mean_latency * 1000,
+            self.model.drawn, self.model.culled, self.model.occluded)
         self.label.draw()
 
+    def draw_profile(self):
+        """ Draw a graph of the recent frame times, with a line at the
+        target frame time, and the slowest phases below it.
+
+        """
+        times = self.profiler.frame_times()[-300:]
+        x0, y0 = 10, self.height - 150
+        scale = 100.0 / PROFILE_GRAPH_MS
+        target = 1000.0 / TICKS_PER_SEC * scale
+        vertex_data = [x0, y0 + target, x0 + 300, y0 + target]
+        for i, t in enumerate(times):
+            vertex_data.extend((x0 + i, y0, x0 + i, y0 + min(t, PROFILE_GRAPH_MS) * scale))
+        glColor3d(0, 0, 0)
+        pyglet.graphics.draw(len(vertex_data) // 2, GL_LINES,
+            ('v2f', vertex_data))
+        lines = ['%-20s %6.2f %6.2f %6.2f ms' % (name, s['mean'], s['p99'], s['max'])
+                 for name, s in list(self.profiler.stats().items())[:8]]
+        header = '%-20s %6s %6s %6s' % ('phase', 'mean', 'p99', 'max')
+        self.profile_label.text = '\n'.join([header] + lines)
+        self.profile_label.draw()
+
     def draw_reticle(self):
         """ Draw the crosshairs in the center of the screen.
 
@@ -1115,8 +812,8 @@ def setup_fog():
     glFogi(GL_FOG_MODE, GL_LINEAR)
     # How close and far away fog starts and ends. The closer the start and end,
     # the denser the fog in the fog range.
-    glFogf(GL_FOG_START, 40.0)
-    glFogf(GL_FOG_END, 60.0)
+    glFogf(GL_FOG_START, FOG_START)
+    glFogf(GL_FOG_END, FOG_END)
 
 
 def setup():
@@ -1139,7 +836,16 @@ def setup():
 
 
 def main():
-    window = Window(width=800, height=600, caption='Pyglet', resizable=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connect', metavar='HOST:PORT',
+                        help='play on a server started with server.py')
+    args = parser.parse_args()
+    server = None
+    if args.connect:
+        host, port = args.connect.rsplit(':', 1)
+        server = (host, int(port))
+    window = Window(width=800, height=600, caption='Pyglet', resizable=True,
+                    server=server)
     # Hide the mouse cursor and prevent the mouse from leaving the window.
     window.set_exclusive_mouse(True)
     setup()
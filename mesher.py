@@ -0,0 +1,360 @@
+""" Section mesh building.
+
+Rather than giving every block its own 24-vertex list, all the faces of a
+section are gathered into one vertex list. Faces that touch another opaque
+block can never be seen, so they are left out; they are found with NumPy over
+the whole section at once. Greedy meshing additionally merges runs of
+matching faces into single quads.
+
+Meshes are stored compactly as shorts rather than floats. Vertices are
+section-local block corners, placed in the world by translating the mesh to
+`mesh_origin()`, and texture coordinates count whole atlas squares or
+texture array layers, scaled back by the texture matrix when drawn.
+
+"""
+
+import numpy as np
+
+from blocks import OPAQUE, UV_TABLE, UV_STRIDE, LAYER_TABLE, ATLAS_SIZE
+from chunks import CHUNK_SIZE, SECTION_SIZE
+
+
+def cube_vertices(x, y, z, n):
+    """ Return the vertices of the cube at position x, y, z with size 2*n.
+
+    """
+    return [
+        x-n,y+n,z-n, x-n,y+n,z+n, x+n,y+n,z+n, x+n,y+n,z-n,  # top
+        x-n,y-n,z-n, x+n,y-n,z-n, x+n,y-n,z+n, x-n,y-n,z+n,  # bottom
+        x-n,y-n,z-n, x-n,y-n,z+n, x-n,y+n,z+n, x-n,y+n,z-n,  # left
+        x+n,y-n,z+n, x+n,y-n,z-n, x+n,y+n,z-n, x+n,y+n,z+n,  # right
+        x-n,y-n,z+n, x+n,y-n,z+n, x+n,y+n,z+n, x-n,y+n,z+n,  # front
+        x+n,y-n,z-n, x-n,y-n,z-n, x-n,y+n,z-n, x+n,y+n,z-n,  # back
+    ]
+
+
+# The direction each face of a cube points in, in the same order as the faces
+# of `cube_vertices()`.
+FACES = [
+    ( 0, 1, 0),
+    ( 0,-1, 0),
+    (-1, 0, 0),
+    ( 1, 0, 0),
+    ( 0, 0, 1),
+    ( 0, 0,-1),
+]
+
+# Number of floats per face in the vertex and texture coordinate data.
+FACE_VERTEX_SIZE = 12
+FACE_UV_SIZE = UV_STRIDE // len(FACES)
+
+# Number of layers in the texture array used by greedy meshes.
+ATLAS_LAYERS = ATLAS_SIZE * ATLAS_SIZE
+
+# pyglet vertex formats of the meshes: positions, texture atlas coordinates,
+# and texture array coordinates for tiled meshes.
+VERTEX_FORMAT = 'v3s'
+ATLAS_FORMAT = 't2s'
+TILED_FORMAT = 't3s'
+
+# Texture array coordinates store 2 * layer + 1, the middle of the layer in
+# units of half a layer, so they stay integers. The texture matrix scales r
+# by this to get back to [0, 1].
+LAYER_SCALE = 1.0 / (2 * ATLAS_LAYERS)
+
+# Bytes per component of the pyglet vertex format types.
+_TYPE_BYTES = {'b': 1, 'B': 1, 's': 2, 'S': 2, 'i': 4, 'I': 4, 'f': 4, 'd': 8}
+
+_UNIT_CUBE = cube_vertices(0, 0, 0, 0.5)
+
+# The corner offsets of each face's quad from the block center.
+_FACE_CORNERS = [
+    _UNIT_CUBE[i * FACE_VERTEX_SIZE:(i + 1) * FACE_VERTEX_SIZE]
+    for i in range(len(FACES))
+]
+
+# The same corner offsets as (4, 3) arrays.
+_FACE_CORNER_ARRAYS = [
+    np.array(corners, dtype=np.float64).reshape(4, 3) for corners in _FACE_CORNERS
+]
+
+# The same corner offsets from the low corner of the block, as integers.
+_FACE_CORNER_OFFSETS = [
+    (corners + 0.5).astype(np.int64) for corners in _FACE_CORNER_ARRAYS
+]
+
+# No faces, for sections that are all air.
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+# For each face: the axis it points along, and the axes its texture's u and v
+# run along in `cube_vertices()`.
+_FACE_AXES = [
+    (1, 2, 0),  # top
+    (1, 0, 2),  # bottom
+    (0, 2, 1),  # left
+    (0, 2, 1),  # right
+    (2, 0, 1),  # front
+    (2, 0, 1),  # back
+]
+
+
+def mesh_origin(key):
+    """ Return the world position that the coordinates of the mesh at `key`
+    are relative to: the low corner of a section for an (x, y, z) section
+    key, or of a chunk for an (x, z) chunk key.
+
+    """
+    if len(key) == 2:
+        x, z = key
+        y = 0
+    else:
+        x, y, z = key
+    # Blocks are centered on integer coordinates.
+    return (x * CHUNK_SIZE - 0.5, y * SECTION_SIZE - 0.5, z * CHUNK_SIZE - 0.5)
+
+
+def face_bytes(*formats):
+    """ Return the number of bytes one quad takes with the pyglet vertex
+    `formats`, e.g. `face_bytes(VERTEX_FORMAT, ATLAS_FORMAT)`.
+
+    """
+    return 4 * sum(int(fmt[1]) * _TYPE_BYTES[fmt[2]] for fmt in formats)
+
+
+def padded_section(world, key):
+    """ Return the blocks of the section at `key` with a border one block
+    wide taken from the six sections around it, or None if the section is all
+    air.
+
+    Returns
+    -------
+    blocks : ndarray of uint8, shape (SECTION_SIZE + 2,) * 3
+        Indexed by y, then z, then x, offset by one. Unloaded neighbours are
+        air.
+
+    """
+    section = world.section(key)
+    if section is None:
+        return None
+    x, y, z = key
+    padded = np.zeros((SECTION_SIZE + 2,) * 3, dtype=np.uint8)
+    padded[1:-1, 1:-1, 1:-1] = section.array()
+    get = world.section
+    other = get((x, y + 1, z))
+    if other is not None:
+        padded[-1, 1:-1, 1:-1] = other.array()[0]
+    other = get((x, y - 1, z))
+    if other is not None:
+        padded[0, 1:-1, 1:-1] = other.array()[-1]
+    other = get((x, y, z + 1))
+    if other is not None:
+        padded[1:-1, -1, 1:-1] = other.array()[:, 0]
+    other = get((x, y, z - 1))
+    if other is not None:
+        padded[1:-1, 0, 1:-1] = other.array()[:, -1]
+    other = get((x + 1, y, z))
+    if other is not None:
+        padded[1:-1, 1:-1, -1] = other.array()[:, :, 0]
+    other = get((x - 1, y, z))
+    if other is not None:
+        padded[1:-1, 1:-1, 0] = other.array()[:, :, -1]
+    return padded
+
+
+def face_arrays(world, key):
+    """ Find the faces of the section at `key` that touch a transparent
+    block, one face direction at a time. Neighbouring sections are consulted
+    so faces on the section border are culled too.
+
+    Returns
+    -------
+    faces : list of tuple
+        For each face in `FACES`, the section-local (x, y, z) coordinates of
+        the blocks showing that face and their block ids, as four arrays.
+
+    """
+    padded = padded_section(world, key)
+    if padded is None:
+        return [(_EMPTY,) * 4] * len(FACES)
+    n = SECTION_SIZE
+    blocks = padded[1:-1, 1:-1, 1:-1]
+    solid = blocks != 0
+    opaque = np.frombuffer(OPAQUE, dtype=np.uint8)
+    faces = []
+    for dx, dy, dz in FACES:
+        neighbours = padded[1 + dy:n + 1 + dy, 1 + dz:n + 1 + dz, 1 + dx:n + 1 + dx]
+        ys, zs, xs = np.nonzero(solid & (opaque[neighbours] == 0))
+        faces.append((xs, ys, zs, blocks[ys, zs, xs]))
+    return faces
+
+
+def visible_faces(world, key):
+    """ Generate the faces of the section at `key` that touch a transparent
+    block.
+
+    Yields
+    ------
+    face : int
+        The index of the face in `FACES`.
+    x, y, z : int
+        The section-local position of the block.
+    block : int
+        The id of the block.
+
+    """
+    for face, arrays in enumerate(face_arrays(world, key)):
+        for x, y, z, block in zip(*[a.tolist() for a in arrays]):
+            yield face, x, y, z, block
+
+
+def build_section_mesh(world, key):
+    """ Build the geometry of the section at `key`, one quad per visible
+    face.
+
+    Parameters
+    ----------
+    world : ChunkStore
+        The world the section belongs to.
+    key : tuple of len 3
+        The (x, y, z) key of the section.
+
+    Returns
+    -------
+    vertices : list of int
+        Four (x, y, z) vertices per face relative to `mesh_origin(key)`, for
+        drawing as GL_QUADS.
+    tex_coords : list of int
+        Four (u, v) texture atlas coordinates per face, in atlas squares.
+
+    """
+    # Atlas coordinates are whole squares, so they are stored as such.
+    uvs = np.rint(np.frombuffer(UV_TABLE, dtype=np.float32) * ATLAS_SIZE)
+    uvs = uvs.astype(np.int64)
+    uv_offsets = np.arange(FACE_UV_SIZE)
+    vertices = []
+    tex_coords = []
+    for face, (xs, ys, zs, ids) in enumerate(face_arrays(world, key)):
+        if not len(xs):
+            continue
+        positions = np.stack([xs, ys, zs], axis=1)
+        vertices.append((positions[:, None, :] + _FACE_CORNER_OFFSETS[face]).ravel())
+        start = ids.astype(np.int64) * UV_STRIDE + face * FACE_UV_SIZE
+        tex_coords.append(uvs[start[:, None] + uv_offsets].ravel())
+    if not vertices:
+        return [], []
+    return (np.concatenate(vertices).tolist(),
+            np.concatenate(tex_coords).tolist())
+
+
+def build_greedy_mesh(world, key):
+    """ Build the geometry of the section at `key`, merging adjacent visible
+    faces that point the same way and share a texture into larger quads.
+
+    The texture coordinates count whole squares along each side of a quad,
+    so the texture must repeat; see `main.texture_array()`.
+
+    Parameters
+    ----------
+    world : ChunkStore
+        The world the section belongs to.
+    key : tuple of len 3
+        The (x, y, z) key of the section.
+
+    Returns
+    -------
+    vertices : list of int
+        Four (x, y, z) vertices per quad relative to `mesh_origin(key)`, for
+        drawing as GL_QUADS.
+    tex_coords : list of int
+        Four (u, v, r) texture array coordinates per quad, where r is
+        `2 * layer + 1`; see `LAYER_SCALE`.
+
+    """
+    # Visible faces grouped by face and slice along the face's normal. Each
+    # slice maps the face's in-plane (u, v) cell to its texture layer.
+    slices = {}
+    layers = LAYER_TABLE
+    for face, x, y, z, block in visible_faces(world, key):
+        normal, u_axis, v_axis = _FACE_AXES[face]
+        position = (x, y, z)
+        cells = slices.setdefault((face, position[normal]), {})
+        cells[(position[u_axis], position[v_axis])] = layers[block * 6 + face]
+
+    vertices = []
+    tex_coords = []
+    add_vertices = vertices.extend
+    add_tex_coords = tex_coords.extend
+    for (face, depth), cells in slices.items():
+        normal, u_axis, v_axis = _FACE_AXES[face]
+        corners = _FACE_CORNERS[face]
+        for u, v, width, height, layer in _merge(cells):
+            low = [0, 0, 0]
+            size = [1, 1, 1]
+            low[normal] = depth
+            low[u_axis] = u
+            low[v_axis] = v
+            size[u_axis] = width
+            size[v_axis] = height
+            x0, y0, z0 = low
+            sx, sy, sz = size
+            for i in range(0, FACE_VERTEX_SIZE, 3):
+                add_vertices((
+                    x0 + int(corners[i] + 0.5) * sx,
+                    y0 + int(corners[i + 1] + 0.5) * sy,
+                    z0 + int(corners[i + 2] + 0.5) * sz,
+                ))
+            r = layer * 2 + 1
+            add_tex_coords((0, 0, r, width, 0, r, width, height, r, 0, height, r))
+    return vertices, tex_coords
+
+
+def _merge(cells):
+    """ Greedily cover the `cells` of one slice with rectangles of a single
+    layer.
+
+    Parameters
+    ----------
+    cells : dict
+        Mapping from (u, v) cell to texture layer.
+
+    Yields
+    ------
+    rectangle : tuple of len 5
+        (u, v, width, height, layer) of each rectangle.
+
+    """
+    done = set()
+    for cell in sorted(cells, key=lambda cell: (cell[1], cell[0])):
+        if cell in done:
+            continue
+        u, v = cell
+        layer = cells[cell]
+        width = 1
+        while cells.get((u + width, v)) == layer and (u + width, v) not in done:
+            width += 1
+        height = 1
+        while all(cells.get((u + i, v + height)) == layer and
+                  (u + i, v + height) not in done for i in range(width)):
+            height += 1
+        for j in range(height):
+            for i in range(width):
+                done.add((u + i, v + j))
+        yield u, v, width, height, layer
+
+
+def mesh_stats(world, keys):
+    """ Return the number of triangles the visible sections of the chunks at
+    `keys` take with naive and with greedy meshing.
+
+    Returns
+    -------
+    stats : dict
+        Mapping from 'naive' and 'greedy' to a triangle count.
+
+    """
+    naive = greedy = 0
+    for key in keys:
+        for section in world.visible_sections(key):
+            naive += len(build_section_mesh(world, section)[0]) // FACE_VERTEX_SIZE * 2
+            greedy += len(build_greedy_mesh(world, section)[0]) // FACE_VERTEX_SIZE * 2
+    return {'naive': naive, 'greedy': greedy}
@@ -0,0 +1,236 @@
+""" Vectorized gradient noise for terrain generation.
+
+Noise is evaluated with NumPy over whole arrays of coordinates, so a full
+chunk heightmap (or a batch of them) costs one call instead of one Python
+call per column. 3D noise works the same way over whole chunk volumes.
+
+"""
+
+import numpy as np
+
+from chunks import CHUNK_SIZE
+
+# Unit gradient directions used by the 2D noise.
+_GRADIENTS_2D = np.array([
+    (1, 0), (-1, 0), (0, 1), (0, -1),
+    (1, 1), (-1, 1), (1, -1), (-1, -1),
+], dtype=np.float64)
+_GRADIENTS_2D /= np.sqrt((_GRADIENTS_2D ** 2).sum(axis=1))[:, None]
+
+# Gradient directions used by the 3D noise: the midpoints of the edges of a
+# cube, as in Perlin's improved noise.
+_GRADIENTS_3D = np.array([
+    (1, 1, 0), (-1, 1, 0), (1, -1, 0), (-1, -1, 0),
+    (1, 0, 1), (-1, 0, 1), (1, 0, -1), (-1, 0, -1),
+    (0, 1, 1), (0, -1, 1), (0, 1, -1), (0, -1, -1),
+], dtype=np.float64)
+
+
+def _fade(t):
+    """ Perlin's smootherstep curve, 6t^5 - 15t^4 + 10t^3.
+
+    """
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+
+def _lerp(a, b, t):
+    return a + t * (b - a)
+
+
+class GradientNoise(object):
+    """ Seeded 2D and 3D Perlin gradient noise.
+
+    Parameters
+    ----------
+    seed : int
+        The same seed always produces the same noise.
+
+    """
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        permutation = np.random.RandomState(seed).permutation(256)
+        # Doubled so `perm[perm[x] + y]` never needs wrapping.
+        self.perm = np.concatenate([permutation, permutation])
+
+    def _gradient(self, xi, zi, x, z):
+        """ Dot product of the lattice gradient at xi, zi with the offset x, z.
+
+        """
+        perm = self.perm
+        g = _GRADIENTS_2D[perm[perm[xi] + zi] % len(_GRADIENTS_2D)]
+        return g[..., 0] * x + g[..., 1] * z
+
+    def noise2(self, x, z):
+        """ Return the noise at each of the coordinates `x`, `z`.
+
+        Parameters
+        ----------
+        x, z : array_like
+            Coordinates of matching shape.
+
+        Returns
+        -------
+        values : ndarray
+            Noise values, roughly in [-1, 1].
+
+        """
+        x = np.asarray(x, dtype=np.float64)
+        z = np.asarray(z, dtype=np.float64)
+        x0 = np.floor(x)
+        z0 = np.floor(z)
+        xf = x - x0
+        zf = z - z0
+        xi = x0.astype(np.int64) & 255
+        zi = z0.astype(np.int64) & 255
+        xj = (xi + 1) & 255
+        zj = (zi + 1) & 255
+        u = _fade(xf)
+        v = _fade(zf)
+        a = _lerp(self._gradient(xi, zi, xf, zf),
+                  self._gradient(xj, zi, xf - 1, zf), u)
+        b = _lerp(self._gradient(xi, zj, xf, zf - 1),
+                  self._gradient(xj, zj, xf - 1, zf - 1), u)
+        # The largest value 2D Perlin noise can reach is sqrt(1/2).
+        return _lerp(a, b, v) * np.sqrt(2)
+
+    def _gradient3(self, xi, yi, zi, x, y, z):
+        """ Dot product of the lattice gradient at xi, yi, zi with the offset
+        x, y, z.
+
+        """
+        perm = self.perm
+        g = _GRADIENTS_3D[perm[perm[perm[xi] + yi] + zi] % len(_GRADIENTS_3D)]
+        return g[..., 0] * x + g[..., 1] * y + g[..., 2] * z
+
+    def noise3(self, x, y, z):
+        """ Return the noise at each of the coordinates `x`, `y`, `z`.
+
+        Parameters
+        ----------
+        x, y, z : array_like
+            Coordinates of shapes that broadcast together.
+
+        Returns
+        -------
+        values : ndarray
+            Noise values, roughly in [-1, 1].
+
+        """
+        x, y, z = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64)
+                                        for a in (x, y, z)])
+        x0 = np.floor(x)
+        y0 = np.floor(y)
+        z0 = np.floor(z)
+        xf = x - x0
+        yf = y - y0
+        zf = z - z0
+        xi = x0.astype(np.int64) & 255
+        yi = y0.astype(np.int64) & 255
+        zi = z0.astype(np.int64) & 255
+        xj = (xi + 1) & 255
+        yj = (yi + 1) & 255
+        zj = (zi + 1) & 255
+        u = _fade(xf)
+        v = _fade(yf)
+        w = _fade(zf)
+        g = self._gradient3
+        a = _lerp(_lerp(g(xi, yi, zi, xf, yf, zf),
+                        g(xj, yi, zi, xf - 1, yf, zf), u),
+                  _lerp(g(xi, yj, zi, xf, yf - 1, zf),
+                        g(xj, yj, zi, xf - 1, yf - 1, zf), u), v)
+        b = _lerp(_lerp(g(xi, yi, zj, xf, yf, zf - 1),
+                        g(xj, yi, zj, xf - 1, yf, zf - 1), u),
+                  _lerp(g(xi, yj, zj, xf, yf - 1, zf - 1),
+                        g(xj, yj, zj, xf - 1, yf - 1, zf - 1), u), v)
+        return _lerp(a, b, w)
+
+
+class TerrainNoise(object):
+    """ Fractal noise made of several octaves of `GradientNoise`, each with
+    its own seed derived from `seed`.
+
+    Parameters
+    ----------
+    seed : int
+    octaves : int
+        Number of layers of noise. Each one has twice the frequency and half
+        the amplitude of the one before.
+    scale : float
+        Width in blocks of one feature of the first octave.
+
+    """
+
+    def __init__(self, seed=0, octaves=2, scale=64.0, persistence=0.5,
+                 lacunarity=2.0):
+        self.seed = seed
+        self.scale = scale
+        self.persistence = persistence
+        self.lacunarity = lacunarity
+        self.octaves = [GradientNoise((seed * 31 + i) % 2 ** 32)
+                        for i in range(octaves)]
+
+    def noise2(self, x, z):
+        """ Return the fractal noise at each of the coordinates `x`, `z`, in
+        roughly [-1, 1].
+
+        """
+        x = np.asarray(x, dtype=np.float64) / self.scale
+        z = np.asarray(z, dtype=np.float64) / self.scale
+        total = np.zeros(np.broadcast(x, z).shape)
+        amplitude = 1.0
+        frequency = 1.0
+        norm = 0.0
+        for octave in self.octaves:
+            total += octave.noise2(x * frequency, z * frequency) * amplitude
+            norm += amplitude
+            amplitude *= self.persistence
+            frequency *= self.lacunarity
+        return total / norm
+
+    def noise3(self, x, y, z):
+        """ Return the fractal noise at each of the coordinates `x`, `y`,
+        `z`, in roughly [-1, 1].
+
+        """
+        x = np.asarray(x, dtype=np.float64) / self.scale
+        y = np.asarray(y, dtype=np.float64) / self.scale
+        z = np.asarray(z, dtype=np.float64) / self.scale
+        total = np.zeros(np.broadcast(x, y, z).shape)
+        amplitude = 1.0
+        frequency = 1.0
+        norm = 0.0
+        for octave in self.octaves:
+            total += octave.noise3(x * frequency, y * frequency,
+                                   z * frequency) * amplitude
+            norm += amplitude
+            amplitude *= self.persistence
+            frequency *= self.lacunarity
+        return total / norm
+
+    def heightmaps(self, keys):
+        """ Return the noise over every column of each chunk in `keys`.
+
+        Parameters
+        ----------
+        keys : sequence of tuple of len 2
+            The (x, z) keys of the chunks.
+
+        Returns
+        -------
+        values : ndarray of shape (len(keys), CHUNK_SIZE, CHUNK_SIZE)
+            Indexed by chunk, then local x, then local z.
+
+        """
+        keys = np.asarray(keys, dtype=np.int64).reshape(-1, 2)
+        local = np.arange(CHUNK_SIZE)
+        x = keys[:, 0, None, None] * CHUNK_SIZE + local[None, :, None]
+        z = keys[:, 1, None, None] * CHUNK_SIZE + local[None, None, :]
+        return self.noise2(x, z)
+
+    def heightmap(self, key):
+        """ Return the noise over every column of the chunk at `key`, as an
+        array indexed by local x, then local z.
+
+        """
+        return self.heightmaps([key])[0]
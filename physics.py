@@ -0,0 +1,137 @@
+""" Player collision with the block grid.
+
+The player is an axis-aligned box and blocks are unit cubes centered on
+integer coordinates. A move is resolved with a swept box test: the blocks
+the box could touch anywhere along the motion are gathered once, then the
+motion is clipped one axis at a time to the exact distance at which the box
+first touches a block. Since the whole motion is swept, fast movement cannot
+tunnel through blocks and no sub-stepping is needed.
+
+"""
+
+import math
+
+# Half the width of the player along x and z.
+PLAYER_RADIUS = 0.25
+
+# Distance from the eyes up to the top of the player's box. The bottom of the
+# box is `height - HEAD_ROOM` below the eyes.
+HEAD_ROOM = 0.25
+
+# Tolerance for boxes that only touch, so sliding along a wall or floor does
+# not count as running into it.
+EPSILON = 1e-6
+
+# Order the axes are resolved in: vertical first, so landing happens before
+# sliding along the ground.
+_AXES = (1, 0, 2)
+
+
+def player_box(position, height):
+    """ Return the (low, high) corners of the box of a player whose eyes are
+    at `position` and who is `height` tall.
+
+    """
+    x, y, z = position
+    r = PLAYER_RADIUS
+    return (
+        [x - r, y - (height - 1) - HEAD_ROOM, z - r],
+        [x + r, y + HEAD_ROOM, z + r],
+    )
+
+
+def candidate_blocks(world, low, high, motion):
+    """ Return the positions of the solid blocks that the box from `low` to
+    `high` could touch while moving by `motion`.
+
+    """
+    lo = []
+    hi = []
+    for i in range(3):
+        a = low[i] + min(motion[i], 0)
+        b = high[i] + max(motion[i], 0)
+        # Block n covers n - 0.5 to n + 0.5.
+        lo.append(int(math.floor(a + 0.5 - EPSILON)))
+        hi.append(int(math.floor(b + 0.5 + EPSILON)))
+    blocks = []
+    for x in range(lo[0], hi[0] + 1):
+        for z in range(lo[2], hi[2] + 1):
+            for y in range(lo[1], hi[1] + 1):
+                if (x, y, z) in world:
+                    blocks.append((x, y, z))
+    return blocks
+
+
+def sweep(blocks, low, high, motion):
+    """ Move the box from `low` to `high` by `motion`, stopping it at the
+    blocks in `blocks`. `low` and `high` are updated in place.
+
+    Returns
+    -------
+    motion : list of len 3
+        The part of `motion` the box could move before touching a block.
+    hits : list of tuple of len 3
+        The direction of each axis on which the box was stopped, e.g.
+        (0, -1, 0) when it landed on the ground.
+
+    """
+    moved = [0.0, 0.0, 0.0]
+    hits = []
+    for axis in _AXES:
+        d = motion[axis]
+        if not d:
+            continue
+        u, v = [i for i in range(3) if i != axis]
+        allowed = d
+        for block in blocks:
+            # Only blocks overlapping the box on the other two axes can be hit.
+            if (block[u] + 0.5 <= low[u] + EPSILON or
+                    block[u] - 0.5 >= high[u] - EPSILON or
+                    block[v] + 0.5 <= low[v] + EPSILON or
+                    block[v] - 0.5 >= high[v] - EPSILON):
+                continue
+            if d > 0:
+                gap = block[axis] - 0.5 - high[axis]
+                if gap >= -EPSILON and gap < allowed:
+                    allowed = max(gap, 0.0)
+            else:
+                gap = block[axis] + 0.5 - low[axis]
+                if gap <= EPSILON and gap > allowed:
+                    allowed = min(gap, 0.0)
+        if allowed != d:
+            direction = [0, 0, 0]
+            direction[axis] = 1 if d > 0 else -1
+            hits.append(tuple(direction))
+        low[axis] += allowed
+        high[axis] += allowed
+        moved[axis] = allowed
+    return moved, hits
+
+
+def move(world, position, motion, height):
+    """ Move a player standing at `position` by `motion`, sliding along any
+    blocks in the way.
+
+    Parameters
+    ----------
+    world : ChunkStore
+        Anything that supports `position in world`.
+    position : tuple of len 3
+        The (x, y, z) position of the player's eyes.
+    motion : tuple of len 3
+        The distance to move along each axis.
+    height : int or float
+        The height of the player.
+
+    Returns
+    -------
+    position : tuple of len 3
+        The new position of the player.
+    hits : list of tuple of len 3
+        The direction of each axis on which the player ran into a block.
+
+    """
+    low, high = player_box(position, height)
+    blocks = candidate_blocks(world, low, high, motion)
+    moved, hits = sweep(blocks, low, high, motion)
+    return tuple(p + m for p, m in zip(position, moved)), hits
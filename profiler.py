@@ -0,0 +1,166 @@
+""" Per-phase frame profiling.
+
+The game loop wraps each phase of `update()` and `on_draw()` in
+`FrameProfiler.phase()`. The profiler keeps the last few seconds of timings.
+It can summarize them per phase, bucket them into a histogram, or export
+them as a Chrome trace (load it in chrome://tracing or Perfetto) for
+offline analysis.
+
+"""
+
+import bisect
+import collections
+import json
+import os
+import time
+
+from contextlib import contextmanager
+
+# Upper edges in milliseconds of the histogram buckets. The last bucket holds
+# everything slower.
+BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 33, 66)
+
+
+class FrameProfiler(object):
+    """ Records how long each phase of each frame takes.
+
+    Parameters
+    ----------
+    history : float
+        How many seconds of timings to keep.
+
+    """
+
+    def __init__(self, history=10.0):
+        self.history = history
+        self.enabled = True
+
+        # Recorded (name, start, duration, depth) phases, oldest first.
+        # Times are in seconds from `time.perf_counter()`.
+        self.events = collections.deque()
+
+        # Recorded (start, duration) frames, oldest first. A frame runs from
+        # one `frame()` call to the next.
+        self.frames = collections.deque()
+
+        # How many phases are currently open.
+        self._depth = 0
+        self._frame_start = None
+
+    @contextmanager
+    def phase(self, name):
+        """ Time the code in the `with` block as phase `name`. Phases may be
+        nested.
+
+        """
+        if not self.enabled:
+            yield
+            return
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self._depth -= 1
+            self.events.append((name, start, end - start, self._depth))
+
+    def frame(self):
+        """ Mark the start of a new frame, and forget timings older than
+        `history` seconds.
+
+        """
+        now = time.perf_counter()
+        if self._frame_start is not None and self.enabled:
+            self.frames.append((self._frame_start, now - self._frame_start))
+        self._frame_start = now
+        cutoff = now - self.history
+        while self.events and self.events[0][1] < cutoff:
+            self.events.popleft()
+        while self.frames and self.frames[0][0] < cutoff:
+            self.frames.popleft()
+
+    def durations(self):
+        """ Return a dict mapping each phase name to a list of its recorded
+        durations in milliseconds.
+
+        """
+        durations = collections.defaultdict(list)
+        for name, _, duration, _ in self.events:
+            durations[name].append(duration * 1000)
+        return durations
+
+    def frame_times(self):
+        """ Return the recorded frame times in milliseconds, oldest first.
+
+        """
+        return [duration * 1000 for _, duration in self.frames]
+
+    def histogram(self, name=None):
+        """ Return the number of recorded durations in each of `BUCKETS`,
+        plus one count for slower ones.
+
+        Parameters
+        ----------
+        name : str or None
+            The phase to count, or None for whole frames.
+
+        """
+        if name is None:
+            times = self.frame_times()
+        else:
+            times = self.durations().get(name, [])
+        counts = [0] * (len(BUCKETS) + 1)
+        for t in times:
+            counts[bisect.bisect_left(BUCKETS, t)] += 1
+        return counts
+
+    def stats(self):
+        """ Return a dict mapping each phase name to its recorded count,
+        mean, 99th percentile and maximum duration in milliseconds, slowest
+        phases first.
+
+        """
+        stats = collections.OrderedDict()
+        phases = self.durations()
+        phases['frame'] = self.frame_times()
+        rows = []
+        for name, times in phases.items():
+            if not times:
+                continue
+            times.sort()
+            rows.append((name, {
+                'count': len(times),
+                'mean': sum(times) / len(times),
+                'p99': times[min(len(times) - 1, int(len(times) * 0.99))],
+                'max': times[-1],
+            }))
+        rows.sort(key=lambda row: -row[1]['mean'] * row[1]['count'])
+        stats.update(rows)
+        return stats
+
+    def trace(self):
+        """ Return the recorded timings in the Chrome trace event format.
+
+        """
+        pid = os.getpid()
+        events = []
+        for start, duration in self.frames:
+            events.append({
+                'name': 'frame', 'ph': 'X', 'pid': pid, 'tid': 0,
+                'ts': start * 1e6, 'dur': duration * 1e6,
+            })
+        for name, start, duration, depth in self.events:
+            events.append({
+                'name': name, 'ph': 'X', 'pid': pid, 'tid': 1,
+                'ts': start * 1e6, 'dur': duration * 1e6,
+                'args': {'depth': depth},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path):
+        """ Write the recorded timings to `path` as a Chrome trace.
+
+        """
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
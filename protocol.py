@@ -0,0 +1,110 @@
+""" The messages sent between the game server and its clients.
+
+Every message is a 5-byte header followed by a payload: the payload length
+as a big-endian unsigned int, then one byte giving the message type. Chunks
+are sent as zlib-compressed `Chunk.to_bytes()` data, and block edits as a
+single position and block id.
+
+    HELLO     server -> client  JSON terrain settings and view radius
+    MOVE      client -> server  (x, z) key of the chunk the player is in
+    CHUNK     server -> client  (x, z) key and compressed chunk
+    BLOCK     both ways         (x, y, z) position and block id; AIR removes
+
+The client tells the server which chunk it is in, and both sides work out
+the chunks it needs with the same `ChunkManager`, so unloading needs no
+message.
+
+"""
+
+import json
+import struct
+import zlib
+
+from terrain import TerrainSettings
+
+# Message types.
+HELLO = 0
+MOVE = 1
+CHUNK = 2
+BLOCK = 3
+
+HEADER = struct.Struct('>IB')
+
+_KEY = struct.Struct('>ii')
+_BLOCK = struct.Struct('>iiiB')
+
+# Largest payload accepted. A chunk compresses to well under this.
+MAX_PAYLOAD = 1 << 20
+
+# zlib level of chunk payloads. The server compresses each chunk once for all
+# clients, so this is worth more than the fast level the chunk cache uses:
+# chunks come out about 40% smaller than at level 1.
+COMPRESSION_LEVEL = 6
+
+
+def pack(kind, payload):
+    """ Return the message of type `kind` with `payload`, header included.
+
+    """
+    return HEADER.pack(len(payload), kind) + payload
+
+
+def unpack_header(data):
+    """ Return the (payload length, type) of the message header `data`.
+
+    """
+    length, kind = HEADER.unpack(data)
+    if length > MAX_PAYLOAD:
+        raise ValueError('Message of %d bytes is too long' % length)
+    return length, kind
+
+
+def encode_hello(settings, radius):
+    return pack(HELLO, json.dumps({
+        'terrain': settings._asdict(),
+        'radius': radius,
+    }).encode('utf-8'))
+
+
+def decode_hello(payload):
+    """ Return the (terrain settings, view radius) of a HELLO payload.
+
+    """
+    hello = json.loads(payload.decode('utf-8'))
+    return TerrainSettings(**hello['terrain']), hello['radius']
+
+
+def encode_move(center):
+    return pack(MOVE, _KEY.pack(*center))
+
+
+def decode_move(payload):
+    return _KEY.unpack(payload)
+
+
+def compress_chunk(chunk):
+    """ Return the CHUNK message of `chunk`.
+
+    """
+    data = zlib.compress(chunk.to_bytes(), COMPRESSION_LEVEL)
+    return pack(CHUNK, _KEY.pack(*chunk.position) + data)
+
+
+def decode_chunk(payload):
+    """ Return the (x, z) key and `Chunk.to_bytes()` data of a CHUNK
+    payload.
+
+    """
+    return _KEY.unpack_from(payload), zlib.decompress(payload[_KEY.size:])
+
+
+def encode_block(position, block):
+    return pack(BLOCK, _BLOCK.pack(position[0], position[1], position[2], block))
+
+
+def decode_block(payload):
+    """ Return the (x, y, z) position and block id of a BLOCK payload.
+
+    """
+    x, y, z, block = _BLOCK.unpack(payload)
+    return (x, y, z), block
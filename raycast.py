@@ -0,0 +1,148 @@
+""" Voxel raycasting.
+
+Rays are walked through the block grid with the Amanatides-Woo traversal:
+each step moves to whichever neighbouring block the ray enters next, so every
+block along the ray is visited exactly once and none are skipped, no matter
+the angle. Blocks are centered on integer coordinates.
+
+"""
+
+import math
+
+import numpy as np
+
+
+def raycast(world, position, vector, max_distance=8):
+    """ Find the first block hit by the ray from `position` along `vector`.
+
+    Parameters
+    ----------
+    world : ChunkStore
+        Anything that supports `position in world`.
+    position : tuple of len 3
+        The (x, y, z) position the ray starts at.
+    vector : tuple of len 3
+        The direction of the ray.
+    max_distance : float
+        How far to search, in multiples of `vector`.
+
+    Returns
+    -------
+    block : tuple of len 3 or None
+        The block that was hit.
+    previous : tuple of len 3 or None
+        The block the ray was in just before, None if the ray started inside
+        `block`.
+    normal : tuple of len 3 or None
+        The normal of the face of `block` the ray entered through.
+
+    """
+    # Shift by half a block so block boundaries fall on integers.
+    origin = [c + 0.5 for c in position]
+    voxel = [int(math.floor(c)) for c in origin]
+    step = [0, 0, 0]
+    t_max = [math.inf] * 3
+    t_delta = [math.inf] * 3
+    for i in range(3):
+        d = vector[i]
+        if d > 0:
+            step[i] = 1
+            t_delta[i] = 1.0 / d
+            t_max[i] = (voxel[i] + 1 - origin[i]) / d
+        elif d < 0:
+            step[i] = -1
+            t_delta[i] = -1.0 / d
+            t_max[i] = (voxel[i] - origin[i]) / d
+    previous = None
+    normal = None
+    t = 0.0
+    while t <= max_distance:
+        key = (voxel[0], voxel[1], voxel[2])
+        if key in world:
+            return key, previous, normal
+        previous = key
+        if t_max[0] < t_max[1]:
+            axis = 0 if t_max[0] < t_max[2] else 2
+        else:
+            axis = 1 if t_max[1] < t_max[2] else 2
+        t = t_max[axis]
+        if t == math.inf:
+            break
+        voxel[axis] += step[axis]
+        t_max[axis] += t_delta[axis]
+        normal = [0, 0, 0]
+        normal[axis] = -step[axis]
+        normal = tuple(normal)
+    return None, None, None
+
+
+def raycast_many(world, positions, vectors, max_distance=8):
+    """ Cast many rays at once. All rays are stepped together with NumPy, and
+    the blocks they reach are looked up in one batch per step.
+
+    Parameters
+    ----------
+    world : ChunkStore
+    positions : array_like of shape (N, 3)
+    vectors : array_like of shape (N, 3)
+    max_distance : float
+        How far to search, in multiples of each ray's vector.
+
+    Returns
+    -------
+    hit : ndarray of bool, shape (N,)
+        Whether each ray hit a block.
+    blocks : ndarray of int, shape (N, 3)
+        The block each ray hit.
+    previous : ndarray of int, shape (N, 3)
+        The block each ray was in before the hit. Equal to `blocks` if the
+        ray started inside the block.
+    normals : ndarray of int, shape (N, 3)
+        The normal of the face each ray entered through.
+    distances : ndarray of float, shape (N,)
+        How far along each ray the hit was.
+
+    """
+    origin = np.asarray(positions, dtype=np.float64).reshape(-1, 3) + 0.5
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 3)
+    n = len(origin)
+    voxel = np.floor(origin).astype(np.int64)
+    step = np.sign(vectors).astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_delta = np.where(step != 0, 1.0 / np.abs(vectors), np.inf)
+        boundary = voxel + (step > 0)
+        t_max = np.where(step != 0, (boundary - origin) / vectors, np.inf)
+
+    hit = np.zeros(n, dtype=bool)
+    blocks = np.zeros((n, 3), dtype=np.int64)
+    previous = voxel.copy()
+    normals = np.zeros((n, 3), dtype=np.int64)
+    distances = np.full(n, np.inf)
+    t = np.zeros(n)
+    active = np.ones(n, dtype=bool)
+    rows = np.arange(n)
+    normal = np.zeros((n, 3), dtype=np.int64)
+    last = voxel.copy()
+    while active.any():
+        index = rows[active]
+        solid = world.lookup_many(voxel[index]) != 0
+        found = index[solid]
+        hit[found] = True
+        blocks[found] = voxel[found]
+        previous[found] = last[found]
+        normals[found] = normal[found]
+        distances[found] = t[found]
+        active[found] = False
+
+        index = rows[active]
+        if not len(index):
+            break
+        axis = np.argmin(t_max[index], axis=1)
+        t[index] = t_max[index, axis]
+        last[index] = voxel[index]
+        voxel[index, axis] += step[index, axis]
+        t_max[index, axis] += t_delta[index, axis]
+        normal[index] = 0
+        normal[index, axis] = -step[index, axis]
+        active[index[t[index] > max_distance]] = False
+    return hit, blocks, previous, normals, distances
@@ -0,0 +1,206 @@
+""" On-disk chunk persistence.
+
+Chunks are saved in region files of REGION_SIZE x REGION_SIZE chunks. Each
+file starts with a fixed-size header holding the (offset, length) of every
+chunk's payload, followed by the zlib-compressed block arrays. Files are read
+through `mmap`, so loading a chunk only touches the pages it needs.
+
+"""
+
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from chunks import Chunk
+
+# Number of chunks along each side of a region.
+REGION_SIZE = 32
+
+# Header entry of each chunk: payload offset and length. An offset of 0 means
+# the chunk has not been saved.
+_ENTRY = struct.Struct('<II')
+HEADER_SIZE = REGION_SIZE * REGION_SIZE * _ENTRY.size
+
+
+def region_key(key):
+    """ Return the (x, z) key of the region containing chunk `key`, and the
+    chunk's index inside that region.
+
+    """
+    x, z = key
+    rx, lx = divmod(x, REGION_SIZE)
+    rz, lz = divmod(z, REGION_SIZE)
+    return (rx, rz), lz * REGION_SIZE + lx
+
+
+class RegionFile(object):
+    """ One region file.
+
+    Parameters
+    ----------
+    path : str
+        The file is created if it does not exist.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(bytes(HEADER_SIZE))
+        self.file = open(path, 'r+b')
+        self._map = None
+
+    def _entry(self, index):
+        data = self.map()
+        return _ENTRY.unpack_from(data, index * _ENTRY.size)
+
+    def map(self):
+        """ Return a read-only memory map of the file, mapping it again if it
+        has been written to since.
+
+        """
+        if self._map is None:
+            self._map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def read(self, index):
+        """ Return the decompressed payload of chunk `index`, or None if it
+        has not been saved.
+
+        """
+        offset, length = self._entry(index)
+        if not offset:
+            return None
+        return zlib.decompress(self.map()[offset:offset + length])
+
+    def write(self, index, data):
+        """ Save `data` as the payload of chunk `index`. The old payload's
+        space is reused if the new one fits, otherwise it is appended.
+
+        """
+        payload = zlib.compress(data, 1)
+        offset, length = self._entry(index)
+        if not offset or len(payload) > length:
+            self.file.seek(0, os.SEEK_END)
+            offset = self.file.tell()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self.file.seek(offset)
+        self.file.write(payload)
+        self.file.seek(index * _ENTRY.size)
+        self.file.write(_ENTRY.pack(offset, len(payload)))
+        self.file.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self.file.close()
+
+
+class RegionStore(object):
+    """ Loads and saves chunks in the region files of a world directory.
+
+    Parameters
+    ----------
+    path : str
+        The world directory. It is created if it does not exist.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        # Mapping from region key to open RegionFile.
+        self.regions = {}
+
+    def _region(self, key, create=True):
+        """ Return the open region file at `key`. If it does not exist it
+        is created, or None is returned if `create` is false.
+
+        """
+        region = self.regions.get(key)
+        if region is None:
+            path = os.path.join(self.path, 'r.%d.%d.region' % key)
+            if not create and not os.path.exists(path):
+                return None
+            region = self.regions[key] = RegionFile(path)
+        return region
+
+    def load_seed(self, default):
+        """ Return the world seed saved in the world directory. If there is
+        none yet, save and return `default`.
+
+        """
+        path = os.path.join(self.path, 'level.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)['seed']
+        with open(path, 'w') as f:
+            json.dump({'seed': default}, f)
+        return default
+
+    def load_pending(self):
+        """ Return the saved structure writes waiting for chunks that were
+        not loaded, and the chunks the player has edited.
+
+        Returns
+        -------
+        pending : dict
+            Mapping from (x, z) chunk key to a list of world (x, y, z, block)
+            writes.
+        edited : set of tuple
+            The (x, z) keys of the edited chunks.
+
+        """
+        path = os.path.join(self.path, 'pending.json')
+        if not os.path.exists(path):
+            return {}, set()
+        with open(path) as f:
+            saved = json.load(f)
+        pending = dict(((x, z), [tuple(write) for write in writes])
+                       for x, z, writes in saved['pending'])
+        return pending, set(tuple(key) for key in saved['edited'])
+
+    def save_pending(self, pending, edited):
+        """ Save the structure writes in `pending` and the chunk keys in
+        `edited`, as returned by `load_pending()`.
+
+        """
+        path = os.path.join(self.path, 'pending.json')
+        with open(path, 'w') as f:
+            json.dump({
+                'pending': [(x, z, writes) for (x, z), writes in pending.items()],
+                'edited': sorted(edited),
+            }, f)
+
+    def load(self, key):
+        """ Return the saved chunk at `key`, or None if it was never saved.
+
+        """
+        region, index = region_key(key)
+        # Looking for a chunk does not create its region file.
+        region = self._region(region, create=False)
+        if region is None:
+            return None
+        data = region.read(index)
+        if data is None:
+            return None
+        return Chunk.from_bytes(key, data)
+
+    def save(self, chunk):
+        """ Write `chunk` to its region file.
+
+        """
+        region, index = region_key(chunk.position)
+        self._region(region).write(index, chunk.to_bytes())
+
+    def close(self):
+        for region in self.regions.values():
+            region.close()
+        self.regions.clear()
@@ -0,0 +1,103 @@
+""" Renderers the world hands its section meshes to.
+
+The `Model` never talks to OpenGL itself. Each time it builds or drops the
+mesh of a chunk section it calls `add_mesh()` or `remove_mesh()` on its
+renderer. The window's `VertexListRenderer` keeps one pyglet vertex list per
+mesh and draws only the meshes it is asked to, each translated to its
+origin; headless code (benchmarks, servers) uses one of the renderers here.
+
+"""
+
+
+class Renderer(object):
+    """ Interface of the object that draws the world's section meshes.
+
+    """
+
+    def add_mesh(self, key, vertex_data, texture_data, tiled):
+        """ Show the mesh of the section at `key`, replacing any mesh already
+        shown for it.
+
+        Parameters
+        ----------
+        key : tuple
+            The (x, y, z) key of the section, or the (x, z) key of a chunk for
+            its level of detail mesh.
+        vertex_data : list of int
+            Three coordinates per vertex, four vertices per quad, relative
+            to `mesher.mesh_origin(key)`.
+        texture_data : list of int
+            Texture coordinates of each vertex: two per vertex counting
+            squares of the texture atlas, or three per vertex into the tiled
+            texture array if `tiled` is true; see `mesher.LAYER_SCALE`.
+        tiled : bool
+            Whether the mesh is a greedy mesh using the tiled texture array.
+
+        """
+        raise NotImplementedError
+
+    def remove_mesh(self, key):
+        """ Stop showing the mesh of the section at `key`.
+
+        """
+        raise NotImplementedError
+
+    def draw(self, keys=None):
+        """ Draw the shown meshes of the sections at `keys`, or all shown
+        meshes if `keys` is None.
+
+        """
+        raise NotImplementedError
+
+
+class NullRenderer(Renderer):
+    """ A renderer that draws nothing, for running the world headless.
+
+    """
+
+    def add_mesh(self, key, vertex_data, texture_data, tiled):
+        pass
+
+    def remove_mesh(self, key):
+        pass
+
+    def draw(self, keys=None):
+        pass
+
+
+class RecordingRenderer(Renderer):
+    """ A renderer that keeps the meshes it is given instead of drawing them,
+    so headless runs can inspect what would be drawn.
+
+    """
+
+    def __init__(self):
+        # Mapping from section key to the (vertex_data, texture_data, tiled)
+        # mesh shown for it.
+        self.meshes = {}
+
+        # Number of meshes added and removed so far.
+        self.added = 0
+        self.removed = 0
+
+        # Keys of the meshes drawn by the last `draw()` call.
+        self.drawn = []
+
+    def add_mesh(self, key, vertex_data, texture_data, tiled):
+        self.meshes[key] = (vertex_data, texture_data, tiled)
+        self.added += 1
+
+    def remove_mesh(self, key):
+        if self.meshes.pop(key, None) is not None:
+            self.removed += 1
+
+    def draw(self, keys=None):
+        if keys is None:
+            keys = self.meshes
+        self.drawn = [key for key in keys if key in self.meshes]
+
+    def face_count(self):
+        """ Return the number of quads in all shown meshes.
+
+        """
+        return sum(len(mesh[0]) // 12 for mesh in self.meshes.values())
@@ -0,0 +1,196 @@
+""" Deferred work scheduling.
+
+Work such as building or deleting chunk meshes is queued and run a little at
+a time between frames. The `WorkScheduler` runs the work nearest to (and in
+front of) the player first, keeps only the latest piece of work for each key,
+and sizes its per-frame time budget from the measured frame time.
+
+"""
+
+import heapq
+import itertools
+import math
+import time
+
+
+class WorkScheduler(object):
+    """ A priority queue of deferred function calls.
+
+    Parameters
+    ----------
+    target : float
+        The frame time in seconds the game aims for.
+    budget : float
+        The initial time in seconds `run()` may spend per frame.
+    min_budget, max_budget : float
+        Bounds for the adapted budget.
+
+    """
+
+    # How far the focus may move, in blocks, or the line of sight may turn,
+    # as the cosine of the angle, before queued work is re-prioritized.
+    refocus_distance = 8
+    refocus_angle = math.cos(math.radians(30))
+
+    def __init__(self, target, budget=None, min_budget=0.001, max_budget=None):
+        self.target = target
+        self.max_budget = target if max_budget is None else max_budget
+        self.min_budget = min_budget
+        self.budget = self.max_budget if budget is None else budget
+
+        # Heap of [priority, sequence, key] entries.
+        self.heap = []
+
+        # Mapping from key to the latest (sequence, func, args, position,
+        # submit time) queued for it. Heap entries whose sequence no longer
+        # matches are stale and skipped.
+        self.entries = {}
+
+        self._sequence = itertools.count()
+
+        # The player's position and line of sight vector.
+        self.focus = (0, 0, 0)
+        self.direction = None
+        self._focus_at_sort = self.focus
+        self._direction_at_sort = None
+
+        # Counters.
+        self.submitted = 0
+        self.coalesced = 0
+        self.processed = 0
+        self.mean_latency = 0.0
+        self.max_latency = 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def priority(self, position):
+        """ Return the priority of work at `position`; lower runs first. Work
+        behind the player counts as up to three times as far away.
+
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position of the work. If y is None only the
+            horizontal distance is used.
+
+        """
+        fx, fy, fz = self.focus
+        x, y, z = position
+        dx, dy, dz = x - fx, (0 if y is None else y - fy), z - fz
+        distance = dx * dx + dy * dy + dz * dz
+        if self.direction is None or not distance:
+            return distance
+        vx, vy, vz = self.direction
+        if y is None:
+            vy = 0
+        cos = (dx * vx + dy * vy + dz * vz) / math.sqrt(distance)
+        return distance * (2 - cos)
+
+    def submit(self, key, func, args=(), position=(0, 0, 0)):
+        """ Queue a call to `func(*args)`. Any work still queued for `key` is
+        dropped, since this supersedes it.
+
+        """
+        if key in self.entries:
+            self.coalesced += 1
+        sequence = next(self._sequence)
+        self.entries[key] = (sequence, func, args, position, time.perf_counter())
+        heapq.heappush(self.heap, [self.priority(position), sequence, key])
+        self.submitted += 1
+
+    def cancel(self, key):
+        """ Drop any work queued for `key`.
+
+        """
+        self.entries.pop(key, None)
+
+    def set_focus(self, position, direction=None):
+        """ Set the player's `position` and line of sight `direction` that
+        work is prioritized by.
+
+        """
+        self.focus = position
+        self.direction = direction
+        if math.dist(position, self._focus_at_sort) > self.refocus_distance:
+            self._resort()
+        elif direction is not None:
+            last = self._direction_at_sort
+            if last is None or sum(a * b for a, b in zip(direction, last)) < self.refocus_angle:
+                self._resort()
+
+    def _resort(self):
+        """ Recompute the priority of all queued work.
+
+        """
+        self._focus_at_sort = self.focus
+        self._direction_at_sort = self.direction
+        self.heap = [
+            [self.priority(entry[3]), entry[0], key]
+            for key, entry in self.entries.items()
+        ]
+        heapq.heapify(self.heap)
+
+    def _pop(self):
+        """ Run the most urgent piece of work. Returns False if there is none.
+
+        """
+        heap = self.heap
+        while heap:
+            _, sequence, key = heapq.heappop(heap)
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != sequence:
+                continue
+            del self.entries[key]
+            _, func, args, _, submitted = entry
+            latency = time.perf_counter() - submitted
+            self.processed += 1
+            self.mean_latency += (latency - self.mean_latency) * 0.05
+            self.max_latency = max(self.max_latency, latency)
+            func(*args)
+            return True
+        return False
+
+    def run(self, budget=None):
+        """ Run queued work, most urgent first, for at most `budget` seconds
+        (by default the adapted budget).
+
+        """
+        if budget is None:
+            budget = self.budget
+        start = time.perf_counter()
+        while self.entries and time.perf_counter() - start < budget:
+            if not self._pop():
+                break
+
+    def run_all(self):
+        """ Run all queued work with no breaks.
+
+        """
+        while self._pop():
+            pass
+
+    def adapt(self, frame_time):
+        """ Adjust the budget given the duration of the last frame: shrink it
+        when frames run long and grow it back when there is time to spare.
+
+        """
+        if frame_time > self.target * 1.2:
+            self.budget *= 0.75
+        else:
+            self.budget *= 1.1
+        self.budget = max(self.min_budget, min(self.max_budget, self.budget))
+
+    def stats(self):
+        """ Return a dict of the scheduler's counters.
+
+        """
+        return {
+            'depth': len(self.entries),
+            'submitted': self.submitted,
+            'coalesced': self.coalesced,
+            'processed': self.processed,
+            'mean_latency': self.mean_latency,
+            'max_latency': self.max_latency,
+            'budget': self.budget,
+        }
@@ -0,0 +1,506 @@
+""" A dedicated server that hosts one world for several players.
+
+The server owns the `Model` and runs it headless on an asyncio event loop.
+Clients connect over TCP (see `protocol.py` for the messages) and tell the
+server which chunk they are in. Each client is sent the chunks around it,
+compressed, nearest first and a few per tick, and every block edit is
+broadcast to the other clients that have the edited chunk. The game window
+connects as a thin client with `python main.py --connect HOST:PORT`.
+
+Run a server, or load test one with scripted clients walking away from the
+spawn point:
+
+    python server.py --port 25566
+    python server.py --load-test 16 --duration 20
+
+"""
+
+from __future__ import division
+
+import argparse
+import asyncio
+import json
+import math
+import signal
+import struct
+import sys
+import time
+
+from blocks import AIR, BLOCKS, BRICK
+from chunks import Chunk, ChunkManager, CHUNK_SIZE, chunk_key
+from world import (Model, GENERATION_WORKERS, TERRAIN, TICKS_PER_SEC,
+    WORLD_PATH, render)
+import protocol
+
+HOST = '127.0.0.1'
+PORT = 25566
+
+# Chunks sent to each client per tick.
+CHUNKS_PER_TICK = 4
+
+# Bytes that may wait in a client's send buffer before the server stops
+# sending it chunks, so a slow client does not pile up memory.
+SEND_BUFFER = 1 << 20
+
+# Longest time per tick spent adding freshly generated chunks to the world.
+GENERATION_BUDGET = 0.5 / TICKS_PER_SEC
+
+# Walking speed of the scripted load test clients in blocks per second, the
+# seconds between their block edits, and the height they edit at.
+LOAD_TEST_SPEED = 10.0
+LOAD_TEST_EDIT_INTERVAL = 0.5
+LOAD_TEST_EDIT_HEIGHT = 100
+
+
+class ServerModel(Model):
+    """ The world as the server keeps it. Chunks are loaded while any client
+    needs them, and no meshes are built.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        # Positions of the blocks the world changed by itself, such as
+        # structures reaching into loaded chunks, for the server to send on.
+        self.changes = []
+        super(ServerModel, self).__init__(*args, **kwargs)
+
+    def _initialize(self, spawn):
+        # Chunks are loaded as clients connect.
+        pass
+
+    def show_chunk(self, key, immediate=True):
+        pass
+
+    def mark_dirty(self, position):
+        self.changes.append(position)
+
+    def set_needed(self, needed, load):
+        """ Keep the chunks at the keys in `needed` loaded and unload the
+        rest.
+
+        Parameters
+        ----------
+        needed : set of tuple
+            The (x, z) keys of the chunks any client needs.
+        load : list of tuple
+            Keys of the chunks in `needed` to load first, in order.
+
+        """
+        unload = self.chunk_manager.needed - needed
+        # Model only keeps and loads the chunks its chunk manager needs.
+        self.chunk_manager.needed = needed
+        load = load + [key for key in needed if key not in self.loaded_chunks]
+        self.update_chunks(load, unload)
+
+
+class Client(object):
+    """ A connected player, as the server sees it.
+
+    Parameters
+    ----------
+    writer : asyncio.StreamWriter
+    radius : int
+        How many chunks around the player to send.
+
+    """
+
+    def __init__(self, writer, radius):
+        self.writer = writer
+
+        # The task talking to the client.
+        self.task = asyncio.current_task()
+
+        # The chunks the client needs, computed the same way on both ends.
+        self.chunks = ChunkManager(radius)
+
+        # Keys of the chunks sent to the client that it still needs. Edits
+        # to them are sent on.
+        self.sent = set()
+
+        # Keys of the chunks still to send, nearest first.
+        self.queue = []
+
+        # Bytes and chunks sent so far.
+        self.bytes_sent = 0
+        self.chunks_sent = 0
+
+    def send(self, message):
+        self.writer.write(message)
+        self.bytes_sent += len(message)
+
+    def buffered(self):
+        """ Return the number of bytes waiting to be sent to the client.
+
+        """
+        return self.writer.transport.get_write_buffer_size()
+
+
+class GameServer(object):
+    """ Serves the world of `model` to clients over TCP.
+
+    Parameters
+    ----------
+    model : ServerModel
+    host : str
+    port : int
+        0 picks a free port; see `port` once `start()` returns.
+
+    """
+
+    def __init__(self, model, host=HOST, port=PORT):
+        self.model = model
+        self.host = host
+        self.port = port
+        self.server = None
+
+        # The connected clients.
+        self.clients = set()
+
+        # Mapping from chunk key to its compressed CHUNK message, shared by
+        # all clients until the chunk is edited or unloaded.
+        self._payloads = {}
+
+        # Duration in seconds of every tick so far.
+        self.tick_times = []
+
+    async def start(self):
+        """ Start accepting connections.
+
+        """
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def run(self, duration=None):
+        """ Tick the world TICKS_PER_SEC times a second, for `duration`
+        seconds or until cancelled.
+
+        """
+        period = 1.0 / TICKS_PER_SEC
+        end = None if duration is None else time.perf_counter() + duration
+        while end is None or time.perf_counter() < end:
+            start = time.perf_counter()
+            self.tick()
+            elapsed = time.perf_counter() - start
+            self.tick_times.append(elapsed)
+            await asyncio.sleep(max(0.0, period - elapsed))
+
+    async def stop(self):
+        """ Disconnect every client and stop accepting connections. The world
+        is not saved; see `Model.close()`.
+
+        """
+        self.server.close()
+        clients = list(self.clients)
+        for client in clients:
+            client.writer.close()
+        await asyncio.gather(*[client.task for client in clients],
+                             return_exceptions=True)
+        await self.server.wait_closed()
+
+    def tick(self):
+        """ Add generated chunks to the world, send on the blocks that
+        changed by themselves, and stream chunks to the clients.
+
+        """
+        self.model.process_generated(GENERATION_BUDGET)
+        changes = self.model.changes
+        self.model.changes = []
+        for position in changes:
+            self.broadcast(position)
+        for client in self.clients:
+            self.stream(client)
+
+    def stream(self, client):
+        """ Send the client up to CHUNKS_PER_TICK of the chunks it is
+        waiting for, nearest first. Chunks that are still being generated
+        keep their place in its queue.
+
+        """
+        if client.buffered() > SEND_BUFFER:
+            return
+        loaded = self.model.loaded_chunks
+        count = 0
+        waiting = []
+        for key in client.queue:
+            if count < CHUNKS_PER_TICK and key in loaded:
+                client.send(self.payload(key))
+                client.sent.add(key)
+                client.chunks_sent += 1
+                count += 1
+            else:
+                waiting.append(key)
+        client.queue = waiting
+
+    def payload(self, key):
+        """ Return the CHUNK message of the loaded chunk at `key`.
+
+        """
+        message = self._payloads.get(key)
+        if message is None:
+            chunk = self.model.world.chunks.get(key) or Chunk(key)
+            message = self._payloads[key] = protocol.compress_chunk(chunk)
+        return message
+
+    def move(self, client, center):
+        """ Move `client` to the chunk at `center` and queue the chunks it now
+        needs.
+
+        """
+        _, unload = client.chunks.update(center)
+        client.sent -= unload
+        cx, cz = center
+        client.queue = [
+            key for key in ((cx + dx, cz + dz) for dx, dz in client.chunks.offsets)
+            if key not in client.sent
+        ]
+        self.update_needed()
+
+    def update_needed(self):
+        """ Load the chunks the clients need, those nearest to a client
+        first, and unload the rest.
+
+        """
+        needed = set()
+        for client in self.clients:
+            needed |= client.chunks.needed
+        old = self.model.chunk_manager.needed
+        load = []
+        # Interleave the clients' queues so each gets its nearest chunks
+        # early.
+        queues = [client.queue for client in self.clients]
+        for i in range(max(map(len, queues), default=0)):
+            for keys in queues:
+                if i < len(keys) and keys[i] not in old:
+                    load.append(keys[i])
+        for key in old - needed:
+            self._payloads.pop(key, None)
+        self.model.set_needed(needed, load)
+
+    def edit(self, client, position, block):
+        """ Apply an edit sent by `client`, and broadcast the block now at
+        `position` to the other clients that have its chunk. A rejected edit,
+        such as one removing or replacing a block that is not breakable, is
+        answered with the block that is really there.
+
+        """
+        key = chunk_key(position)
+        world = self.model.world
+        current = world.get(position, AIR)
+        valid = (key in client.sent and key in self.model.loaded_chunks and
+                 world.in_bounds(position) and block < len(BLOCKS) and
+                 (current == AIR or BLOCKS[current].breakable))
+        if not valid:
+            if key in client.sent:
+                client.send(protocol.encode_block(position, world.get(position, AIR)))
+            return
+        if block != AIR:
+            self.model.add_block(position, block, immediate=False)
+        elif position in world:
+            self.model.remove_block(position, immediate=False)
+        self.broadcast(position, client)
+
+    def broadcast(self, position, origin=None):
+        """ Send the block at `position` to every client that has its chunk,
+        except `origin`.
+
+        """
+        key = chunk_key(position)
+        self._payloads.pop(key, None)
+        message = protocol.encode_block(position, self.model.world.get(position, AIR))
+        for client in self.clients:
+            if client is not origin and key in client.sent:
+                client.send(message)
+
+    async def _serve(self, reader, writer):
+        """ Talk to one client until it disconnects.
+
+        """
+        client = Client(writer, render)
+        self.clients.add(client)
+        client.send(protocol.encode_hello(self.model.generator.settings, render))
+        try:
+            while True:
+                header = await reader.readexactly(protocol.HEADER.size)
+                length, kind = protocol.unpack_header(header)
+                payload = await reader.readexactly(length)
+                if kind == protocol.MOVE:
+                    self.move(client, protocol.decode_move(payload))
+                elif kind == protocol.BLOCK:
+                    self.edit(client, *protocol.decode_block(payload))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError,
+                struct.error):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+            self.update_needed()
+
+
+class ScriptedClient(object):
+    """ A load test client that walks away from the spawn point in a
+    straight line, placing and removing a block every so often, and counts
+    what it is sent.
+
+    Parameters
+    ----------
+    angle : float
+        The direction the client walks in, in radians.
+
+    """
+
+    def __init__(self, angle):
+        self.angle = angle
+
+        # Bytes and messages of each type received.
+        self.bytes_received = 0
+        self.received = dict.fromkeys(
+            (protocol.HELLO, protocol.CHUNK, protocol.BLOCK), 0)
+
+    async def run(self, host, port, duration):
+        reader, writer = await asyncio.open_connection(host, port)
+        receiving = asyncio.ensure_future(self._receive(reader))
+        dx = math.cos(self.angle) * LOAD_TEST_SPEED
+        dz = math.sin(self.angle) * LOAD_TEST_SPEED
+        center = None
+        placed = False
+        start = last_edit = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if now - start >= duration:
+                break
+            x = dx * (now - start)
+            z = dz * (now - start)
+            key = (int(x // CHUNK_SIZE), int(z // CHUNK_SIZE))
+            if key != center:
+                center = key
+                writer.write(protocol.encode_move(center))
+            if now - last_edit >= LOAD_TEST_EDIT_INTERVAL:
+                last_edit = now
+                position = (int(x), LOAD_TEST_EDIT_HEIGHT, int(z))
+                writer.write(protocol.encode_block(
+                    position, AIR if placed else BRICK))
+                placed = not placed
+            await asyncio.sleep(1.0 / TICKS_PER_SEC)
+        writer.close()
+        receiving.cancel()
+
+    async def _receive(self, reader):
+        try:
+            while True:
+                header = await reader.readexactly(protocol.HEADER.size)
+                length, kind = protocol.unpack_header(header)
+                await reader.readexactly(length)
+                self.bytes_received += protocol.HEADER.size + length
+                self.received[kind] = self.received.get(kind, 0) + 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+
+def percentile(values, p):
+    """ Return the `p`th percentile of `values`.
+
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(math.ceil(p / 100 * len(values))) - 1)
+    return values[max(index, 0)]
+
+
+async def load_test(count, duration, workers=GENERATION_WORKERS, seed=None):
+    """ Run a server on an in-memory world with `count` scripted clients for
+    `duration` seconds.
+
+    Returns
+    -------
+    report : dict
+        Server tick times in milliseconds and the bandwidth each client used.
+
+    """
+    terrain = TERRAIN if seed is None else TERRAIN._replace(seed=seed)
+    model = ServerModel(path=None, terrain=terrain, workers=workers)
+    server = GameServer(model, port=0)
+    await server.start()
+    ticking = asyncio.ensure_future(server.run())
+    clients = [ScriptedClient(2 * math.pi * i / count) for i in range(count)]
+    await asyncio.gather(*[
+        client.run(server.host, server.port, duration) for client in clients])
+    ticking.cancel()
+    await server.stop()
+    model.close()
+
+    times = [t * 1000 for t in server.tick_times]
+    rates = [client.bytes_received / 1024 / duration for client in clients]
+    return {
+        'clients': count,
+        'duration': duration,
+        'ticks': len(times),
+        'tick_ms': {
+            'mean': sum(times) / len(times) if times else 0.0,
+            'p50': percentile(times, 50),
+            'p99': percentile(times, 99),
+            'max': max(times) if times else 0.0,
+        },
+        'client_kib_per_s': {
+            'mean': sum(rates) / count,
+            'min': min(rates),
+            'max': max(rates),
+        },
+        'chunks_per_client': sum(
+            client.received[protocol.CHUNK] for client in clients) / count,
+        'edits_per_client': sum(
+            client.received[protocol.BLOCK] for client in clients) / count,
+    }
+
+
+async def serve(host, port, path, workers):
+    model = ServerModel(path=path, workers=workers)
+    server = GameServer(model, host, port)
+    await server.start()
+    print('Serving %s on %s:%d' % (path, host, server.port))
+    running = asyncio.ensure_future(server.run())
+    try:
+        # Stop and save the world when terminated, as for Ctrl-C.
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, running.cancel)
+    except NotImplementedError:
+        pass
+    try:
+        await running
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await server.stop()
+        model.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--world', default=WORLD_PATH,
+                        help='directory the world is saved in')
+    parser.add_argument('--workers', type=int, default=GENERATION_WORKERS,
+                        help='chunk generation processes')
+    parser.add_argument('--load-test', type=int, metavar='CLIENTS',
+                        help='run scripted clients against an in-memory world')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to run the load test for')
+    parser.add_argument('--seed', type=int,
+                        help='terrain seed of the load test world')
+    args = parser.parse_args()
+
+    if args.load_test:
+        report = asyncio.run(load_test(
+            args.load_test, args.duration, args.workers, args.seed))
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+        return
+    try:
+        asyncio.run(serve(args.host, args.port, args.world, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+""" Staged terrain generation.
+
+The blocks of a chunk are generated in stages, each working on whole-chunk
+NumPy arrays:
+
+    heightmap -> strata -> caves -> ores
+    heightmap -> structures -> decorate
+
+`heightmap` gives the height of each column. `strata` fills the columns with
+grass or sand over stone. `caves` carves tunnels out of the stone with 3D
+noise, and `ores` scatters diamond ore through what is left. Each stage keeps
+its recent results in a cache, so a later stage can be rerun (or a
+neighbouring chunk can look at an earlier one) without redoing the work
+before it, and records how long it takes.
+
+`structures` lays out structures, such as ruins, that may reach into the
+chunks around the one being generated. Rather than loading those chunks, it
+returns the blocks as writes, which the world groups by the chunk they fall
+in; it keeps the writes for chunks that are not loaded yet and places them
+with `place_blocks()` once they are. Writes only ever fill air, and
+`decorate` drops the cells that a structure of a neighbouring chunk with a
+smaller key also claims, so no two chunks write the same cell. The result is
+then the same whichever chunk is generated first, except that the world
+drops writes into chunks the player has already edited.
+
+"""
+
+import collections
+import time
+
+from collections import namedtuple
+
+import numpy as np
+
+from blocks import AIR, GRASS, SAND, STONE, DIAMOND_ORE, BRICK, OBSIDIAN
+from chunks import CHUNK_SIZE, SECTION_SIZE, WORLD_HEIGHT
+from noise import TerrainNoise
+
+
+TerrainSettings = namedtuple('TerrainSettings',
+    ['seed', 'octaves', 'base', 'amplitude', 'max_height'])
+
+# Names of the stages, in the order they run.
+STAGES = ('heightmap', 'strata', 'caves', 'ores', 'structures', 'decorate')
+
+# Number of chunks each stage keeps the results of.
+STAGE_CACHE_SIZE = 64
+
+# Number of durations kept per stage.
+TIMING_HISTORY = 1000
+
+# Layers of grass or sand above the stone.
+SOIL_DEPTH = 4
+
+# Columns no higher than this far below the base height are sand.
+SAND_DEPTH = 0.5
+
+# Width in blocks of one cave feature, and the noise above which stone is
+# carved out. Cave noise is sampled every CAVE_STEP blocks and interpolated.
+CAVE_SCALE = 24.0
+CAVE_THRESHOLD = 0.2
+CAVE_STEP = 4
+
+# Caves stay this many blocks below the surface and above the bottom of the
+# world.
+CAVE_ROOF = 6
+CAVE_FLOOR = 1
+
+# Attempts per chunk at placing a cluster of diamond ore, blocks per cluster,
+# and the highest layer ore is placed in.
+ORE_CLUSTERS = 6
+ORE_CLUSTER_SIZE = 4
+ORE_MAX_Y = 24
+
+# Random streams of the chunk stages that use one, see `_chunk_rng()`.
+ORE_STREAM = 0
+STRUCTURE_STREAM = 1
+
+# Chance of a chunk holding a ruin, and the range of its width and wall
+# height. Structures must reach less than a chunk from their root column.
+RUIN_CHANCE = 0.1
+RUIN_SIZE = (5, 10)
+RUIN_HEIGHT = (1, 5)
+
+# Chance of a chunk holding an obsidian pillar, and the range of its height.
+PILLAR_CHANCE = 0.15
+PILLAR_HEIGHT = (4, 12)
+
+# TerrainNoise instances of each process, by settings.
+_noise = {}
+
+
+def _terrain_noise(settings):
+    """ Return the TerrainNoise of `settings`, creating it on first use.
+
+    """
+    noise = _noise.get(settings)
+    if noise is None:
+        noise = _noise[settings] = TerrainNoise(settings.seed, settings.octaves)
+    return noise
+
+
+def _to_heights(settings, values):
+    """ Turn noise `values` into integer terrain heights.
+
+    """
+    heights = values * settings.amplitude + settings.base
+    return heights.clip(1, settings.max_height).astype(np.int64)
+
+
+def terrain_heights(settings, keys):
+    """ Return the terrain height of every column of each chunk in `keys`.
+
+    Returns
+    -------
+    heights : ndarray of int, shape (len(keys), CHUNK_SIZE, CHUNK_SIZE)
+        Indexed by chunk, then local x, then local z.
+
+    """
+    return _to_heights(settings, _terrain_noise(settings).heightmaps(keys))
+
+
+def column_heights(settings, x, z):
+    """ Return the terrain height of the columns at world coordinates `x`,
+    `z`, arrays of matching shape. The same as `terrain_heights()` for the
+    same columns.
+
+    """
+    return _to_heights(settings, _terrain_noise(settings).noise2(x, z))
+
+
+def place_blocks(chunk, writes):
+    """ Apply the structure `writes` that fall in `chunk`, filling only air.
+
+    Parameters
+    ----------
+    chunk : Chunk
+    writes : sequence of tuple
+        World (x, y, z, block) of each block to place.
+
+    Returns
+    -------
+    count : int
+        Number of blocks placed.
+
+    """
+    ox = chunk.position[0] * CHUNK_SIZE
+    oz = chunk.position[1] * CHUNK_SIZE
+    count = 0
+    for x, y, z, block in writes:
+        x -= ox
+        z -= oz
+        if chunk.get(x, y, z) == AIR:
+            chunk.set(x, y, z, block)
+            count += 1
+    return count
+
+
+def group_writes(writes):
+    """ Return a dict mapping the (x, z) key of each chunk `writes` fall in
+    to a list of the (x, y, z, block) writes in it.
+
+    """
+    groups = {}
+    for x, y, z, block in writes:
+        groups.setdefault((x // CHUNK_SIZE, z // CHUNK_SIZE), []).append(
+            (x, y, z, block))
+    return groups
+
+
+def _chunk_rng(seed, key, stream):
+    """ Return the random number generator of the chunk at `key` for
+    `stream`, which is the same for the same arguments on every platform and
+    Python version, and different for different chunks and streams.
+
+    """
+    entropy = [seed & 0xffffffff, key[0] & 0xffffffff, key[1] & 0xffffffff,
+               stream]
+    state = np.random.SeedSequence(entropy).generate_state(1)[0]
+    return np.random.RandomState(state)
+
+
+def _interpolate(samples, step, size):
+    """ Linearly interpolate `samples`, taken every `step` blocks along each
+    axis, to `size` blocks along each axis.
+
+    """
+    for axis, n in enumerate(size):
+        position = np.arange(n) / step
+        low = position.astype(np.int64)
+        t = position - low
+        shape = [1] * samples.ndim
+        shape[axis] = n
+        t = t.reshape(shape)
+        samples = (np.take(samples, low, axis=axis) * (1 - t) +
+                   np.take(samples, low + 1, axis=axis) * t)
+    return samples
+
+
+class TerrainGenerator(object):
+    """ Generates the blocks of chunks one stage at a time.
+
+    Parameters
+    ----------
+    settings : TerrainSettings
+    cache_size : int
+        Number of chunks each stage keeps the results of.
+
+    """
+
+    def __init__(self, settings, cache_size=STAGE_CACHE_SIZE):
+        self.settings = settings
+        self.cache_size = cache_size
+        self.caves_noise = TerrainNoise((settings.seed * 7 + 1) % 2 ** 32,
+                                        2, CAVE_SCALE)
+
+        # Mapping from stage name to an OrderedDict from chunk key to the
+        # stage's (read-only) result, least recently used first.
+        self.caches = dict((stage, collections.OrderedDict()) for stage in STAGES)
+
+        # Mapping from stage name to its recent durations in seconds.
+        self.timings = dict(
+            (stage, collections.deque(maxlen=TIMING_HISTORY)) for stage in STAGES)
+
+    def _run(self, stage, key, func, inputs=()):
+        """ Return the result of `stage` for the chunk at `key`, from the
+        cache or by calling `func(key, *inputs)`. `inputs` are callables
+        returning the results of earlier stages, only called on a cache
+        miss, so the time spent in them is not counted as this stage's.
+
+        """
+        cache = self.caches[stage]
+        result = cache.get(key)
+        if result is not None:
+            cache.move_to_end(key)
+            return result
+        args = [get(key) for get in inputs]
+        start = time.perf_counter()
+        result = func(key, *args)
+        self.timings[stage].append(time.perf_counter() - start)
+        # Cached results are shared, so later stages must copy them.
+        result.setflags(write=False)
+        cache[key] = result
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return result
+
+    def heightmap(self, key):
+        """ Return the terrain height of each column of the chunk at `key`,
+        indexed by local x, then local z.
+
+        """
+        return self._run('heightmap', key, self._heightmap)
+
+    def _heightmap(self, key):
+        return terrain_heights(self.settings, [key])[0]
+
+    def strata(self, key):
+        """ Return the blocks of the chunk at `key` filled up to the terrain
+        height: grass, or sand in low places, over stone.
+
+        """
+        return self._run('strata', key, self._strata, (self.heightmap,))
+
+    def _strata(self, key, heights):
+        heights = heights.T
+        layers = -(-int(heights.max()) // SECTION_SIZE) * SECTION_SIZE
+        # Chunk arrays are indexed by y, then z, then x.
+        y = np.arange(layers)[:, None, None]
+        sand_level = self.settings.base - self.settings.amplitude * SAND_DEPTH
+        soil = np.where(heights <= sand_level, SAND, GRASS).astype(np.uint8)
+        blocks = np.where(y < heights - SOIL_DEPTH, STONE, AIR).astype(np.uint8)
+        top = (y >= heights - SOIL_DEPTH) & (y < heights)
+        blocks[top] = np.broadcast_to(soil, blocks.shape)[top]
+        return blocks
+
+    def caves(self, key):
+        """ Return the blocks of the chunk at `key` with caves carved out of
+        the stone.
+
+        """
+        return self._run('caves', key, self._caves,
+                         (self.strata, self.heightmap))
+
+    def _caves(self, key, blocks, heights):
+        blocks = blocks.copy()
+        heights = heights.T
+        layers = len(blocks)
+        # Sample the noise on a coarse grid and interpolate, since caves are
+        # much larger than a block.
+        n = CHUNK_SIZE // CAVE_STEP + 1
+        y, z, x = np.meshgrid(np.arange(layers // CAVE_STEP + 1) * CAVE_STEP,
+                              np.arange(n) * CAVE_STEP + key[1] * CHUNK_SIZE,
+                              np.arange(n) * CAVE_STEP + key[0] * CHUNK_SIZE,
+                              indexing='ij')
+        samples = self.caves_noise.noise3(x, y, z)
+        noise = _interpolate(samples, CAVE_STEP, blocks.shape)
+        y = np.arange(layers)[:, None, None]
+        carve = ((noise > CAVE_THRESHOLD) & (y >= CAVE_FLOOR) &
+                 (y < heights - CAVE_ROOF) & (blocks == STONE))
+        blocks[carve] = AIR
+        return blocks
+
+    def ores(self, key):
+        """ Return the blocks of the chunk at `key` with diamond ore
+        scattered through the stone.
+
+        """
+        return self._run('ores', key, self._ores, (self.caves,))
+
+    def _ores(self, key, blocks):
+        blocks = blocks.copy()
+        # The same chunk always gets the same ore.
+        rng = _chunk_rng(self.settings.seed, key, ORE_STREAM)
+        top = min(ORE_MAX_Y, len(blocks))
+        count = ORE_CLUSTERS * ORE_CLUSTER_SIZE
+        centers = np.column_stack([
+            rng.randint(0, top, ORE_CLUSTERS),
+            rng.randint(0, CHUNK_SIZE, ORE_CLUSTERS),
+            rng.randint(0, CHUNK_SIZE, ORE_CLUSTERS),
+        ]).repeat(ORE_CLUSTER_SIZE, axis=0)
+        cells = centers + rng.randint(-1, 2, (count, 3))
+        cells = cells.clip(0, [top - 1, CHUNK_SIZE - 1, CHUNK_SIZE - 1])
+        y, z, x = cells.T
+        stone = blocks[y, z, x] == STONE
+        blocks[y[stone], z[stone], x[stone]] = DIAMOND_ORE
+        return blocks
+
+    def structures(self, key):
+        """ Return the blocks of the structures rooted in the chunk at
+        `key`, which may reach into the chunks around it, as an (N, 4) array
+        of world (x, y, z, block). Some may be dropped by `decorate()`.
+
+        """
+        return self._run('structures', key, self._structures, (self.heightmap,))
+
+    def decorate(self, key):
+        """ Return the blocks of the structures rooted in the chunk at `key`
+        without the cells a structure of a neighbouring chunk with a smaller
+        key also claims, so that whichever chunk is generated first, each
+        cell is written by at most one chunk.
+
+        Returns
+        -------
+        writes : ndarray of int, shape (N, 4)
+            World (x, y, z, block) of each block.
+
+        """
+        return self._run('decorate', key, self._decorate,
+                         (self.structures, self._earlier_structures))
+
+    def _earlier_structures(self, key):
+        """ Return the structures of the neighbours of the chunk at `key`
+        with smaller keys, or none if the chunk has no structures.
+
+        """
+        if not len(self.structures(key)):
+            return []
+        x, z = key
+        return [self.structures(other) for other in
+                ((x - 1, z - 1), (x - 1, z), (x - 1, z + 1), (x, z - 1))]
+
+    def _decorate(self, key, writes, earlier):
+        claimed = set()
+        for other in earlier:
+            claimed.update(map(tuple, other[:, :3].tolist()))
+        if not claimed:
+            return writes
+        keep = [tuple(cell) not in claimed for cell in writes[:, :3].tolist()]
+        return writes[np.array(keep, dtype=bool)]
+
+    def _structures(self, key, heights):
+        # The same chunk always gets the same structures.
+        rng = _chunk_rng(self.settings.seed, key, STRUCTURE_STREAM)
+        ox = key[0] * CHUNK_SIZE
+        oz = key[1] * CHUNK_SIZE
+        writes = []
+        if rng.random_sample() < RUIN_CHANCE:
+            # A square of crumbling brick walls around the root column.
+            x, z = rng.randint(0, CHUNK_SIZE, 2)
+            size = rng.randint(*RUIN_SIZE)
+            ground = int(heights[x, z])
+            x0, z0 = ox + x - size // 2, oz + z - size // 2
+            for i in range(size):
+                for wx, wz in ((x0 + i, z0), (x0 + i, z0 + size - 1),
+                               (x0, z0 + i), (x0 + size - 1, z0 + i)):
+                    for y in range(ground, ground + rng.randint(*RUIN_HEIGHT)):
+                        writes.append((wx, y, wz, BRICK))
+        if rng.random_sample() < PILLAR_CHANCE:
+            x, z = rng.randint(0, CHUNK_SIZE, 2)
+            ground = int(heights[x, z])
+            for y in range(ground, ground + rng.randint(*PILLAR_HEIGHT)):
+                writes.append((ox + x, y, oz + z, OBSIDIAN))
+        writes = np.array(writes, dtype=np.int64).reshape(-1, 4)
+        return writes[(writes[:, 1] >= 0) & (writes[:, 1] < WORLD_HEIGHT)]
+
+    def generate(self, key):
+        """ Run every stage for the chunk at `key` and return its blocks, as
+        a writable (y, z, x) array. The writes of its structures are
+        returned by `decorate()`.
+
+        """
+        return self.ores(key).copy()
+
+    def stats(self):
+        """ Return a dict mapping each stage name to its recorded count and
+        mean duration in milliseconds, and the chunks per second it alone
+        could generate.
+
+        """
+        stats = collections.OrderedDict()
+        for stage in STAGES:
+            times = self.timings[stage]
+            mean = sum(times) / len(times) if times else 0.0
+            stats[stage] = {
+                'count': len(times),
+                'mean_ms': mean * 1000,
+                'chunks_per_sec': 1 / mean if mean else 0.0,
+            }
+        return stats
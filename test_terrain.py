@@ -0,0 +1,35 @@
+""" Tests of the terrain generator.
+
+"""
+
+import numpy as np
+
+from blocks import DIAMOND_ORE
+from terrain import ORE_STREAM, STRUCTURE_STREAM, TerrainGenerator, _chunk_rng
+from world import TERRAIN
+
+
+def _ore(generator, key):
+    return set(zip(*np.nonzero(generator.ores(key) == DIAMOND_ORE)))
+
+
+def test_chunk_rng_is_repeatable():
+    first = _chunk_rng(TERRAIN.seed, (3, -5), ORE_STREAM).randint(0, 2 ** 31, 8)
+    second = _chunk_rng(TERRAIN.seed, (3, -5), ORE_STREAM).randint(0, 2 ** 31, 8)
+    assert (first == second).all()
+
+
+def test_neighbouring_negative_keys_get_different_ore():
+    generator = TerrainGenerator(TERRAIN)
+    for a, b in (((-1, 0), (-2, 0)), ((0, -1), (0, -2)), ((-1, -1), (-2, -2))):
+        draws_a = _chunk_rng(TERRAIN.seed, a, ORE_STREAM).randint(0, 2 ** 31, 8)
+        draws_b = _chunk_rng(TERRAIN.seed, b, ORE_STREAM).randint(0, 2 ** 31, 8)
+        assert (draws_a != draws_b).any()
+        assert _ore(generator, a) != _ore(generator, b)
+
+
+def test_neighbouring_negative_keys_get_different_structures():
+    for a, b in (((-1, 0), (-2, 0)), ((0, -1), (0, -2))):
+        draws_a = _chunk_rng(TERRAIN.seed, a, STRUCTURE_STREAM).random_sample(4)
+        draws_b = _chunk_rng(TERRAIN.seed, b, STRUCTURE_STREAM).random_sample(4)
+        assert (draws_a != draws_b).any()
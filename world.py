@@ -0,0 +1,912 @@
+""" The game world, independent of any window or graphics library.
+
+The `Model` owns the blocks, chunk loading, generation and saving. It builds
+chunk meshes as plain vertex arrays and hands them to a renderer (see
+`renderer.py`), so it can run headless, e.g. in benchmarks or a server, with
+a `NullRenderer`.
+
+"""
+
+from __future__ import division
+
+import sys
+import random
+
+import numpy as np
+
+from blocks import *
+from culling import reachable_sections, section_bounds, section_connectivity
+from chunks import (Chunk, ChunkCache, ChunkManager, ChunkStore, CHUNK_SIZE,
+    SECTION_SIZE, SECTIONS, chunk_key, section_key)
+from generation import ChunkGenerator, TerrainSettings, generate_chunk
+from terrain import place_blocks
+from lod import build_lod_mesh
+from mesher import build_section_mesh, build_greedy_mesh, mesh_stats, FACES
+from raycast import raycast
+from region import RegionStore
+from renderer import NullRenderer
+from scheduler import WorkScheduler
+
+TICKS_PER_SEC = 60
+# originally was 60
+
+max_world_size = 32000
+max_build_height = 319
+
+# Seed of the terrain noise. The same seed always generates the same world.
+WORLD_SEED = random.randrange(2 ** 31)
+
+# Terrain height is TERRAIN_BASE plus up to TERRAIN_AMPLITUDE blocks either way.
+TERRAIN_BASE = 32
+TERRAIN_AMPLITUDE = 12
+
+TERRAIN = TerrainSettings(seed=WORLD_SEED, octaves=2, base=TERRAIN_BASE,
+    amplitude=TERRAIN_AMPLITUDE, max_height=max_build_height)
+
+# Number of processes generating chunks in the background. None uses one per
+# CPU; 0 generates chunks on the main thread.
+GENERATION_WORKERS = None
+
+# Longest time per frame spent adding freshly generated chunks to the world.
+GENERATION_BUDGET = 0.25 / TICKS_PER_SEC
+
+# Directory the world is saved in.
+WORLD_PATH = 'world'
+
+# Number of unloaded chunks kept in memory so they can be reloaded without
+# generating them again.
+CHUNK_CACHE_SIZE = 256
+
+render = 3
+
+# How many chunks away distant terrain is drawn with simplified level of
+# detail meshes, beyond the loaded chunks.
+LOD_DISTANCE = 4 * render
+
+# Whether chunk meshes merge matching faces into larger quads. Toggle in game
+# with G to compare against one quad per face.
+GREEDY_MESHING = False
+
+# Size of sectors used to ease block loading. Sectors line up with the chunk
+# columns of the world store.
+SECTOR_SIZE = CHUNK_SIZE
+
+# Where the player starts; chunks around it are loaded before the first frame.
+SPAWN_POSITION = (0, 10, 0)
+
+if sys.version_info[0] >= 3:
+    xrange = range
+
+
+def normalize(position):
+    """ Accepts `position` of arbitrary precision and returns the block
+    containing that position.
+
+    Parameters
+    ----------
+    position : tuple of len 3
+
+    Returns
+    -------
+    block_position : tuple of ints of len 3
+
+    """
+    x, y, z = position
+    x, y, z = (int(round(x)), int(round(y)), int(round(z)))
+    return (x, y, z)
+
+
+def sectorize(position):
+    """ Returns a tuple representing the sector for the given `position`.
+
+    Parameters
+    ----------
+    position : tuple of len 3
+
+    Returns
+    -------
+    sector : tuple of len 3
+
+    """
+    x, y, z = normalize(position)
+    x, y, z = x // SECTOR_SIZE, y // SECTOR_SIZE, z // SECTOR_SIZE
+    return (x, 0, z)
+
+
+class Model(object):
+    """ The blocks of the world and the meshes shown of them.
+
+    Parameters
+    ----------
+    renderer : Renderer
+        Receives the chunk meshes. Defaults to a `NullRenderer`, which draws
+        nothing.
+    path : str or None
+        The directory the world is saved in. If None nothing is saved, and
+        chunks dropped from the chunk cache are generated again.
+    terrain : TerrainSettings
+        Settings for generating new terrain. A saved world keeps the seed it
+        was created with.
+    workers : int or None
+        Number of chunk generation processes, as for `ChunkGenerator`.
+    spawn : tuple of len 3
+        The position around which the first chunks are loaded.
+
+    """
+
+    def __init__(self, renderer=None, path=WORLD_PATH, terrain=TERRAIN,
+                 workers=GENERATION_WORKERS, spawn=SPAWN_POSITION):
+
+        # Receives the chunk meshes to draw.
+        self.renderer = NullRenderer() if renderer is None else renderer
+
+        # Whether chunk meshes are built with greedy meshing.
+        self.greedy = GREEDY_MESHING
+
+        self.chunk_cooldown = 75
+
+        # Chunks saved on disk, or None if the world is not saved. A saved
+        # world keeps the seed it was created with.
+        self.regions = None if path is None else RegionStore(path)
+        if self.regions is not None:
+            terrain = terrain._replace(seed=self.regions.load_seed(terrain.seed))
+
+        # Generates chunk terrain in worker processes.
+        self.generator = ChunkGenerator(terrain, workers)
+
+        # Mapping from the (x, z) key of a chunk that is not loaded to the
+        # world (x, y, z, block) writes of structures from other chunks that
+        # reach into it. They are placed when the chunk is generated or
+        # loaded.
+        self.pending_writes = {}
+
+        # Set of the (x, z) keys of the chunks the player has edited.
+        # Structure writes are not placed in them, as they could fill air the
+        # player dug out.
+        self.edited = set()
+        if self.regions is not None:
+            self.pending_writes, self.edited = self.regions.load_pending()
+
+        self.current_chunk = (0, 0)
+        self.last_chunk = (0, 0)
+
+        # A mapping from position to the id of the block at that position.
+        # This defines all the blocks that are currently in the world. Blocks
+        # are kept in per-chunk arrays rather than one dict entry each.
+        self.world = ChunkStore()
+
+        # Set of the (x, z) keys of all chunks that are shown.
+        self.shown = set()
+
+        # Set of the (x, z) keys of all chunks in the world.
+        self.loaded_chunks = set()
+
+        # Decides which chunks to load as the player moves.
+        self.chunk_manager = ChunkManager(render)
+
+        # Recently unloaded chunks, including any edits made to them.
+        self.chunk_cache = ChunkCache(CHUNK_CACHE_SIZE)
+
+        # Set of the keys of loaded chunks that differ from their saved copy.
+        self.unsaved = set()
+
+        # Mapping from (x, y, z) section key to the number of faces in the
+        # mesh of that section. Sections that are all air or buried have no
+        # mesh.
+        self._shown = {}
+
+        # Number of faces in all shown section meshes.
+        self.face_count = 0
+
+        # Keys of the sections whose blocks were edited since their meshes
+        # were last built. They are rebuilt once per frame, however many
+        # edits hit them.
+        self.dirty = set()
+
+        # Decides which chunks distant terrain is drawn for.
+        self.lod_manager = ChunkManager(LOD_DISTANCE)
+
+        # Mapping from (x, z) chunk key to the (face count, top) of the level
+        # of detail mesh shown for it, where top is its highest column.
+        # Chunks that are shown get no level of detail mesh.
+        self._lod = {}
+
+        # Number of faces in all shown level of detail meshes.
+        self.lod_face_count = 0
+
+        # Number of section meshes drawn, culled by the frustum and hidden
+        # behind terrain in the last frame.
+        self.drawn = 0
+        self.culled = 0
+        self.occluded = 0
+
+        # Keys of the sections that can be seen from the camera's section,
+        # the section they were computed from, and whether blocks or chunks
+        # have changed since.
+        self.reachable = set()
+        self._reachable_from = None
+        self._occlusion_dirty = True
+
+        # Queue of deferred _show_section() and _hide_section() calls, run
+        # nearest to the player first.
+        self.queue = WorkScheduler(1.0 / TICKS_PER_SEC)
+
+        self._initialize(spawn)
+    
+    def load_chunk(self, pos=(1, 0)):
+        """ Load the chunk at `pos` from the cache or disk, or generate it on
+        the calling thread, and add it to the world.
+
+        """
+        if not pos in self.loaded_chunks:
+            chunk = self.load_stored_chunk(pos)
+            if chunk is None:
+                key, blocks, pending = generate_chunk(self.generator.settings, pos)
+                self.insert_generated(key, blocks, pending)
+            else:
+                self.insert_chunk(chunk)
+
+    def load_stored_chunk(self, key):
+        """ Return the chunk at `key` from the chunk cache or the region
+        files, or None if it has never been saved.
+
+        """
+        chunk = self.chunk_cache.pop(key)
+        if chunk is None and self.regions is not None:
+            chunk = self.regions.load(key)
+        return chunk
+
+    def insert_chunk(self, chunk, immediate=True):
+        """ Add a loaded chunk to the world and show it.
+
+        Parameters
+        ----------
+        chunk : Chunk
+            The chunk to add.
+        immediate : bool
+            Whether or not to build the chunk mesh immediately.
+
+        """
+        key = chunk.position
+        writes = self.pending_writes.pop(key, None)
+        if writes and key not in self.edited and place_blocks(chunk, writes):
+            self.unsaved.add(key)
+        self.world.add_chunk(chunk)
+        self.loaded_chunks.add(key)
+        self._occlusion_dirty = True
+        self.show_chunk(key, immediate)
+        self.refresh_neighbors(key)
+
+    def insert_generated(self, key, blocks, pending=None, immediate=True):
+        """ Add a freshly generated chunk to the world. It is saved to disk
+        when it is unloaded.
+
+        Parameters
+        ----------
+        key : tuple of len 2
+        blocks : bytes
+        pending : dict or None
+            The writes of the chunk's structures that reach into other
+            chunks, as returned by `generate_chunk()`.
+        immediate : bool
+            Whether or not to build the chunk mesh immediately.
+
+        """
+        self.insert_chunk(Chunk.from_bytes(key, blocks), immediate)
+        self.unsaved.add(key)
+        if pending:
+            self.add_pending_writes(pending)
+
+    def add_pending_writes(self, pending):
+        """ Place structure writes from a generated chunk in the loaded chunks
+        they fall in, and keep the rest until their chunks are loaded. Writes
+        into chunks the player has edited are dropped.
+
+        Parameters
+        ----------
+        pending : dict
+            Mapping from (x, z) chunk key to a list of world (x, y, z, block)
+            writes.
+
+        """
+        for key, writes in pending.items():
+            if key in self.edited:
+                continue
+            if key not in self.loaded_chunks:
+                self.pending_writes.setdefault(key, []).extend(writes)
+                continue
+            for x, y, z, block in writes:
+                position = (x, y, z)
+                if position not in self.world and self.world.in_bounds(position):
+                    self.world[position] = block
+                    self.mark_dirty(position)
+                    self.unsaved.add(key)
+
+    def process_generated(self, budget=None):
+        """ Add chunks finished by the background generator to the world,
+        spending at most `budget` seconds. Chunks that failed to generate are
+        requested again while they are still needed.
+
+        """
+        for key, blocks, pending in self.generator.drain(
+                budget, retry=self.chunk_manager.needed):
+            if key not in self.loaded_chunks and key in self.chunk_manager.needed:
+                self.insert_generated(key, blocks, pending, immediate=False)
+
+    def unload_chunk(self, pos=(1, 0)):
+        """ Remove the chunk at `pos` and all its blocks from the world. It is
+        saved if it changed, and kept in the chunk cache in case the player
+        comes back.
+
+        """
+        key = (pos[0], pos[1])
+        if key in self.unsaved:
+            self.save_chunk(key)
+        chunk = self.world.remove_chunk(key)
+        if chunk is not None:
+            self.chunk_cache.put(chunk)
+        self.loaded_chunks.discard(key)
+        self._occlusion_dirty = True
+        if key in self.shown:
+            self.hide_chunk(key)
+        self.refresh_neighbors(key)
+
+    def save_chunk(self, key):
+        """ Write the chunk at `key` to its region file.
+
+        """
+        if self.regions is not None:
+            self.regions.save(self.world.chunks.get(key) or Chunk(key))
+        self.unsaved.discard(key)
+
+    def save(self):
+        """ Write every loaded chunk that changed since it was loaded to disk.
+
+        """
+        for key in list(self.unsaved):
+            if key in self.loaded_chunks:
+                self.save_chunk(key)
+        if self.regions is not None:
+            self.regions.save_pending(self.pending_writes, self.edited)
+
+    def close(self):
+        """ Save the world and stop the background generator.
+
+        """
+        self.save()
+        if self.regions is not None:
+            self.regions.close()
+        self.generator.shutdown()
+
+    def check_chunks(self, x=0, z=0):
+        """ Load the chunks around world position `x`, `z`, nearest first, and
+        unload those that are now too far away. Cheap to call every frame; it
+        only does work when the player enters another chunk.
+
+        """
+        global SECTOR_SIZE
+        center = (int(x // SECTOR_SIZE), int(z // SECTOR_SIZE))
+        load, unload = self.chunk_manager.update(center)
+        self.update_chunks(load, unload)
+        load, unload = self.lod_manager.update(center)
+        for key in unload:
+            self._hide_lod(key)
+        for key in load:
+            if key not in self.shown:
+                self._enqueue_lod(self._show_lod, key)
+
+    def update_chunks(self, load, unload):
+        """ Load or request generation of the chunks at the keys in `load`,
+        in order, and unload those in `unload`.
+
+        Parameters
+        ----------
+        load : list of tuple
+            Keys of the chunks that are now needed, nearest first.
+        unload : iterable of tuple
+            Keys of the chunks that are no longer needed.
+
+        """
+        for key in unload:
+            if key in self.loaded_chunks:
+                self.unload_chunk(key)
+        for key in load:
+            if key in self.loaded_chunks:
+                continue
+            chunk = self.load_stored_chunk(key)
+            if chunk is None:
+                self.generator.request(key)
+            else:
+                self.insert_chunk(chunk, immediate=False)
+        if unload:
+            # Stop generating chunks the player has moved away from.
+            self.generator.cancel(self.chunk_manager.needed)
+
+    def moved_chunks(self, chunk1=(0, 0), chunk2=(0, 0)):
+        return chunk1 != chunk2
+
+    def get_chunked_coords(self, pos=(0, 0)):
+        global SECTOR_SIZE
+        return (pos[0] // SECTOR_SIZE, pos[1] // SECTOR_SIZE)
+
+
+        
+
+    def _initialize(self, spawn):
+        """ Initialize the world by loading the chunks around `spawn`.
+
+        """
+        '''
+        n = 80  # 1/2 width and height of world
+        s = 1  # step size
+        y = 0  # initial y height
+        for x in xrange(-n, n + 1, s):
+            for z in xrange(-n, n + 1, s):
+                # create a layer stone an grass everywhere.
+                self.add_block((x, y - 2, z), GRASS, immediate=False)
+                self.add_block((x, y - 3, z), STONE, immediate=False)
+                if x in (-n, n) or z in (-n, n):
+                    # create outer walls.
+                    pass
+
+        # generate the hills randomly
+        o = n - 10
+        for _ in xrange(120):
+            a = random.randint(-o, o)  # x position of the hill
+            b = random.randint(-o, o)  # z position of the hill
+            c = -1  # base of the hill
+            h = random.randint(1, 6)  # height of the hill
+            s = random.randint(4, 8)  # 2 * s is the side length of the hill
+            d = 2  # how quickly to taper off the hills
+            t = GRASS
+            for y in xrange(c, c + h):
+                for x in xrange(a - s, a + s + 1):
+                    for z in xrange(b - s, b + s + 1):
+                        if (x - a) ** 2 + (z - b) ** 2 > (s + 1) ** 2:
+                            continue
+                        if (x - 0) ** 2 + (z - 0) ** 2 < 5 ** 2:
+                            continue
+                        self.add_block((x, y, z), t, immediate=False)
+                s -= d  # decrement side length so hills taper off
+        '''
+        '''
+        for x in range(-render, render):
+            for z in range(-render, render):
+                self.load_chunk((x, z))
+                # self.unload_chunk((x, z))
+        '''
+        self.check_chunks(spawn[0], spawn[2])
+        # Wait for the chunks around the spawn point so the player has ground
+        # to stand on.
+        for key, blocks, pending in self.generator.drain(
+                block=True, retry=self.chunk_manager.needed):
+            self.insert_generated(key, blocks, pending, immediate=False)
+
+
+    
+        
+
+    def surface_height(self, x, z):
+        """ Return the height of the highest block in the column at `x`,
+        `z`, plus one, or 0 if the column is empty.
+
+        """
+        x, z = normalize((x, 0, z))[::2]
+        for y in xrange(max_build_height, -1, -1):
+            if (x, y, z) in self.world:
+                return y + 1
+        return 0
+
+    def hit_test(self, position, vector, max_distance=8):
+        """ Line of sight search from current position. If a block is
+        intersected it is returned, along with the block previously in the line
+        of sight. If no block is found, return None, None.
+
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position to check visibility from.
+        vector : tuple of len 3
+            The line of sight vector.
+        max_distance : int
+            How many blocks away to search for a hit.
+
+        """
+        block, previous, _ = raycast(self.world, position, vector, max_distance)
+        return block, previous
+
+    def add_block(self, position, block, immediate=True):
+        """ Add a block with the given `block` id and `position` to the world.
+        Only loaded chunks are edited.
+
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position of the block to add.
+        block : int
+            The id of the block, as registered in `blocks.py`.
+        immediate : bool
+            Whether or not to mark the block's section for remeshing.
+
+        """
+        if (not self.world.in_bounds(position) or
+                chunk_key(position) not in self.loaded_chunks):
+            return
+        if position in self.world:
+            self.remove_block(position, immediate)
+        self.world[position] = block
+        self.unsaved.add(chunk_key(position))
+        self.edited.add(chunk_key(position))
+        if immediate:
+            self.mark_dirty(position)
+
+    def remove_block(self, position, immediate=True):
+        """ Remove the block at the given `position`. Only loaded chunks are
+        edited.
+
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position of the block to remove.
+        immediate : bool
+            Whether or not to mark the block's section for remeshing.
+
+        """
+        if chunk_key(position) not in self.loaded_chunks:
+            return
+        del self.world[position]
+        self.unsaved.add(chunk_key(position))
+        self.edited.add(chunk_key(position))
+        if immediate:
+            self.mark_dirty(position)
+
+    def fill(self, low, high, block, mask=None, replace=None):
+        """ Set every block in the box from `low` to `high` to `block`, and
+        queue one rebuild of each affected section. Only loaded chunks are
+        edited.
+
+        Parameters
+        ----------
+        low, high : tuple of len 3
+            The (x, y, z) positions of opposite corners of the box, both
+            included.
+        block : int
+            The id of the block to write; AIR clears the box.
+        mask : array_like of bool or None
+            If given, only the blocks where `mask` is true are written.
+            Indexed by x, y, z relative to the low corner, with the shape of
+            the box.
+        replace : int or None
+            If given, only blocks that are currently `replace` are written.
+
+        Returns
+        -------
+        touched : set of tuple
+            The (x, y, z) keys of the sections that were written to.
+
+        """
+        touched = self.world.fill(low, high, block, mask, replace,
+                                  self.loaded_chunks)
+        if not touched:
+            return touched
+        # Sections next to the box may show or hide faces against it.
+        low_key = section_key([min(a, b) - 1 for a, b in zip(low, high)])
+        high_key = section_key([max(a, b) + 1 for a, b in zip(low, high)])
+        # Large edits can touch hundreds of sections, so they are rebuilt
+        # through the queue's time budget rather than all in the next frame.
+        rebuild = set(touched)
+        for x, y, z in touched:
+            self.unsaved.add((x, z))
+            self.edited.add((x, z))
+            for dx, dy, dz in FACES:
+                other = (x + dx, y + dy, z + dz)
+                if all(l <= o <= h for l, o, h in zip(low_key, other, high_key)):
+                    rebuild.add(other)
+        for key in rebuild:
+            if (key[0], key[2]) in self.shown:
+                self._enqueue(self._show_section, key)
+        return touched
+
+    def replace(self, low, high, old, new):
+        """ Turn every `old` block in the box from `low` to `high` into
+        `new`. See `fill()`.
+
+        """
+        return self.fill(low, high, new, replace=old)
+
+    def clear(self, low, high, mask=None):
+        """ Remove every block in the box from `low` to `high`. See
+        `fill()`.
+
+        """
+        return self.fill(low, high, AIR, mask)
+
+    def mark_dirty(self, position):
+        """ Mark the section containing `position` for remeshing, and the
+        sections next to it if `position` is on a section border. Usually
+        used after a block is added or removed.
+
+        """
+        x, y, z = position
+        dirty = self.dirty
+        dirty.add(section_key(position))
+        for dx, dy, dz in FACES:
+            dirty.add(section_key((x + dx, y + dy, z + dz)))
+
+    def remesh_dirty(self):
+        """ Rebuild the meshes of the shown sections marked by
+        `mark_dirty()`, once each.
+
+        """
+        dirty = self.dirty
+        self.dirty = set()
+        for key in dirty:
+            if (key[0], key[2]) in self.shown:
+                # This supersedes any rebuild still queued for the section.
+                self.queue.cancel(key)
+                self._show_section(key)
+
+    def chunk_sections(self, key):
+        """ Return the keys of the sections of the chunk at `key` that hold
+        blocks or have a mesh.
+
+        """
+        x, z = key
+        chunk = self.world.chunks.get(key)
+        return [
+            (x, cy, z) for cy in range(SECTIONS)
+            if (chunk is not None and chunk.sections[cy] is not None) or
+            (x, cy, z) in self._shown
+        ]
+
+    def refresh_neighbors(self, key):
+        """ Queue a rebuild of the shown chunks around chunk `key`, so faces
+        on their shared border are culled or uncovered.
+
+        """
+        x, z = key
+        for other in ((x - 1, z), (x + 1, z), (x, z - 1), (x, z + 1)):
+            if other in self.shown:
+                for section in self.chunk_sections(other):
+                    self._enqueue(self._show_section, section)
+
+    def show_chunk(self, key, immediate=True):
+        """ Show the chunk with the given (x, z) `key`.
+
+        Parameters
+        ----------
+        key : tuple of len 2
+            The (x, z) key of the chunk to show.
+        immediate : bool
+            Whether or not to build the section meshes immediately.
+
+        """
+        self.shown.add(key)
+        self._hide_lod(key)
+        for section in self.chunk_sections(key):
+            if immediate:
+                self._show_section(section)
+            else:
+                self._enqueue(self._show_section, section)
+
+    def _show_section(self, key):
+        """ Replace the mesh of the section at (x, y, z) `key` with a freshly
+        built one. Sections that are all air or buried get no mesh.
+
+        """
+        self._hide_section(key)
+        self._occlusion_dirty = True
+        if (key[0], key[2]) not in self.shown:
+            return
+        section = self.world.section(key)
+        if section is None or self.world.is_buried(key):
+            return
+        # Computed here so that it is spread over the queue rather than
+        # done all at once by the next `visible_meshes()`.
+        section_connectivity(section)
+        if self.greedy:
+            vertex_data, texture_data = build_greedy_mesh(self.world, key)
+        else:
+            vertex_data, texture_data = build_section_mesh(self.world, key)
+        count = len(vertex_data) // 12
+        if not count:
+            return
+        self.renderer.add_mesh(key, vertex_data, texture_data, self.greedy)
+        self._shown[key] = count
+        self.face_count += count
+
+    def set_greedy(self, greedy):
+        """ Switch between greedy and naive meshing and rebuild all shown
+        chunks.
+
+        Returns
+        -------
+        stats : dict
+            The triangle count of the shown chunks with each kind of meshing.
+
+        """
+        self.greedy = greedy
+        for key in self.shown:
+            for section in self.chunk_sections(key):
+                self._enqueue(self._show_section, section)
+        return mesh_stats(self.world, self.shown)
+
+    def hide_chunk(self, key, immediate=True):
+        """ Hide the chunk with the given (x, z) `key`. Hiding does not remove
+        its blocks from the world.
+
+        Parameters
+        ----------
+        key : tuple of len 2
+            The (x, z) key of the chunk to hide.
+        immediate : bool
+            Whether or not to immediately remove the chunk from the canvas.
+
+        """
+        self.shown.discard(key)
+        for section in self.chunk_sections(key):
+            if immediate:
+                self._hide_section(section)
+            else:
+                self._enqueue(self._hide_section, section)
+        if key in self.lod_manager.needed:
+            self._enqueue_lod(self._show_lod, key)
+
+    def _hide_section(self, key):
+        """ Remove the mesh of the section at (x, y, z) `key`, if it has one.
+
+        """
+        count = self._shown.pop(key, None)
+        if count is not None:
+            self.face_count -= count
+            self.renderer.remove_mesh(key)
+
+    def _show_lod(self, key):
+        """ Show a level of detail mesh for the chunk at (x, z) `key`, unless
+        the chunk itself is shown or out of range.
+
+        """
+        self._hide_lod(key)
+        if key in self.shown or key not in self.lod_manager.needed:
+            return
+        vertex_data, texture_data, top = build_lod_mesh(self.generator.settings, key)
+        count = len(vertex_data) // 12
+        self.renderer.add_mesh(key, vertex_data, texture_data, True)
+        self._lod[key] = (count, top)
+        self.lod_face_count += count
+
+    def _hide_lod(self, key):
+        """ Remove the level of detail mesh of the chunk at (x, z) `key`, if
+        it has one.
+
+        """
+        self.queue.cancel(('lod',) + key)
+        entry = self._lod.pop(key, None)
+        if entry is not None:
+            self.lod_face_count -= entry[0]
+            self.renderer.remove_mesh(key)
+
+    def visible_meshes(self, frustum, camera=None):
+        """ Return the keys of the shown section and level of detail meshes
+        that are at least partly inside `frustum`, and count how many were
+        culled.
+
+        Parameters
+        ----------
+        frustum : Frustum
+            The volume seen by the camera.
+        camera : tuple of len 3 or None
+            The position of the camera. If given, sections that terrain hides
+            from it are culled as well.
+
+        """
+        keys = list(self._shown)
+        lod = list(self._lod)
+        self.occluded = 0
+        if not keys and not lod:
+            self.drawn = self.culled = 0
+            return keys
+        low, high = section_bounds(keys)
+        if lod:
+            lod_low, lod_high = section_bounds([(x, 0, z) for x, z in lod])
+            lod_high[:, 1] = [self._lod[key][1] - 0.5 for key in lod]
+            low = np.concatenate([low, lod_low])
+            high = np.concatenate([high, lod_high])
+        visible = frustum.test_boxes(low, high).tolist()
+        lod = [key for key, inside in zip(lod, visible[len(keys):]) if inside]
+        keys = [key for key, inside in zip(keys, visible) if inside]
+        self.culled = len(visible) - len(keys) - len(lod)
+        if camera is not None:
+            start = section_key(normalize(camera))
+            if self._occlusion_dirty or start != self._reachable_from:
+                self.reachable = reachable_sections(self.world, start, self.shown)
+                self._reachable_from = start
+                self._occlusion_dirty = False
+            reachable = self.reachable
+            count = len(keys)
+            keys = [key for key in keys if key in reachable]
+            self.occluded = count - len(keys)
+        keys.extend(lod)
+        self.drawn = len(keys)
+        return keys
+
+    def show_sector(self, sector):
+        """ Ensure the chunk of the given sector is drawn to the canvas.
+
+        """
+        key = (sector[0], sector[2])
+        if key not in self.shown and key in self.world.chunks:
+            self.show_chunk(key, False)
+
+    def hide_sector(self, sector):
+        """ Ensure the chunk of the given sector is removed from the canvas.
+
+        """
+        key = (sector[0], sector[2])
+        if key in self.shown:
+            self.hide_chunk(key, False)
+
+    def change_sectors(self, before, after):
+        """ Move from sector `before` to sector `after`. A sector is a
+        contiguous x, y sub-region of world. Sectors are used to speed up
+        world rendering.
+
+        """
+        before_set = set()
+        after_set = set()
+        pad = 4
+        for dx in xrange(-pad, pad + 1):
+            for dy in [0]:  # xrange(-pad, pad + 1):
+                for dz in xrange(-pad, pad + 1):
+                    if dx ** 2 + dy ** 2 + dz ** 2 > (pad + 1) ** 2:
+                        continue
+                    if before:
+                        x, y, z = before
+                        before_set.add((x + dx, y + dy, z + dz))
+                    if after:
+                        x, y, z = after
+                        after_set.add((x + dx, y + dy, z + dz))
+        show = after_set - before_set
+        hide = before_set - after_set
+        for sector in show:
+            self.show_sector(sector)
+        for sector in hide:
+            self.hide_sector(sector)
+
+    def _enqueue(self, func, key):
+        """ Add a call of `func` for the section at `key` to the internal
+        queue, replacing any call already queued for that section.
+
+        """
+        x, y, z = key
+        position = ((x + 0.5) * CHUNK_SIZE, (y + 0.5) * SECTION_SIZE,
+                    (z + 0.5) * CHUNK_SIZE)
+        self.queue.submit(key, func, (key,), position)
+
+    def _enqueue_lod(self, func, key):
+        """ Add a call of `func` for the level of detail mesh of the chunk at
+        (x, z) `key` to the internal queue.
+
+        """
+        x, z = key
+        position = ((x + 0.5) * CHUNK_SIZE, None, (z + 0.5) * CHUNK_SIZE)
+        self.queue.submit(('lod',) + key, func, (key,), position)
+
+    def process_queue(self):
+        """ Process the queue, nearest chunks first, for as long as the
+        queue's frame budget allows. This allows the game loop to run
+        smoothly. The queue contains calls to _show_section() and _hide_section()
+        so this method should be called if show_chunk() or hide_chunk() was
+        called with immediate=False. Sections dirtied by edits are rebuilt
+        first.
+
+        """
+        self.remesh_dirty()
+        self.queue.run()
+
+    def process_entire_queue(self):
+        """ Process the entire queue with no breaks.
+
+        """
+        self.remesh_dirty()
+        self.queue.run_all()